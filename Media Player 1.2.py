@@ -1,14 +1,361 @@
+import time
+START_TIME = time.perf_counter()    #Reference point for the startup timing report, taken before anything else is imported
+
 import os
 import sys
 import contextlib
+import threading
+import sqlite3
+import queue
+import itertools
+import math
+import bisect
+import select
+import struct
+import ctypes
+import socket
+import json
+import random
+import re
+import heapq
+import hashlib
+import wave
+import io
+import base64
+import types
+import importlib.util
+import inspect
+import importlib.machinery
+import concurrent
+from array import array
+from collections import Counter, OrderedDict, deque
+
+class LazyModule(types.ModuleType):                 #Stand-in for a module that is only executed on first attribute access -- keeps modules the first track doesn't need off the startup path
+    def __init__(self, spec):
+        super().__init__(spec.name)
+        self.__spec__ = spec                            #A real spec (not initializing), so import statements naming the module take it as already loaded
+
+    def __getattr__(self, attribute):                   #Only reached for attributes not yet copied in, i.e. before the module has run (or ones it makes up on demand)
+        spec = self.__spec__
+        module = sys.modules.get(spec.name)
+        if module is self:
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[spec.name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                sys.modules[spec.name] = self
+                raise
+
+            (parent, _, child) = spec.name.rpartition('.')
+            if parent in sys.modules:
+                setattr(sys.modules[parent], child, module)
+            self.__dict__.update(module.__dict__)
+
+        return getattr(module, attribute)
+
+def lazy_import(name, search_path=None):        #Register a LazyModule for a module (found on search_path for a submodule of a package not imported yet), returns None if it isn't installed
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.machinery.PathFinder.find_spec(name, search_path) if search_path else importlib.util.find_spec(name)
+    if spec is None:
+        return None
+
+    module = sys.modules[name] = LazyModule(spec)
+    (parent, _, child) = name.rpartition('.')
+    if parent in sys.modules:
+        setattr(sys.modules[parent], child, module)
+    return module
 
+asyncio = lazy_import('asyncio')            #Pulls in ssl, only the main loop needs it and that starts after the first track
+multiprocessing = lazy_import('multiprocessing')
+lazy_import('concurrent.futures')
+numpy = lazy_import('numpy')                #Optional, only the waveform seekbar, spectrum and loudness analysis need it
+
+pygame_path = importlib.util.find_spec('pygame').submodule_search_locations
+pygame_lazy_modules = {name: lazy_import('pygame.' + name, pygame_path) for name in ('surfarray', 'sndarray', 'pkgdata')}       #Submodules pygame imports eagerly, between them NumPy and pkg_resources are most of its import time
 import pygame
+for name, module in pygame_lazy_modules.items():                #Already in sys.modules when pygame imported them, so they were never bound on the package
+    if module:
+        setattr(pygame, name, module)
 import vlc
 
 
 
 WINDOW_WIDTH = 1000                 #Window size constants
 WINDOW_HEIGHT = 500
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))            #Directory holding config.txt and the other files the player keeps between runs
+LIBRARY_INDEX_FILE = 'library.db'
+SESSION_FILE = 'session.json'       #Track, position, volume, queue and shuffle saved for the next launch
+CONTROL_SOCKET = os.path.join(CONFIG_DIR, 'control.sock')        #Unix socket for the JSON-RPC control API and the --ctl client
+CONTROL_PUBLISH_HZ = 10             #Most status pushes a second, a change inside that window goes out when it ends
+CONTROL_DRAIN_SECONDS = 2           #A subscriber that hasn't taken a push in this long is disconnected
+SUPPORTED_EXTENSIONS = ('.wav', '.mp3', '.ogg')
+TEXT_CACHE_SIZE = 256               #Max rendered text surfaces kept by the shared text cache
+LAYOUT_CACHE_SIZE = 8               #Window sizes whose computed layout is kept
+RESIZE_SETTLE_MS = 150              #Window size has to hold still this long before a full relayout, until then the last frame is scaled to fit
+
+ACTIVE_FPS = 30                     #Frame cap while something is animating (drags)
+IDLE_TICK_MS = 1000                 #Slowest wakeup while playing, enough to keep the time display ticking
+INPUT_POLL_MS = 10                  #How often pygame is polled for input right after the user did something, only where SDL can't be waited on from a thread
+INPUT_IDLE_POLL_MS = 50             #Slower polling once input has been quiet for INPUT_IDLE_AFTER_MS
+INPUT_IDLE_AFTER_MS = 2000
+INPUT_WAKE_EVENT = pygame.USEREVENT + 11            #Posted to release the input thread from its wait, dropped unseen
+INPUT_RELEASE_TIMEOUT_MS = 500      #Longest the loop waits for the input thread to come out of SDL, after that it gives up on the thread and polls
+PLAYER_EVENT = pygame.USEREVENT + 2 #Posted from libvlc's event thread to wake the main loop on playback state changes
+METADATA_EVENT = pygame.USEREVENT + 3               #Posted by metadata workers when parsed results are waiting
+METADATA_WORKERS = 4                #Threads parsing durations and tags in the background
+UNKNOWN_DURATION = -1.0             #Duration stored for tracks that parsed but that libvlc couldn't time, so they aren't parsed again every startup
+LIBRARY_EVENT = pygame.USEREVENT + 4                #Posted by the directory watcher when a batch of file changes is ready
+CONTROL_EVENT = pygame.USEREVENT + 5                #Posted after a control command so the next frame shows its effect
+WAVEFORM_EVENT = pygame.USEREVENT + 6               #Posted when a waveform finishes analysis so the seekbar picks it up
+LOUDNESS_EVENT = pygame.USEREVENT + 7               #Posted when loudness results are waiting
+WAVEFORM_DIR = os.path.join(CONFIG_DIR, 'waveforms')             #On-disk waveform cache, one small .npy per file identity
+WAVEFORM_BINS = 1024                #Envelope columns stored per track, resampled to the seekbar width when drawn
+WAVEFORM_WORKERS = 2                #Processes decoding and reducing audio for waveforms
+WAVEFORM_SAMPLE_RATE = 22050        #Decode rate for compressed files, plenty for an envelope
+WAVEFORM_MEMORY = 16                #Envelopes kept mapped in memory
+LOUDNESS_MODES = ('off', 'track', 'album')         #Normalization modes cycled through by the N key
+LOUDNESS_MODE = 'track'             #Default normalization mode
+LOUDNESS_TARGET_LUFS = -18.0        #Integrated loudness every track (or album) is brought to, the ReplayGain 2 reference level
+LOUDNESS_MAX_BOOST_DB = 10.0        #Most a quiet track is raised, it's also held back so its peak doesn't clip
+LOUDNESS_WORKERS = 1                #Analysis processes, niced so playback and the UI never wait on them
+LOUDNESS_IN_FLIGHT = 2              #Tracks handed to the pool at once, the rest wait in order so current and next can jump the queue
+LOUDNESS_SAMPLE_RATE = 44100        #Decode format for compressed files, stereo
+LOUDNESS_APPLY_BATCH = 2000         #Results applied per main loop wakeup
+ART_EVENT = pygame.USEREVENT + 8    #Posted when cover art finishes loading
+ERROR_EVENT = pygame.USEREVENT + 9  #Posted when an error toast is added so it shows without waiting for the next tick
+ERROR_TOASTS = 4                    #Most error toasts stacked at once
+ERROR_TOAST_SECONDS = 6             #How long a non-fatal toast stays up after its last repeat
+ERROR_RATE = 2                      #New error messages shown per second once the burst allowance is used up
+ERROR_BURST = 4
+ART_DIR = os.path.join(CONFIG_DIR, 'art')                        #On-disk thumbnail cache, one small PNG per file identity and size (empty for tracks with no art)
+ART_WORKERS = 2                     #Threads extracting, decoding and scaling cover art
+ART_MEMORY = 8 * 1024 * 1024        #Bytes of converted art surfaces kept in memory
+ART_FOLDER_NAMES = ('folder', 'cover', 'front', 'album')        #Image names looked for beside a track with no embedded art, by priority
+ART_MAX_BYTES = 16 * 1024 * 1024    #Largest tag or picture read looking for art
+MAX_PLAYER_VOLUME = 200             #libvlc volume ceiling, above 100 is software gain
+SPECTRUM_RATE = 44100               #PCM format tapped for the spectrum visualizer, mono
+SPECTRUM_FFT_SIZE = 2048            #Samples per FFT, about 46 ms at SPECTRUM_RATE
+SPECTRUM_BANDS = 48                 #Bars drawn when within budget, halved down to SPECTRUM_MIN_BANDS when over it
+SPECTRUM_MIN_BANDS = 12
+SPECTRUM_BUDGET_MS = 2.0            #Most a frame may spend on spectrum analysis before it degrades
+SPECTRUM_LEAD_MS = 250              #How far ahead of the audible player the analysis player is started, so the samples at the audible position are already in the ring
+SPECTRUM_RING_MS = 2000             #PCM history kept for the analysis, the analysis player is only re-seeked when the audible position falls outside it
+WATCH_DEBOUNCE_MS = 250             #Quiet period before a batch of file changes is applied
+WATCH_MAX_DELAY_MS = 1000           #Longest a steady stream of changes (e.g. rsync) can hold a batch back
+WATCH_POLL_MS = 1000                #Listing interval where inotify isn't available
+SEARCH_RESULTS = 8                  #Results shown in the search overlay
+SEARCH_MATCH_RATIO = 0.5            #Share of query trigrams a track needs to match to be a result
+SEARCH_POSTINGS_BUDGET = 15000      #Most posting entries counted per query, the rarest trigrams are counted first and common ones left to verification
+SEARCH_CANDIDATES = 300             #Most candidates (highest counts first) verified against the full query
+SEARCH_LATENCY_MS = 10              #Query time the search benchmark holds the index to
+SEARCH_DEBOUNCE_MS = 60             #Typing pause before a query is run
+SEARCH_EVENT = pygame.USEREVENT + 10                #Posted when a query run on a worker has results
+SEARCH_INDEX_BUDGET_MS = 8          #Time per main loop wakeup spent catching the search index up, so building it never drops frames
+SESSION_SAVE_DELAY_MS = 2000        #Quiet period before a changed session is written
+SESSION_MAX_DELAY_MS = 10000        #Longest a steady stream of changes can hold a write back
+SESSION_POSITION_STEP_MS = 10000    #Playback moving less than this since the last save doesn't count as a change, a clean quit saves the exact position
+DEFAULT_VOLUME = 25                 #Volume when there's no saved session
+
+GAPLESS = True                      #Buffer the next track on a standby player and hand over without silence
+GAPLESS_LEAD_MS = 1500              #How close to the end of a track the handover timer is armed
+GAPLESS_OVERLAP_MS = 30             #Start the next track this early to cover the new player's output startup
+GAPLESS_MAX_GAP_MS = 10             #Most silence the gapless benchmark accepts between the end of one track's audio and the start of the next
+CROSSFADE_SECONDS = 0               #Default crossfade length, 0 is a plain (gapless) cut
+CROSSFADE_STEPS = (0, 2, 4, 6, 8, 10, 12)           #Crossfade lengths cycled through by the C key
+FADE_STEP_MS = 20                   #Volume ramp update interval
+SEEK_MIN_INTERVAL_MS = 50           #Fastest live scrubbing sends seeks to libvlc, each one also waits for the last to land
+SEEK_TIMEOUT_MS = 300               #Longest a scrub seek waits to land before the next is sent anyway (paused players may never report)
+SEEK_TOLERANCE_MS = 500             #How close libvlc's reported time has to be to the target for a seek to count as landed
+PROFILE_HISTORY = 60                #Frames averaged by the profiler overlay
+FRAME_BUDGET_MS = 1000 / ACTIVE_FPS                 #Frames slower than this are logged while profiling
+PROFILE_VLC_CALLS = ('play', 'stop', 'set_pause', 'set_media', 'get_state', 'get_time', 'set_time', 'get_length', 'get_position', 'set_position',
+                     'is_playing', 'audio_get_volume', 'audio_set_volume')            #libvlc MediaPlayer methods timed as the vlc section
+HEADLESS = False                    #No display or sound card needed, set by --headless (and the frame benchmark) through headless_init
+
+class TextCache:                                #Bounded LRU cache of rendered text surfaces, shared by everything that draws text
+    def __init__(self, max_entries=TEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.surfaces = OrderedDict()                   #Format of {(font, text, color, antialias): surface}, oldest first
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color, antialias=True):       #Drop-in for font.render(), only rasterizes text not seen recently
+        key = (font, text, tuple(color), antialias)
+        surface = self.surfaces.get(key)
+
+        if surface is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.max_entries:           #Evict least recently used
+            self.surfaces.popitem(last=False)
+        return surface
+
+    def clear(self):                                        #Drop all cached surfaces, counters are kept
+        self.surfaces.clear()
+
+    def stats(self):                                        #Returns a dictionary of cache counters
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.surfaces),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0
+        }
+
+text_cache = TextCache()
+
+fonts = {}                          #Format of {(name, size): font}, shared by everything that draws text
+
+def load_font(name, size):                      #SysFont looks the name up and opens the file on every call, this does it once per name and size
+    font = fonts.get((name, size))
+    if font is None:
+        font = fonts[(name, size)] = pygame.font.SysFont(name, size)
+    return font
+
+def preload_fonts():                            #Load the UI's fonts, run on a thread at startup while libvlc initializes
+    try:
+        pygame.font.init()
+        for size in (24, 16):
+            load_font('Comic Sans', size)
+    except Exception as error:
+        print("Font preload failed: " + str(error))
+
+class Profiler:                                 #Per-frame timings of the main loop's hot sections -- call sites are swapped for timed wrappers only while enabled, so when off it costs nothing
+    SECTIONS = ('frame', 'events', 'update', 'progress', 'text', 'vlc', 'flip')
+
+    def __init__(self):
+        self.enabled = False
+        self.hooks = []                                 #Format of [(target, attribute, original)], undone on disable
+        self.current = dict.fromkeys(self.SECTIONS, 0.0)            #Seconds spent per section in the frame being run, sections nest (frame includes everything, update includes text and flip)
+        self.history = deque(maxlen=PROFILE_HISTORY)    #Format of [{section: ms}] per frame
+        self.lines = []                                 #Overlay text, refreshed a few times a second so it can be read
+
+    def call_sites(self):                               #Returns list of (target, attribute, section) to instrument, targets are modules, classes or a globals dict
+        call_sites = [
+            (globals(), 'run_frame', 'frame'),
+            (globals(), 'handle_event', 'events'),
+            (MediaPlayer, 'update', 'update'),
+            (MediaPlayer, 'progress', 'progress'),
+            (TextCache, 'render', 'text'),
+            (pygame.display, 'flip', 'flip'),
+            (pygame.display, 'update', 'flip'),
+        ]
+        call_sites.extend((vlc.MediaPlayer, name, 'vlc') for name in PROFILE_VLC_CALLS if hasattr(vlc.MediaPlayer, name))
+        return call_sites
+
+    def instrument(self, target, attribute, section):               #Replace a function with a wrapper adding its run time to a section
+        original = target[attribute] if isinstance(target, dict) else getattr(target, attribute)
+        current = self.current
+        perf_counter = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                current[section] += perf_counter() - start
+
+        if isinstance(target, dict):
+            target[attribute] = timed
+        else:
+            setattr(target, attribute, timed)
+        self.hooks.append((target, attribute, original))
+
+    def toggle(self):                                   #Turn profiling on or off, returns the new state
+        if self.enabled:
+            for target, attribute, original in reversed(self.hooks):
+                if isinstance(target, dict):
+                    target[attribute] = original
+                else:
+                    setattr(target, attribute, original)
+            self.hooks = []
+            self.history.clear()
+            self.lines = []
+        else:
+            for target, attribute, section in self.call_sites():
+                self.instrument(target, attribute, section)
+
+        self.enabled = not self.enabled
+        return self.enabled
+
+    def frame_end(self):                                #Close out a frame -- store its timings, log it if it blew the budget, refresh the overlay text now and then
+        frame = {section: seconds * 1000 for section, seconds in self.current.items()}
+        for section in self.current:
+            self.current[section] = 0.0
+        self.history.append(frame)
+
+        if frame['frame'] > FRAME_BUDGET_MS:
+            print(f"Slow frame {frame['frame']:.1f} ms: " + ", ".join(f"{section} {frame[section]:.1f}" for section in self.SECTIONS[1:]), file=sys.stderr)
+
+        if len(self.history) % (PROFILE_HISTORY // 4) == 0 or not self.lines:
+            self.lines = [f"{'ms/frame':<9}{'avg':>7}{'max':>7}"]
+            for section in self.SECTIONS:
+                timings = [frame[section] for frame in self.history]
+                self.lines.append(f"{section:<9}{sum(timings) / len(timings):7.2f}{max(timings):7.2f}")
+
+profiler = Profiler()
+
+class StartupTimer:                             #Phase marks in ms from process start, reported once the first track is audible and the first frame is up
+    def __init__(self):
+        self.marks = {}                                 #Format of {phase: ms since START_TIME}, in the order reached
+        self.reported = False
+
+    def mark(self, phase):                              #Record the first time a phase is reached, later calls are ignored -- safe from any thread
+        self.marks.setdefault(phase, round((time.perf_counter() - START_TIME) * 1000, 2))
+
+    def done(self):                                     #True once there is something to report -- first audio and first frame, or just the frame if nothing is playing
+        return 'first_frame' in self.marks and ('first_audio' in self.marks or 'play' not in self.marks)
+
+    def report(self):                                   #Returns a dictionary of phase end times and durations in ms
+        durations = {}
+        previous = 0
+        for phase, end in sorted(self.marks.items(), key=lambda item: item[1]):
+            durations[phase] = round(end - previous, 2)
+            previous = end
+        return {'marks': dict(self.marks), 'phases': durations}
+
+    def summary(self):                                  #One line report for the console
+        phases = ', '.join(f"{phase} {duration:.0f}" for phase, duration in self.report()['phases'].items())
+        first_audio = self.marks.get('first_audio')
+        return f"Startup: first audio {'-' if first_audio is None else f'{first_audio:.0f} ms'}, first frame {self.marks.get('first_frame', 0):.0f} ms ({phases} ms)"
+
+startup = StartupTimer()
+STARTUP_REPORT = False              #Set by --startup-report, print the startup report as JSON and exit once it's complete (used by the startup benchmark)
+STARTUP_REPORT_TIMEOUT_MS = 10000   #Report without first audio if it hasn't come this long after the first frame
+STARTUP_REGRESSION = 0.2            #Startup benchmark flags a mark more than this share slower than the baseline
+STARTUP_NOISE_MS = 5                #...and more than this many ms slower, so tiny phases don't trip it on jitter
+
+event_scheduler = None              #FrameScheduler running the asyncio main loop, events posted from other threads go straight to it
+
+def post_event(event_type, **attributes):       #Thread-safe way to wake the main loop from other threads, safe to call before/after the display or event loop exists
+    event = pygame.event.Event(event_type, attributes)
+    if event_scheduler is not None:
+        event_scheduler.post(event)
+        return
+
+    try:
+        pygame.event.post(event)
+    except pygame.error:
+        pass
+
+def run_background(function, *args):            #Run blocking work off the main thread, on the event loop's executor once it runs, otherwise a daemon thread
+    if event_scheduler is not None and event_scheduler.loop is not None:        #Checked first so startup work doesn't import asyncio just to find there's no loop yet
+        return event_scheduler.loop.run_in_executor(None, function, *args)
+    threading.Thread(target=function, args=args, daemon=True).start()
+
+def headless_init():                            #Switch SDL to its dummy video and audio drivers and VLC to its dummy audio output, must run before the player is created
+    global HEADLESS
+    HEADLESS = True
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
 
 class Button:                                   #Button class, takes configs from inits in other classes or set by defaults
     def __init__(self, config):
@@ -19,7 +366,7 @@ class Button:                                   #Button class, takes configs fro
 
         self.label = config.get('label', 'Click')
         self.label_color = (255, 255, 255)
-        self.font = pygame.font.SysFont('Comic Sans', 16)
+        self.font = load_font('Comic Sans', 16)
 
         text_size = self.font.size(self.label)          #Size(x) returns a tuple of width, height, so we use text_size to index them.
         self.width = text_size[0] + 20
@@ -34,21 +381,26 @@ class Button:                                   #Button class, takes configs fro
 
         self.onClick = config.get('onClick', lambda: None)
 
-    def draw(self, surface):                        #Personal draw function
-        mouse_pos = pygame.mouse.get_pos()
-        color = self.hover_color if self.check_mouse(mouse_pos) else self.color
+    def draw(self, surface, hovered=None):          #Personal draw function, hover state can be passed in when already known
+        if hovered is None:
+            hovered = self.check_mouse(pygame.mouse.get_pos())
+        color = self.hover_color if hovered else self.color
 
         pygame.draw.rect(surface, color, self.rect)
 
-        text_surface = self.font.render(self.label, True, self.label_color)
+        text_surface = text_cache.render(self.font, self.label, self.label_color)
         text_rect = text_surface.get_rect(center=self.rect.center)
         surface.blit(text_surface, text_rect)
 
     def check_mouse(self, mouse_pos):                #Checks if mouse is hovering over button
         return self.rect.collidepoint(mouse_pos)
 
-    def handle_click(self):                          #Checks if mouse is clicking on button
-        if self.check_mouse(pygame.mouse.get_pos()):
+    def move(self, center):                          #Re-center the button after a relayout, label and size are kept
+        (self.center_x, self.center_y) = center
+        self.rect.center = (self.center_x, self.center_y)
+
+    def handle_click(self, mouse_pos):               #Checks if mouse is clicking on button, position comes from the click event
+        if self.check_mouse(mouse_pos):
             self.onClick()
 
 class DragButton:                       #Parallel class to Button, but for drag buttons
@@ -69,6 +421,14 @@ class DragButton:                       #Parallel class to Button, but for drag
         color = self.dragging_color if self.being_dragged else self.color
         pygame.draw.circle(surface, color, (self.center_x, self.center_y + (self.radius//2)), self.radius)
 
+    def get_rect(self):                         #Bounding rect of the drawn circle, used for dirty region tracking
+        return pygame.Rect(
+            self.center_x - self.radius,
+            self.center_y + (self.radius//2) - self.radius,
+            self.radius * 2 + 1,
+            self.radius * 2 + 1
+        )
+
     def check_mouse(self, mouse_pos):               #Checks if mouse is hovering over button
         return ((mouse_pos[0] - self.center_x) ** 2 + (mouse_pos[1] - self.center_y) ** 2) <= (self.radius ** 2)
 
@@ -98,52 +458,414 @@ class DragButton:                       #Parallel class to Button, but for drag
         if self.being_dragged == False:
             self.center_x = self.min_x + (self.max_x - self.min_x) * position_percent
 
-class AudioManager:                             #Class to handle vlc media playback and volume
-    def __init__(self):                                 #Initialize VLC and player, set default volume
+    def set_track(self, min_x, max_x, y):               #Move the bar the button slides along after a relayout, keeping its position along it
+        position_percent = (self.center_x - self.min_x) / (self.max_x - self.min_x)
+        (self.min_x, self.max_x, self.center_y) = (min_x, max_x, y)
+        self.center_x = min_x + (max_x - min_x) * position_percent
+
+class PlayerState:                              #Thread-safe snapshot of playback state, written by libvlc event callbacks and read by the render loop without crossing into libvlc
+    def __init__(self, volume):
+        self.lock = threading.Lock()
+        self.state = vlc.State.NothingSpecial
+        self.time = 0                                   #Elapsed and total time in ms, as last reported by libvlc
+        self.time_at = time.monotonic()                 #When time was last written, lets readers interpolate between libvlc's reports
+        self.length = 0
+        self.volume = volume
+        self.ended = False                              #Set when the current track reaches its end, cleared once the main loop acts on it
+        self.handed_over = False                        #Set when the standby player took over at the end of a track, cleared once the main loop acts on it
+        self.error = None
+
+    def update(self, **changes):                        #Apply several fields at once so readers never see a half-written update
+        with self.lock:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            if 'time' in changes:
+                self.time_at = time.monotonic()
+
+    def current_time(self):                             #Elapsed ms now, interpolated from the last report while playing
+        with self.lock:
+            if self.state != vlc.State.Playing:
+                return self.time
+            return self.time + (time.monotonic() - self.time_at) * 1000
+
+    def get_progress(self):                             #Returns tuple of current time and total time in seconds, (0, 0) when nothing is loaded
+        with self.lock:
+            if self.state not in [vlc.State.Playing, vlc.State.Paused] or self.length <= 0:
+                return (0, 0)
+            return (self.time / 1000, self.length / 1000)
+
+    def take_ended(self):                               #Returns and clears the ended flag in one step so a track end is only acted on once
+        with self.lock:
+            ended = self.ended
+            self.ended = False
+            return ended
+
+    def take_handed_over(self):                         #Returns and clears the handover flag in one step
+        with self.lock:
+            handed_over = self.handed_over
+            self.handed_over = False
+            return handed_over
+
+    def take_error(self):                               #Returns and clears the last playback error
+        with self.lock:
+            error = self.error
+            self.error = None
+            return error
+
+class AudioManager:                             #Class to handle vlc media playback and volume -- owns two players so the next track can be buffered on the standby one
+    def __init__(self, volume=DEFAULT_VOLUME):          #Initialize VLC and players, set starting volume, hook up libvlc events
+        self.state = PlayerState(volume)
+        self.current_path = None
+        self.lock = threading.RLock()                   #Guards player swaps between the main thread and the handover timer
+
+        self.gapless = GAPLESS
+        self.crossfade = CROSSFADE_SECONDS
+        self.preloaded_path = None                      #Track buffered and paused on the standby player
+        self.preload_ready = False
+        self.fading = False                             #True while the standby player is fading out under the active one
+        self.fade_generation = 0                        #Bumped to cancel a running fade thread
+        self.deferred_preload = None                    #Preload requested mid fade or while the handed over track plays out, run once the standby player is free
+        self.handover_timer = None
+        self.handover_pending = False                   #True between an automatic handover and both of its gap timestamps arriving
+        self.handover_start = None                      #Monotonic times of the new track reporting playing and the old track ending, used to measure the gap
+        self.handover_end = None
+        self.last_gap_ms = None                         #Positive is silence between tracks, negative is overlap
+        self.normalization = LOUDNESS_MODE
+        self.gain_lookup = None                         #Callable of (path, mode) returning a normalization gain in dB, set by the playlist
+        self.player_gain = {}                           #Format of {player: linear gain} for the track each player holds, state.volume stays the user's volume
+        self.seek_condition = threading.Condition()     #Guards the scrub target and wakes the seek thread
+        self.seek_target = None                         #Newest scrub position in ms not yet sent to libvlc, each new one replaces it
+        self.seek_generation = 0                        #Bumped by anything that makes a queued or in-flight scrub stale (track change, stop, final seek)
+        self.seek_pending = None                        #Target of the seek in flight, cleared by the time event that shows it landed
+        self.seek_landed = threading.Event()
+        self.seek_thread = None                         #Started on the first scrub
+        self.seeks_sent = 0
+        self.last_seek_ms = None                        #Time from sending the last scrub seek to libvlc reporting it landed
+
         try:
-            self.instance = vlc.Instance('--quiet', '--no-video', '--no-video-title-show')
+            self.instance = vlc.Instance('--quiet', '--no-video', '--no-video-title-show', *(['--aout=dummy'] if HEADLESS else []))
             self.player = self.instance.media_player_new()
+            self.standby = self.instance.media_player_new()
             
-            self.player.audio_set_volume(25)
+            self.player.audio_set_volume(self.scaled_volume(self.player))
+            self.events_init(self.player)
+            self.events_init(self.standby)
         except Exception as error:
             print("VLC initialization failed: " + str(error))
 
-    def play(self, track_path):                         #Store volume, create new media object and send to player, play and set volume
+    def events_init(self, player):                      #Attach libvlc event callbacks -- these run on libvlc's own thread, so they only write the state snapshot, arm timers and wake the main loop
+        event_manager = player.event_manager()
+        events = {
+            vlc.EventType.MediaPlayerOpening: lambda event: self.state.update(state=vlc.State.Opening),
+            vlc.EventType.MediaPlayerPlaying: lambda event: self.state.update(state=vlc.State.Playing),
+            vlc.EventType.MediaPlayerPaused: lambda event: self.state.update(state=vlc.State.Paused),
+            vlc.EventType.MediaPlayerStopped: lambda event: self.state.update(state=vlc.State.Stopped, time=0),
+            vlc.EventType.MediaPlayerEndReached: lambda event: self.state.update(state=vlc.State.Ended, ended=True),
+            vlc.EventType.MediaPlayerEncounteredError: lambda event: self.state.update(state=vlc.State.Error, error="Playback error: " + os.path.basename(self.current_path or "")),
+            vlc.EventType.MediaPlayerLengthChanged: lambda event: self.state.update(length=event.u.new_length)
+        }
+
+        for event_type, callback in events.items():
+            event_manager.event_attach(event_type, self.on_state_event, callback, player)
+
+        event_manager.event_attach(vlc.EventType.MediaPlayerTimeChanged, self.on_time_changed, player)        #Time changes are frequent, the main loop's own timer picks them up
+
+    def on_state_event(self, event, callback, player):  #Apply a state change from the active player and wake the main loop so transitions happen immediately
+        if player is not self.player:                   #Standby player only reports buffering done, or the end of the track it just handed over from
+            if event.type == vlc.EventType.MediaPlayerPaused and self.preloaded_path:
+                self.preload_ready = True
+            elif event.type in (vlc.EventType.MediaPlayerEndReached, vlc.EventType.MediaPlayerStopped) and self.handover_pending and self.handover_end is None:
+                self.handover_end = time.monotonic()
+                self.measure_gap()
+                post_event(PLAYER_EVENT)                #The main loop runs the preload held back for it
+            return
+
+        if event.type == vlc.EventType.MediaPlayerPlaying:
+            startup.mark('first_audio')
+        if event.type == vlc.EventType.MediaPlayerPlaying and self.handover_pending:
+            self.handover_start = time.monotonic()
+            self.measure_gap()
+
+        callback(event)
+        post_event(PLAYER_EVENT)
+
+    def on_time_changed(self, event, player):           #Track elapsed time, arm the gapless handover once the end of the track is close
+        if player is not self.player:
+            return
+
+        self.state.update(time=event.u.new_time)
+        if self.seek_pending is not None and abs(event.u.new_time - self.seek_pending) <= SEEK_TOLERANCE_MS:
+            self.seek_pending = None
+            self.seek_landed.set()
+
+        remaining = self.state.length - event.u.new_time
+        crossfade_ms = self.crossfade * 1000
+        if (self.gapless or crossfade_ms) and self.preload_ready and self.handover_timer is None and 0 < remaining <= crossfade_ms + GAPLESS_LEAD_MS:
+            self.handover_timer = threading.Timer(max(0, remaining - (crossfade_ms or GAPLESS_OVERLAP_MS)) / 1000, self.handover)
+            self.handover_timer.daemon = True
+            self.handover_timer.start()
+
+    def measure_gap(self):                              #Gap between the old track ending and the new one playing in ms, once both ends of the handover have reported
+        if self.handover_start is not None and self.handover_end is not None:
+            self.last_gap_ms = (self.handover_start - self.handover_end) * 1000
+            self.handover_pending = False
+
+    def standby_busy(self):                             #True while the standby player still has audio to play -- fading out, or finishing the track it handed over from early
+        return self.fading or (self.handover_pending and self.handover_end is None)
+
+    def preload(self, track_path):                      #Open the next track paused on the standby player so it is parsed and buffered before it's needed
+        with self.lock:
+            if self.standby_busy():                     #Stopping it now would cut the end off, the fade thread or preload_deferred runs it once it's done
+                self.deferred_preload = track_path
+                return
+
+            self.cancel_handover()
+            self.preload_ready = False
+            self.preloaded_path = None
+
+            if not (self.gapless or self.crossfade) or track_path is None:
+                return
+
+            try:
+                media = self.instance.media_new(track_path)
+                media.add_option(':start-paused')               #Input opens, fills its buffers and holds on the first frame
+                self.standby.stop()
+                self.standby.set_media(media)
+                self.preloaded_path = track_path
+                self.player_gain[self.standby] = self.gain_factor(track_path)
+                self.standby.play()
+            except Exception as error:
+                self.preloaded_path = None
+                print("Failed to preload " + os.path.basename(track_path) + ": " + str(error))
+
+    def handover(self, automatic=True):                 #Swap to the buffered standby player -- automatic handovers run on the timer thread at the end of a track, manual ones from play()
+        with self.lock:
+            self.handover_timer = None
+            if not self.preload_ready or (automatic and self.state.state != vlc.State.Playing):
+                return False
+
+            self.drop_seeks()
+            self.player, self.standby = self.standby, self.player
+            self.current_path = self.preloaded_path
+            self.preloaded_path = None
+            self.preload_ready = False
+
+            self.handover_pending = automatic and not self.crossfade
+            self.handover_start = None
+            self.handover_end = None
+            if self.crossfade:                          #Automatic handovers fade over whatever is left of the old track
+                self.player.audio_set_volume(0)
+                self.player.set_pause(0)
+                remaining = max(0, self.state.length - self.state.time) / 1000 if automatic else self.crossfade
+                self.start_fade(self.standby, self.player, max(FADE_STEP_MS / 1000, min(self.crossfade, remaining)))
+            else:
+                self.player.set_pause(0)
+                self.player.audio_set_volume(self.scaled_volume(self.player))
+            self.state.update(state=vlc.State.Playing, time=0, length=max(0, self.player.get_length()), ended=False, handed_over=automatic)
+
+        post_event(PLAYER_EVENT)
+        return True
+
+    def crossfade_to(self, track_path):                 #Start a track on the standby player and fade over to it, used for skips and rewinds while playing
+        with self.lock:
+            self.end_fade()
+            if not (track_path == self.preloaded_path and self.preload_ready):
+                self.standby.stop()
+                self.standby.set_media(self.instance.media_new(track_path))
+                self.standby.audio_set_volume(0)
+                self.player_gain[self.standby] = self.gain_factor(track_path)
+                self.standby.play()
+                self.preloaded_path = track_path
+                self.preload_ready = True
+
+            self.state.update(state=vlc.State.Opening, time=0, length=0, ended=False)
+            self.handover(automatic=False)
+
+    def start_fade(self, fade_out, fade_in, duration):  #Run a volume ramp between two players on its own thread
+        self.fade_generation += 1
+        self.fading = True
+        threading.Thread(target=self.fade, args=(fade_out, fade_in, duration, self.fade_generation), daemon=True).start()
+
+    def fade(self, fade_out, fade_in, duration, generation):        #Equal-power ramp against a monotonic clock, off the render thread so dropped frames don't make it stutter
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                if generation != self.fade_generation:
+                    return
+
+                progress = min(1, (time.monotonic() - start) / duration)
+                volume = self.state.volume
+                fade_out.audio_set_volume(self.scaled_volume(fade_out, volume * math.cos(progress * math.pi / 2)))
+                fade_in.audio_set_volume(self.scaled_volume(fade_in, volume * math.sin(progress * math.pi / 2)))
+
+                if progress >= 1:
+                    fade_out.stop()
+                    self.fading = False
+                    deferred_preload = self.deferred_preload
+                    self.deferred_preload = None
+                    break
+
+            time.sleep(FADE_STEP_MS / 1000)
+
+        if deferred_preload:
+            self.preload(deferred_preload)
+
+    def preload_deferred(self):                         #Run a preload held back while the old track played out, call from the main loop once the standby player reported its end
+        with self.lock:
+            if self.deferred_preload is None or self.standby_busy():
+                return
+            track_path = self.deferred_preload
+            self.deferred_preload = None
+        self.preload(track_path)
+
+    def end_fade(self):                                 #Cut a running fade short -- the fading out player stops and the active one jumps to full volume
+        if self.fading:
+            self.fade_generation += 1
+            self.fading = False
+            self.deferred_preload = None
+            self.standby.stop()
+            self.player.audio_set_volume(self.scaled_volume(self.player))
+
+    def cycle_crossfade(self):                          #Step to the next crossfade length, returns it in seconds
+        self.crossfade = CROSSFADE_STEPS[(CROSSFADE_STEPS.index(self.crossfade) + 1) % len(CROSSFADE_STEPS)] if self.crossfade in CROSSFADE_STEPS else 0
+        return self.crossfade
+
+    def gain_factor(self, track_path):                  #Linear normalization gain for a track in the current mode, 1 when off or not analysed yet
+        if not self.gain_lookup or self.normalization == 'off':
+            return 1.0
+        return 10 ** (self.gain_lookup(track_path, self.normalization) / 20)
+
+    def scaled_volume(self, player, volume=None):       #libvlc volume for a player -- the user's volume times the gain of the track it holds
+        volume = self.state.volume if volume is None else volume
+        return max(0, min(MAX_PLAYER_VOLUME, int(volume * self.player_gain.get(player, 1.0))))
+
+    def cycle_normalization(self):                      #Step to the next normalization mode and re-apply gains (this one changes the playing track's level on purpose), returns the mode
+        self.normalization = LOUDNESS_MODES[(LOUDNESS_MODES.index(self.normalization) + 1) % len(LOUDNESS_MODES)]
+        self.refresh_gain(current=True)
+        return self.normalization
+
+    def refresh_gain(self, current=False):              #Recompute the buffered track's gain (analysis may have landed since it was preloaded), and the playing one's if current
+        with self.lock:
+            if self.preloaded_path:
+                self.player_gain[self.standby] = self.gain_factor(self.preloaded_path)
+            if current and self.current_path:
+                self.player_gain[self.player] = self.gain_factor(self.current_path)
+                if not self.fading:
+                    self.set_volume(self.state.volume)
+
+    def cancel_handover(self):                          #Drop a pending handover, e.g. when the user pauses, seeks or changes track near the end
+        if self.handover_timer:
+            self.handover_timer.cancel()
+            self.handover_timer = None
+
+    def play(self, track_path, start_ms=0):             #Play a track -- crossfades if enabled and something is playing, uses the standby player if it already has this track buffered, otherwise create new media object (starting at start_ms) and send to player, play and restore volume
+        startup.mark('play')
         try:
-            current_volume = self.get_volume()
+            with self.lock:
+                self.cancel_handover()
+                self.drop_seeks()
+                self.handover_pending = False           #The user moved on, the old track's tail can be cut
 
-            self.player.set_media(self.instance.media_new(track_path))
-            self.player.play()
-            self.set_volume(current_volume)
+                if self.crossfade and self.state.state == vlc.State.Playing:
+                    self.crossfade_to(track_path)
+                    return
+
+                self.end_fade()
+
+                if track_path == self.preloaded_path and self.preload_ready:
+                    self.player.stop()
+                    self.handover(automatic=False)
+                    return
+
+                self.current_path = track_path
+                self.player_gain[self.player] = self.gain_factor(track_path)
+                self.state.update(state=vlc.State.Opening, time=start_ms, length=0, ended=False)
+
+                media = self.instance.media_new(track_path)
+                if start_ms:
+                    media.add_option(f':start-time={start_ms / 1000:.3f}')         #Decoding starts at the position, no audible seek after playback begins
+                self.player.set_media(media)
+                self.player.play()
+                self.set_volume(self.state.volume)
         except Exception as error:
             raise Exception("Failed to play " + os.path.basename(track_path) + ": " + str(error))
 
     def stop(self):                                             #Stop player
-        self.player.stop()
+        with self.lock:
+            self.drop_seeks()
+            self.cancel_handover()
+            self.end_fade()
+            self.handover_pending = False
+            self.player.stop()
+            self.state.update(state=vlc.State.Stopped, time=0, ended=False)
 
     def toggle_pause(self):                                     #Pause player -- Same function unpauses
-        self.player.pause()
+        with self.lock:
+            self.cancel_handover()
+            self.end_fade()
+            self.player.pause()
+
+    def get_state(self):                                        #Fetch player state from the snapshot
+        return self.state.state
         
     def get_progress(self):                                     #Fetch player progress, returns tuple of current time and total time
-        if self.player.get_state() in [vlc.State.Playing, vlc.State.Paused]:
-            (current_time, total_time) = self.player.get_time() / 1000, self.player.get_length() / 1000
-
-            if total_time <= 0:
-                return (0, 0)
-
-            return (current_time, total_time)
-
-        return (0, 0)
+        return self.state.get_progress()
     
     def set_progress(self, progress_percent):                   #Set player progress
         if self.player and progress_percent >= 0 and progress_percent <= 1:
-            self.player.set_position(progress_percent)
+            with self.lock:
+                self.drop_seeks()
+                self.cancel_handover()
+                self.player.set_position(progress_percent)
+                self.state.update(time=int(self.state.length * progress_percent))
+
+    def scrub(self, progress_percent):                          #Live seek while the progress button is dragged -- cheap to call per motion event, only the newest target is kept and the seek thread sends it once libvlc has caught up
+        if self.state.length <= 0 or not 0 <= progress_percent <= 1:
+            return
 
-    def get_volume(self):                                       #Fetch player volume
-        return self.player.audio_get_volume()
+        with self.seek_condition:
+            self.seek_target = int(self.state.length * progress_percent)
+            self.seek_condition.notify()
+
+        if self.seek_thread is None:
+            self.seek_thread = threading.Thread(target=self.seeker, daemon=True)
+            self.seek_thread.start()
+
+    def seeker(self):                                           #Seek thread -- send the newest target, wait for libvlc to report it (or SEEK_TIMEOUT_MS), keep at least SEEK_MIN_INTERVAL_MS between seeks
+        while True:
+            with self.seek_condition:
+                while self.seek_target is None:
+                    self.seek_condition.wait()
+                target = self.seek_target
+                self.seek_target = None
+                generation = self.seek_generation
+
+            with self.lock:
+                if generation != self.seek_generation:          #Track changed or the drag ended while this one waited
+                    continue
+                self.cancel_handover()
+                self.seek_landed.clear()
+                self.seek_pending = target
+                sent = time.monotonic()
+                self.player.set_time(target)
+                self.seeks_sent += 1
+
+            if self.seek_landed.wait(SEEK_TIMEOUT_MS / 1000):
+                self.last_seek_ms = (time.monotonic() - sent) * 1000
+            self.seek_pending = None
+            time.sleep(max(0, sent + SEEK_MIN_INTERVAL_MS / 1000 - time.monotonic()))
+
+    def drop_seeks(self):                                       #Forget any scrub target not yet sent, an in-flight one is left to land
+        with self.seek_condition:
+            self.seek_target = None
+            self.seek_generation += 1
+
+    def get_volume(self):                                       #Fetch player volume from the snapshot
+        return self.state.volume
     
-    def set_volume(self, volume):                               #Set player volume
-        self.player.audio_set_volume(volume)
+    def set_volume(self, volume):                               #Set player volume, scaled by the playing track's normalization gain
+        self.state.volume = volume
+        self.player.audio_set_volume(self.scaled_volume(self.player))
     
     def volume_raise(self, volume_raise_amount):                #Raise volume by increment
         current_volume = self.get_volume()
@@ -155,17 +877,75 @@ class AudioManager:                             #Class to handle vlc media playb
         new_volume = max(0, current_volume - volume_lower_amount)
         self.set_volume(new_volume)
 
-    def cleanup(self):                                          #Stop and release player, release media instance
-        self.player.stop()
-        self.player.release()
+    def cleanup(self):                                          #Stop and release players, release media instance
+        self.cancel_handover()
+        self.fade_generation += 1
+        with self.lock:                                         #Not under a scrub seek
+            self.drop_seeks()
+            for player in (self.player, self.standby):
+                player.stop()
+                player.release()
         self.instance.release()
     
+class LayoutManager:                                #Declarative layout of the main window -- elements are placed by shares of the window size, geometry is computed once per size and cached, so resizing costs a lookup
+    POINTS = {                                      #Format of {name: (x share, y share)}, centers of text, art and buttons
+        'title': (1/2, 1/4),
+        'artist': (1/2, 1/3),
+        'volume': (1/2, 1/6),
+        'time': (1/2, 9/16),
+        'default': (1/2, 1/2),
+        'art': (5/6, 3/8),
+        'pause_button': (1/4, 4/5),
+        'skip_button': (2/4, 4/5),
+        'rewind_button': (3/4, 4/5),
+        'quit_button': (1/6, 1/2),
+    }
+    BARS = {                                        #Format of {name: (width share, y share)}, bars centered across the window, BAR_HEIGHT tall
+        'volume_bar': (0.1, 1/10),
+        'progress_bar': (0.6, 5/8),
+    }
+    BAR_HEIGHT = 10
+
+    def __init__(self, cache_size=LAYOUT_CACHE_SIZE):
+        self.cache = OrderedDict()                      #Format of {(width, height): geometry}, least recently used first
+        self.cache_size = cache_size
+        self.computed = 0                               #Layouts computed rather than found in the cache
+
+    def get(self, width, height):                       #Returns the geometry for a window size, computing it on first use
+        key = (width, height)
+        geometry = self.cache.get(key)
+        if geometry is not None:
+            self.cache.move_to_end(key)
+            return geometry
+
+        geometry = self.cache[key] = self.compute(width, height)
+        self.computed += 1
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return geometry
+
+    def compute(self, width, height):                   #Returns a dictionary of {name: geometry} -- points as (x, y), bars as (x, y, width, height), panels as Rects, plus derived sizes
+        geometry = {name: (width * x, height * y) for name, (x, y) in self.POINTS.items()}
+        for name, (share, y) in self.BARS.items():
+            bar_width = width * share
+            geometry[name] = ((width - bar_width) // 2, height * y, bar_width, self.BAR_HEIGHT)
+
+        geometry['wave_height'] = max(self.BAR_HEIGHT, int(height * 0.1))          #Waveform seekbar, centered on where the flat bar sits
+        geometry['art_size'] = max(32, int(min(width * 0.2, height * 0.35)))       #Side of the square cover art is fitted into
+        geometry['spectrum'] = pygame.Rect(width * 0.3, height * 0.37, width * 0.4, height * 0.15)       #Gap between the artist line and the time
+        geometry['search'] = pygame.Rect(0, 0, width * 0.7, height * 0.8)
+        geometry['search'].center = (width // 2, height // 2)
+        toast_width = int(min(width * 0.6, 520))
+        geometry['toasts'] = ((width - toast_width) // 2, 10, toast_width)         #Left, top and width of the toast stack
+        geometry['metadata_progress'] = (width // 2, height - 20)
+        return geometry
+
 class RenderManager:                                #Class to handle pygame window and general rendering
     MIN_WIDTH = 400                                 #Minimum window size
     MIN_HEIGHT = 200
 
-    def __init__(self, audio_manager):              #Initialize pygame, pygame font, and window -- Takes audio manager as a parameter to access player methods
-        pygame.init()
+    def __init__(self, audio_manager):              #Initialize pygame display and font, and window -- Takes audio manager as a parameter to access player methods
+        pygame.display.init()                       #Only what the window needs, pygame.init() would also open an audio device and probe joysticks
         pygame.font.init()
 
         self.audio_manager = audio_manager
@@ -175,183 +955,1823 @@ class RenderManager:                                #Class to handle pygame wind
         self.window = pygame.display.set_mode((self.window_width, self.window_height), pygame.RESIZABLE)
         pygame.display.set_caption("Baise Media Player")
 
-        self.font = pygame.font.SysFont('Comic Sans', 24)
+        self.font = load_font('Comic Sans', 24)
+        self.small_font = load_font('Comic Sans', 16)
         self.font_color = (255, 255, 255)
+        self.background_color = (0, 0, 0)
+
+        self.layout_manager = LayoutManager()
+        self.layout = self.layout_manager.get(self.window_width, self.window_height)
+        self.snapshot = None                        #Copy of what's on screen, kept current through the dirty rects -- scaled to fit while a resize is in progress
+        self.resize_deadline = None                 #Monotonic time the window size counts as settled, None when no resize is pending
+        self.preview_size = None                    #Window size the scaled snapshot was last drawn at
 
-    def resize_window(self):                         #Resize window, use as flag to update in main loop
+        self.regions = {}                           #Regions shown on screen as of the last present, format of {name: (key, rect, draw)} -- insertion order is draw order
+        self.frame_regions = {}                     #Regions submitted for the frame being built, swapped into regions on present
+        self.full_redraw = True                     #Flag to repaint and flip the whole window on next present (startup, resize, window recreated)
+        self.waveform_cache = None                  #Format of ((envelope id, width, height), (played, unplayed))
+        self.error_manager = ErrorManager(audio_manager)
+
+    def resize_window(self):                         #Take on the window's new size -- only recreates the window to enforce the minimum size, looks up the layout and flags a full redraw
         set_screen_size = pygame.display.get_window_size()
         self.window_width = max(self.MIN_WIDTH, set_screen_size[0])
         self.window_height = max(self.MIN_HEIGHT, set_screen_size[1])
-        self.window = pygame.display.set_mode((self.window_width, self.window_height), pygame.RESIZABLE)
+        self.window = pygame.display.get_surface()
+        if self.window.get_size() != (self.window_width, self.window_height):
+            self.window = pygame.display.set_mode((self.window_width, self.window_height), pygame.RESIZABLE)
+        self.layout = self.layout_manager.get(self.window_width, self.window_height)
+        self.full_redraw = True
 
         return True
 
-    def render_song_info(self, title, artist, time_text, play_state):               #Render song info in title, artist, time, and volume -- default to no song selected
-        self.window.fill((0, 0, 0))
+    def resize_request(self):                        #The window is being resized, (re)start the settle timer -- cheap, called for every resize event
+        self.resize_deadline = time.monotonic() + RESIZE_SETTLE_MS / 1000
+
+    def resize_update(self):                         #Once per frame while a resize is pending -- scales the last frame to the window while the size keeps changing, returns True once it settled and the layout was applied
+        if time.monotonic() < self.resize_deadline:
+            self.window = pygame.display.get_surface()
+            size = self.window.get_size()
+            if self.snapshot and size != self.preview_size:
+                pygame.transform.scale(self.snapshot, size, self.window)
+                pygame.display.flip()
+                self.preview_size = size
+            return False
+
+        self.resize_deadline = None
+        self.preview_size = None
+        return self.resize_window()
+
+    def region_render(self, name, key, rect, draw):             #Submit a named region for this frame -- key describes what is drawn, so unchanged regions cost nothing on present
+        self.frame_regions[name] = (key, pygame.Rect(rect), draw)
+
+    def text_render(self, name, text, center, font=None):       #Submit a line of text centered on a point as its own region
+        text_surface = text_cache.render(font or self.font, text, self.font_color)
+        text_rect = text_surface.get_rect(center=center)
+        self.region_render(name, text, text_rect, lambda surface: surface.blit(text_surface, text_rect))
+
+    def present(self):                              #Compare submitted regions against last frame and push only the changed areas, returns list of updated rects
+        previous_regions = self.regions
+        current_regions = self.frame_regions
+        self.regions = current_regions
+        self.frame_regions = {}
+
+        if self.full_redraw:                        #Full repaint when the window contents can't be trusted
+            self.full_redraw = False
+            self.window.fill(self.background_color)
+            for key, rect, draw in current_regions.values():
+                draw(self.window)
+            pygame.display.flip()
+            self.snapshot = self.window.copy()
+            return [self.window.get_rect()]
+
+        dirty_rects = []
+        for name, (key, rect, draw) in current_regions.items():             #New or changed regions dirty both where they were and where they are now
+            previous = previous_regions.get(name)
+            if previous is None:
+                dirty_rects.append(rect)
+            elif previous[0] != key or previous[1] != rect:
+                dirty_rects.append(previous[1].union(rect))
+
+        for name, (key, rect, draw) in previous_regions.items():            #Regions no longer submitted leave their old area dirty
+            if name not in current_regions:
+                dirty_rects.append(rect)
+
+        if not dirty_rects:
+            return []
+
+        for dirty_rect in dirty_rects:                      #Clear each dirty area and redraw everything overlapping it in order, clipped so neighbours aren't disturbed
+            self.window.set_clip(dirty_rect)
+            self.window.fill(self.background_color)
+            for key, rect, draw in current_regions.values():
+                if rect.colliderect(dirty_rect):
+                    draw(self.window)
+            self.snapshot.blit(self.window, dirty_rect, dirty_rect)
+        self.window.set_clip(None)
+
+        pygame.display.update(dirty_rects)
+        return dirty_rects
+
+    def art_size(self):                             #Side of the square cover art is fitted into, in pixels
+        return self.layout['art_size']
+
+    def render_song_info(self, title, artist, time_text, play_state, art=None):     #Render song info in title, artist, time, and volume, with cover art to the right when there is some -- default to no song selected
         if title:
             try:
                 volume = self.audio_manager.get_volume()
 
-                title_render = self.font.render(f"{title} (Paused)" if not play_state == vlc.State.Playing else f"{title}", True, self.font_color)
-                title_rect = title_render.get_rect(center=(self.window_width//2, self.window_height * (1/4)))
-                self.window.blit(title_render, title_rect)
-
-                artist_render = self.font.render(artist, True, self.font_color)
-                artist_render_rect = artist_render.get_rect(center=(self.window_width//2, self.window_height * (1/3)))
-                self.window.blit(artist_render, artist_render_rect)
+                if art:
+                    art_rect = art.get_rect(center=self.layout['art'])
+                    self.region_render('art', id(art), art_rect, lambda surface: surface.blit(art, art_rect))
 
-                time_render = self.font.render(time_text, True, self.font_color)
-                time_rect = time_render.get_rect(center=(self.window_width//2, self.window_height * (9/16)))
-                self.window.blit(time_render, time_rect)
-
-                volume_render = self.font.render(str(volume) + "%", True, self.font_color)
-                volume_rect = volume_render.get_rect(center=(self.window_width//2, self.window_height * (1/6)))
-                self.window.blit(volume_render, volume_rect)
+                self.text_render('title', f"{title} (Paused)" if not play_state == vlc.State.Playing else f"{title}", self.layout['title'])
+                self.text_render('artist', artist, self.layout['artist'])
+                self.text_render('time', time_text, self.layout['time'])
+                self.text_render('volume', str(volume) + "%", self.layout['volume'])
 
             except Exception as error:
                 self.error_prompt_render("Error rendering song info: " + str(error), fatal=True)
         else:
-            default_text_render = self.font.render("No song selected.", True, self.font_color)
-            default_text_rect = default_text_render.get_rect(center=(self.window_width//2, self.window_height//2))
-            self.window.blit(default_text_render, default_text_rect)
+            self.text_render('default', "No song selected.", self.layout['default'])
 
     def volume_bar_render(self, volume):            #Render volume bar
-        width = self.window_width * 0.1
-        height = 10
-        x = (self.window_width - width) // 2
-        y = self.window_height * (1/10)
+        (x, y, width, height) = self.layout['volume_bar']
 
-        pygame.draw.rect(self.window, (150, 100, 150), (x, y, width, height))
-        pygame.draw.rect(self.window, (0, 0, 150), (x, y, (width * (volume / 100)), height))
+        def draw(surface):
+            pygame.draw.rect(surface, (150, 100, 150), (x, y, width, height))
+            pygame.draw.rect(surface, (0, 0, 150), (x, y, (width * (volume / 100)), height))
 
-    def progress_bar_render(self, progress):            #Render progress bar
-        width = self.window_width * 0.6
-        height = 10
-        x = (self.window_width - width) // 2
-        y = self.window_height * (5/8)
+        self.region_render('volume_bar', volume, (x, y, width, height), draw)
 
-        pygame.draw.rect(self.window, (150, 100, 150), (x, y, width, height))
-        pygame.draw.rect(self.window, (0, 0, 150), (x, y, (width * progress), height))
+    def progress_bar_render(self, progress, envelope=None):            #Render progress bar, as a waveform when the track's envelope is ready -- key is the filled width in pixels so sub-pixel progress doesn't trigger a redraw
+        (x, y, width, height) = self.layout['progress_bar']
+        fill_width = int(width * progress)
 
-    def error_prompt_render(self, error_string, fatal=False):               #Method to call the error manager to render
-        error_manager = ErrorManager(self.audio_manager)
-        error_manager.error_render(error_string, fatal)
+        if envelope is None:
+            def draw(surface):
+                pygame.draw.rect(surface, (150, 100, 150), (x, y, width, height))
+                pygame.draw.rect(surface, (0, 0, 150), (x, y, fill_width, height))
 
-class ErrorManager:                                 #Class for exception handling and rendering, also takes audio manager as a parameter so it can properly run cleanup
-    def __init__(self, audio_manager):
-        self.audio_manager = audio_manager
-        self.error_window = None
-        self.error_queue = []                           #Format of [(error_string, fatal), etc], queue to prevent pileup with running flag to help iterate
-        self.error_active = False
-        self.error_window_width = WINDOW_WIDTH * 4/5
-        self.error_window_height = WINDOW_HEIGHT * 4/5
+            self.region_render('progress_bar', fill_width, (x, y, width, height), draw)
+            return
 
-        self.error_font = pygame.font.SysFont('Comic Sans', 16)
-        self.error_font_color = (255, 0, 0)
+        wave_height = self.layout['wave_height']            #Centered on where the flat bar sits so the drag knob still lines up
+        wave_y = y + height // 2 - wave_height // 2
+        (played, unplayed) = self.waveform_surfaces(envelope, int(width), wave_height)
 
-        self.running = True
+        def draw(surface):
+            surface.blit(unplayed, (x, wave_y))
+            surface.blit(played, (x, wave_y), (0, 0, fill_width, wave_height))
 
-        self.error_window = pygame.display.set_mode((self.error_window_width, self.error_window_height), pygame.RESIZABLE)
-        pygame.display.set_caption("Error")
+        self.region_render('progress_bar', (fill_width, id(envelope)), (x, wave_y, int(width), wave_height), draw)
 
-        self.soft_error_button = Button({                       #Button configurations, soft button returns to program, hard button exits
-            'x': (self.error_window_width - 100)//2,
-            'y': self.error_window_height - 50,
-            'label': "Recover",
-            'onClick': lambda: setattr(self, 'running', False)
-        })
+    def waveform_surfaces(self, envelope, width, height):      #Played and unplayed waveform images for an envelope at a size, painted with surfarray once and reused until either changes
+        key = (id(envelope), width, height)
+        if self.waveform_cache and self.waveform_cache[0] == key:
+            return self.waveform_cache[1]
 
-        self.hard_error_button = Button({
-            'x': (self.error_window_width - 100)//2,
-            'y': self.error_window_height - 50,
-            'label': "Exit",
-            'onClick': lambda: (
-                self.audio_manager.cleanup(),
-                pygame.quit(),
-                sys.exit(1)
-            )
-        })
+        columns = numpy.arange(width) * envelope.shape[1] // width
+        peak = envelope[0][columns] * (height / 2) / 255
+        rms = envelope[1][columns] * (height / 2) / 255
+        distance = numpy.abs(numpy.arange(height) - (height - 1) / 2)[None, :]             #Pixel distance from the center line, broadcast against each column's heights
 
-    def close_error(self):                  #Simple method to close current error
-        self.error_active = False
+        level = (distance <= peak[:, None]).astype(numpy.uint8) + (distance <= rms[:, None])           #0 background, 1 peak, 2 RMS per pixel
 
-    def error_render(self, error_string, fatal):        #Queues errors if one is already active, creates window and renders error, handles mouse clicks via buttons
-        if self.error_active:
-            self.error_queue.append((error_string, fatal))
-            return
-        
-        self.error_active = True
-        self.running = True
-                    
-        os.environ['SDL_VIDEO_WINDOW_POS'] = "100,100"              #Create a hard coded position for the error window
-        self.error_window = pygame.display.set_mode((self.error_window_width, self.error_window_height))
-        pygame.display.set_caption("Error")
+        def paint(peak_color, rms_color):
+            surface = pygame.Surface((width, height)).convert()
+            palette = numpy.array([surface.map_rgb(color) for color in (self.background_color, peak_color, rms_color)], numpy.uint32)
+            pygame.surfarray.blit_array(surface, palette[level])
+            return surface
 
-        self.audio_manager.stop()
-        current_button = self.hard_error_button if fatal else self.soft_error_button
+        surfaces = (paint((0, 0, 150), (60, 60, 230)), paint((150, 100, 150), (200, 150, 200)))
+        self.waveform_cache = (key, surfaces)
+        return surfaces
 
-        while self.running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.hard_error_button.handle_click()
-                elif event.type == pygame.MOUSEBUTTONDOWN:
-                    current_button.handle_click()
-
-            self.error_window.fill((0, 0, 0))
-            current_button.draw(self.error_window)
-            self.error_text_render(error_string)
-            pygame.display.flip()
-        
-        if not fatal:
-            pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.RESIZABLE)
-            pygame.display.set_caption("Baise Media Player")
-        
-        self.error_active = False
+    def spectrum_render(self, levels):                          #Spectrum bars in the gap between the artist line and the time, key is the bar heights in pixels
+        area = self.layout['spectrum']
+        bar_width = area.width / len(levels)
+        heights = tuple(int(level * area.height) for level in levels)
+
+        def draw(surface):
+            for index, height in enumerate(heights):
+                if height:
+                    pygame.draw.rect(surface, (60, 60, 230), (area.x + index * bar_width + 1, area.bottom - height, max(1, bar_width - 2), height))
+
+        self.region_render('spectrum', heights, area, draw)
 
-        if self.error_queue:                            #Recursive call to render next error in queue
-            new_error_string, new_fatal = self.error_queue.pop(0)
-            self.error_render(new_error_string, new_fatal)
+    def profiler_render(self, lines):                           #Profiler timings in the top left corner, rendered uncached since the numbers change constantly
+        surfaces = [self.small_font.render(line, True, self.font_color) for line in lines]
+        line_height = self.small_font.get_linesize()
+        panel = pygame.Rect(5, 5, max(surface.get_width() for surface in surfaces) + 10, line_height * len(surfaces) + 10)
 
-    def error_text_render(self, error_string):                      #Render error text onto error window/button, sets wrap with a height margin
-        lines = self._wrap_text(error_string, self.error_window_width - 20)
-        heightBuffer = 30
+        def draw(surface):
+            pygame.draw.rect(surface, (20, 20, 40), panel)
+            for index, line_surface in enumerate(surfaces):
+                surface.blit(line_surface, (panel.x + 5, panel.y + 5 + line_height * index))
 
-        for line in lines:
-            text_surface = self.error_font.render(line, True, self.error_font_color)
-            text_rect = text_surface.get_rect(center=(self.error_window_width // 2, heightBuffer))
-            self.error_window.blit(text_surface, text_rect)
-            heightBuffer += 20
+        self.region_render('profiler', tuple(lines), panel, draw)
 
-    def _wrap_text(self, text, max_width):                          #Method to wrap text with a width margin
-        x_margin = 20
-        effective_width = max_width - (x_margin * 2)
+    def search_render(self, query, titles, selected):           #Search overlay panel over the middle of the window, query line then ranked results with the selected one highlighted
+        panel = self.layout['search']
+        line_height = self.small_font.get_linesize() + 4
 
+        def draw(surface):
+            pygame.draw.rect(surface, (20, 20, 40), panel)
+            pygame.draw.rect(surface, (100, 100, 150), panel, 2)
+            surface.blit(text_cache.render(self.small_font, "Search: " + query + "_", self.font_color), (panel.x + 10, panel.y + 10))
+
+            for index, title in enumerate(titles):
+                y = panel.y + 10 + line_height * (index + 1)
+                if y + line_height > panel.bottom:
+                    break
+                if index == selected:
+                    pygame.draw.rect(surface, (10, 10, 200), (panel.x + 5, y - 2, panel.width - 10, line_height))
+                surface.blit(text_cache.render(self.small_font, title, self.font_color), (panel.x + 10, y))
+
+        self.region_render('search', (query, tuple(titles), selected), panel, draw)
+
+    def button_render(self, name, button, mouse_pos):           #Submit a button region keyed on its hover state
+        hovered = button.check_mouse(mouse_pos)
+        self.region_render('button_' + name, (button.label, hovered), button.rect, lambda surface: button.draw(surface, hovered))
+
+    def drag_button_render(self, name, button):                 #Submit a drag button region keyed on its position and drag state
+        self.region_render('drag_' + name, (int(button.center_x), button.being_dragged), button.get_rect(), button.draw)
+
+    def error_prompt_render(self, error_string, fatal=False):               #Method to call the error manager to show an error, returns at once
+        self.error_manager.error_render(error_string, fatal)
+
+    def toasts_render(self):                        #Submit the error toasts, stacked down from the top center over everything else
+        self.error_manager.expire()
+        (x, y, width) = self.layout['toasts']
+        rects = {}
+
+        for index, (message, surface) in enumerate(self.error_manager.toast_surfaces(width)):
+            rect = surface.get_rect(topleft=(x, y))
+            self.region_render(f'toast_{index}', id(surface), rect, lambda window, surface=surface, rect=rect: window.blit(surface, rect))
+            rects[message] = rect
+            y = rect.bottom + 6
+
+        self.error_manager.rects = rects
+
+class ErrorManager:                                 #Non-blocking error toasts stacked at the top of the main window -- repeats of a shown message are counted instead of stacked, new non-fatal messages beyond a rate limit are folded into one summary toast
+    SUPPRESSED = "More errors were suppressed, see the console"
+
+    def __init__(self, audio_manager):
+        self.audio_manager = audio_manager
+        self.lock = threading.Lock()                    #Errors can come from worker threads
+        self.toasts = OrderedDict()                     #Format of {message: [fatal, count, expiry time]}, oldest first, fatal ones never expire
+        self.tokens = ERROR_BURST                       #Token bucket for new messages, refilled at ERROR_RATE per second
+        self.token_time = time.monotonic()
+        self.surfaces = {}                              #Format of {message: (key, surface)}, a toast is re-rendered only when its count or width changes
+        self.rects = {}                                 #Format of {message: rect} where each toast was last drawn, for clicks
+
+        self.error_font = load_font('Comic Sans', 16)
+        self.error_font_color = (255, 0, 0)
+        self.hint_color = (150, 150, 150)
+        self.background_color = (40, 0, 0)
+
+    def error_render(self, error_string, fatal):        #Queue a toast, cheap and never blocks so a flood of errors can't stall the frame loop
+        now = time.monotonic()
+        with self.lock:
+            toast = self.toasts.get(error_string)
+            if toast is None:
+                print(("Fatal error: " if fatal else "Error: ") + error_string, file=sys.stderr)
+            if toast is None and not fatal:                     #Fatal errors always get their own toast, the summary only ever stands in for dismissable ones
+                self.tokens = min(ERROR_BURST, self.tokens + (now - self.token_time) * ERROR_RATE)
+                self.token_time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                else:
+                    error_string = self.SUPPRESSED
+                    toast = self.toasts.get(error_string)
+
+            if toast is None:
+                toast = self.toasts[error_string] = [fatal, 0, 0]
+                while len(self.toasts) > ERROR_TOASTS:          #Make room by dropping the oldest, non-fatal ones first
+                    dropped = next((message for message, (toast_fatal, count, expiry) in self.toasts.items() if not toast_fatal), next(iter(self.toasts)))
+                    del self.toasts[dropped]
+
+            toast[0] = toast[0] or fatal
+            toast[1] += 1
+            toast[2] = now + ERROR_TOAST_SECONDS
+
+        post_event(ERROR_EVENT)
+
+    def expire(self):                                   #Drop toasts past their expiry, returns seconds until the next one is due or None
+        now = time.monotonic()
+        with self.lock:
+            for message in [message for message, (fatal, count, expiry) in self.toasts.items() if not fatal and expiry <= now]:
+                del self.toasts[message]
+            expiries = [expiry for fatal, count, expiry in self.toasts.values() if not fatal]
+        return max(0, min(expiries) - now) if expiries else None
+
+    def toast_surfaces(self, width):                    #Returns list of (message, surface) for the current toasts, oldest first
+        with self.lock:
+            toasts = [(message, fatal, count) for message, (fatal, count, expiry) in self.toasts.items()]
+
+        surfaces = []
+        for message, fatal, count in toasts:
+            key = (fatal, count, width)
+            cached = self.surfaces.get(message)
+            if not cached or cached[0] != key:
+                cached = self.surfaces[message] = (key, self.toast_render(message, fatal, count, width))
+            surfaces.append((message, cached[1]))
+
+        for message in [message for message in self.surfaces if message not in self.toasts]:
+            del self.surfaces[message]
+        return surfaces
+
+    def toast_render(self, message, fatal, count, width):          #Render one toast -- wrapped message, repeat count, and what a click does
+        lines = self._wrap_text(message + (f" (x{count})" if count > 1 else ""), width - 20)
+        line_height = self.error_font.get_linesize()
+        surface = pygame.Surface((width, line_height * (len(lines) + 1) + 12))
+        surface.fill(self.background_color)
+        pygame.draw.rect(surface, self.error_font_color, surface.get_rect(), 1)
+
+        for index, line in enumerate(lines):
+            surface.blit(text_cache.render(self.error_font, line, self.error_font_color), (10, 6 + index * line_height))
+        surface.blit(text_cache.render(self.error_font, "Click to exit" if fatal else "Click to dismiss", self.hint_color), (10, 6 + len(lines) * line_height))
+        return surface
+
+    def click(self, mouse_pos):                         #Dismiss a clicked toast, or exit if it was fatal, returns True if the click landed on one
+        for message, rect in self.rects.items():
+            if rect.collidepoint(mouse_pos):
+                with self.lock:
+                    toast = self.toasts.pop(message, None)
+                if toast and toast[0]:
+                    self.exit()
+                return True
+        return False
+
+    def exit(self):                                     #Exit after a fatal error
+        self.audio_manager.cleanup()
+        pygame.quit()
+        sys.exit(1)
+
+    def wait_for_exit(self, render_manager):            #Last resort when the player itself couldn't be built -- show the toasts and wait for the window to close or a click, nothing else can run
+        while True:
+            event = pygame.event.wait(IDLE_TICK_MS)
+            if event.type == pygame.QUIT:
+                self.exit()
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                self.click(event.pos)
+
+            render_manager.toasts_render()
+            render_manager.present()
+
+    def _wrap_text(self, text, max_width):                          #Method to wrap text to a width in pixels
         words = text.split(' ')
         lines = []
         current_line = []
-        current_width = 0
 
         for word in words:
-            if current_width + len(word) + 1 <= effective_width:
-                current_line.append(word)
-                current_width += len(word) + 1
-            else:
+            if current_line and self.error_font.size(' '.join(current_line + [word]))[0] > max_width:
                 lines.append(' '.join(current_line))
                 current_line = [word]
-                current_width = len(word) + 1
+            else:
+                current_line.append(word)
         
         if current_line:
             lines.append(' '.join(current_line))
         
         return lines
 
+def format_title(name):                             #Display title from a file name -- extension dropped, underscores to spaces, words capitalized
+    title = name.replace('.wav', '').replace('.mp3', '').replace('.ogg', '')
+    return ' '.join(word.capitalize() for word in title.split('_'))
+
+class TrackStore:                                   #Compact sorted track list -- names packed into one byte buffer with parallel offset arrays, O(1) indexing, display titles computed once and kept alongside
+    TITLE_UNSET = 0xFFFF                            #Title length marking a title not computed yet
+
+    def __init__(self, music_dir, names=(), durations=None):        #Names must already be sorted, durations in seconds with None for not parsed yet
+        self.music_dir = music_dir
+        self.dirs = ['']                                #Interned directory prefixes relative to music_dir, '' is music_dir itself
+        self.dir_lookup = {'': 0}
+        self.blob = bytearray()                         #Append-only UTF-8 names and titles, removed tracks leave garbage until compacted
+        self.garbage = 0
+        self.offsets = array('I')                       #Per track, in sorted order: name start and length in blob, title start and length, directory id, duration (NaN until parsed)
+        self.name_lengths = array('H')
+        self.title_offsets = array('I')
+        self.title_lengths = array('H')
+        self.dir_ids = array('I')                       #Not 'H', a library can have more than 65,535 directories
+        self.durations = array('f')
+
+        self.extend(names, durations)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):                       #Returns the name relative to music_dir, list style indexing
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        directory = self.dirs[self.dir_ids[index]]
+        name = self.base_name(index)
+        return os.path.join(directory, name) if directory else name
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __contains__(self, name):
+        return self.find(name) >= 0
+
+    def intern(self, directory):                        #Returns the id of a directory prefix, adding it if new
+        dir_id = self.dir_lookup.get(directory)
+        if dir_id is None:
+            dir_id = self.dir_lookup[directory] = len(self.dirs)
+            self.dirs.append(directory)
+        return dir_id
+
+    def base_name(self, index):                         #File name without its directory prefix
+        offset = self.offsets[index]
+        return self.blob[offset:offset + self.name_lengths[index]].decode('utf-8', 'surrogateescape')
+
+    def extend(self, names, durations=None):            #Bulk append of names known to sort after everything already stored, done column at a time since it runs on startup
+        count = len(names)
+        if not count:
+            return
+
+        if any('/' in name or os.sep in name for name in names):
+            directories, names = zip(*[os.path.split(name) for name in names])
+            self.dir_ids.extend(array('I', [self.intern(directory) for directory in directories]))
+        else:
+            self.dir_ids.extend(array('I', [0]) * count)
+
+        encoded = [name.encode('utf-8', 'surrogateescape') for name in names]
+        lengths = array('H', map(len, encoded))
+        self.offsets.extend(array('I', itertools.accumulate(lengths, initial=len(self.blob)))[:-1])
+        self.name_lengths.extend(lengths)
+        self.blob += b''.join(encoded)
+
+        self.title_offsets.extend(array('I', [0]) * count)
+        self.title_lengths.extend(array('H', [self.TITLE_UNSET]) * count)
+        if durations:
+            self.durations.extend(array('f', [math.nan if duration is None else duration for duration in durations]))
+        else:
+            self.durations.extend(array('f', [math.nan]) * count)
+
+    def insert(self, name, duration=None):              #Insert keeping the store sorted, returns the index -- names already present are left as they are
+        index = bisect.bisect_left(self, name)
+        if index < len(self) and self[index] == name:
+            return index
+
+        directory, base = os.path.split(name)
+        name_bytes = base.encode('utf-8', 'surrogateescape')
+        self.offsets.insert(index, len(self.blob))
+        self.name_lengths.insert(index, len(name_bytes))
+        self.title_offsets.insert(index, 0)
+        self.title_lengths.insert(index, self.TITLE_UNSET)
+        self.dir_ids.insert(index, self.intern(directory))
+        self.durations.insert(index, math.nan if duration is None else duration)
+        self.blob += name_bytes
+        return index
+
+    def remove(self, name):                             #Remove by name, returns the index it had or -1 if it wasn't present
+        index = self.find(name)
+        if index < 0:
+            return -1
+
+        self.garbage += self.name_lengths[index] + (self.title_lengths[index] if self.title_lengths[index] != self.TITLE_UNSET else 0)
+        for column in (self.offsets, self.name_lengths, self.title_offsets, self.title_lengths, self.dir_ids, self.durations):
+            del column[index]
+
+        if self.garbage > len(self.blob) // 2:
+            self.compact()
+        return index
+
+    def compact(self):                                  #Rewrite the blob without the bytes of removed tracks
+        blob = bytearray()
+        for index in range(len(self)):
+            offset = self.offsets[index]
+            self.offsets[index] = len(blob)
+            blob += self.blob[offset:offset + self.name_lengths[index]]
+
+            if self.title_lengths[index] != self.TITLE_UNSET:
+                offset = self.title_offsets[index]
+                self.title_offsets[index] = len(blob)
+                blob += self.blob[offset:offset + self.title_lengths[index]]
+        self.blob = blob
+        self.garbage = 0
+
+    def find(self, name):                               #Returns index of a name, -1 if not present
+        index = bisect.bisect_left(self, name)
+        if index < len(self) and self[index] == name:
+            return index
+        return -1
+
+    def title(self, index):                             #Returns the display title, formatted the first time it's asked for and stored from then on
+        length = self.title_lengths[index]
+        if length == self.TITLE_UNSET:
+            title_bytes = format_title(self.base_name(index)).encode('utf-8', 'surrogateescape')
+            self.title_offsets[index] = len(self.blob)
+            self.title_lengths[index] = length = len(title_bytes)
+            self.blob += title_bytes
+
+        offset = self.title_offsets[index]
+        return self.blob[offset:offset + length].decode('utf-8', 'surrogateescape')
+
+    def path(self, index):                              #Returns the full path of a track
+        return os.path.join(self.music_dir, self[index])
+
+    def get_duration(self, index):                      #Returns duration in seconds, None if not parsed yet and UNKNOWN_DURATION if parsing couldn't tell
+        duration = self.durations[index]
+        return None if math.isnan(duration) else duration
+
+    def set_duration(self, index, duration):
+        self.durations[index] = math.nan if duration is None else duration
+
+    def memory_usage(self):                             #Returns bytes held by the store's buffers
+        columns = (self.offsets, self.name_lengths, self.title_offsets, self.title_lengths, self.dir_ids, self.durations)
+        return len(self.blob) + sum(column.itemsize * len(column) for column in columns) + sum(sys.getsizeof(directory) for directory in self.dirs)
+
+class LibraryIndex:                                 #Persistent SQLite index of the library, stores file identity, duration and tags per track so startup doesn't re-list or re-parse unchanged files
+    def __init__(self, index_path):
+        self.lock = threading.Lock()                    #One connection shared with the background verify thread, guarded by this lock
+        self.connection = sqlite3.connect(index_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS tracks (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                duration REAL,
+                title TEXT,
+                artist TEXT,
+                album TEXT,
+                loudness REAL,
+                peak REAL,
+                PRIMARY KEY (dir, name)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS dirs (
+                dir TEXT PRIMARY KEY,
+                mtime INTEGER NOT NULL
+            );
+        ''')
+
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(tracks)')}          #Indexes from before loudness analysis
+        for column in ('loudness', 'peak'):
+            if column not in columns:
+                self.connection.execute(f'ALTER TABLE tracks ADD COLUMN {column} REAL')
+
+    def load(self, music_dir):                          #Returns sorted rows of (name, duration, title, artist, album) -- the directory is only re-listed if its mtime moved since the last scan
+        dir_mtime = os.stat(music_dir).st_mtime_ns
+
+        with self.lock:
+            stored = self.connection.execute('SELECT mtime FROM dirs WHERE dir = ?', (music_dir,)).fetchone()
+
+        if not stored or stored[0] != dir_mtime:
+            self.rescan(music_dir, dir_mtime)
+
+        with self.lock:
+            return self.connection.execute(
+                'SELECT name, duration, title, artist, album FROM tracks WHERE dir = ? ORDER BY name', (music_dir,)
+            ).fetchall()
+
+    def rescan(self, music_dir, dir_mtime):             #Re-list a directory, keeping rows whose size and mtime still match and resetting metadata for new or changed files
+        with self.lock:
+            stored = {name: (size, mtime) for name, size, mtime in self.connection.execute(
+                'SELECT name, size, mtime FROM tracks WHERE dir = ?', (music_dir,)
+            )}
+
+        changed = []
+        found = set()
+        with os.scandir(music_dir) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(SUPPORTED_EXTENSIONS) or not entry.is_file():
+                    continue
+
+                found.add(entry.name)
+                stat = entry.stat()
+                if stored.get(entry.name) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append((music_dir, entry.name, stat.st_size, stat.st_mtime_ns))
+
+        removed = [(music_dir, name) for name in stored if name not in found]
+
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO tracks (dir, name, size, mtime) VALUES (?, ?, ?, ?)', changed)
+            self.connection.executemany('DELETE FROM tracks WHERE dir = ? AND name = ?', removed)
+            self.connection.execute('INSERT OR REPLACE INTO dirs (dir, mtime) VALUES (?, ?)', (music_dir, dir_mtime))
+
+        if changed or removed:
+            print(f"Library index: {len(changed)} new or changed, {len(removed)} removed in {music_dir}")
+
+    def verify(self, music_dir):                        #Stat every indexed file and reset metadata for ones edited in place (which doesn't move the directory mtime), returns changed names
+        with self.lock:
+            stored = self.connection.execute('SELECT name, size, mtime FROM tracks WHERE dir = ?', (music_dir,)).fetchall()
+
+        changed = []
+        for name, size, mtime in stored:
+            try:
+                stat = os.stat(os.path.join(music_dir, name))
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime):
+                changed.append((music_dir, name, stat.st_size, stat.st_mtime_ns))
+
+        if changed:
+            with self.lock, self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO tracks (dir, name, size, mtime) VALUES (?, ?, ?, ?)', changed)
+
+        return [row[1] for row in changed]
+
+    def apply_changes(self, music_dir, added, removed, renamed):         #Apply a batch from the directory watcher -- renames keep their metadata, added or rewritten files are reset for parsing
+        rows = []
+        for name in added:
+            try:
+                stat = os.stat(os.path.join(music_dir, name))
+            except OSError:
+                continue
+            rows.append((music_dir, name, stat.st_size, stat.st_mtime_ns))
+
+        with self.lock, self.connection:
+            for old_name, new_name in renamed.items():
+                self.connection.execute('DELETE FROM tracks WHERE dir = ? AND name = ?', (music_dir, new_name))
+                self.connection.execute('UPDATE tracks SET name = ? WHERE dir = ? AND name = ?', (new_name, music_dir, old_name))
+            self.connection.executemany('INSERT OR REPLACE INTO tracks (dir, name, size, mtime) VALUES (?, ?, ?, ?)', rows)
+            self.connection.executemany('DELETE FROM tracks WHERE dir = ? AND name = ?', [(music_dir, name) for name in removed])
+            self.connection.execute('INSERT OR REPLACE INTO dirs (dir, mtime) VALUES (?, ?)', (music_dir, os.stat(music_dir).st_mtime_ns))
+
+    def set_metadata(self, music_dir, name, duration, title, artist, album):         #Store parsed duration and tags for a track
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE tracks SET duration = ?, title = ?, artist = ?, album = ? WHERE dir = ? AND name = ?',
+                (duration, title, artist, album, music_dir, name)
+            )
+
+    def set_loudness(self, music_dir, name, loudness, peak):        #Store analysed loudness in LUFS (None for silence or undecodable) and sample peak
+        with self.lock, self.connection:
+            self.connection.execute('UPDATE tracks SET loudness = ?, peak = ? WHERE dir = ? AND name = ?', (loudness, peak, music_dir, name))
+
+    def first_track(self, music_dir, name=None):        #Returns (name, loudness, peak) of the named track, or the first in a directory, without loading the rest -- None if it isn't indexed
+        with self.lock:
+            if name is not None:
+                return self.connection.execute('SELECT name, loudness, peak FROM tracks WHERE dir = ? AND name = ?', (music_dir, name)).fetchone()
+            return self.connection.execute('SELECT name, loudness, peak FROM tracks WHERE dir = ? ORDER BY name LIMIT 1', (music_dir,)).fetchone()
+
+    def load_loudness(self, music_dir):                 #Returns tuple of {name: (loudness, peak)} for analysed tracks and list of names still to analyse
+        with self.lock:
+            rows = self.connection.execute('SELECT name, loudness, peak FROM tracks WHERE dir = ?', (music_dir,)).fetchall()
+        return ({name: (loudness, peak) for name, loudness, peak in rows if peak is not None}, [name for name, loudness, peak in rows if peak is None])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+class SessionService:                               #Keeps what's playing between runs -- saves are debounced onto a background thread and written atomically, so neither the frame loop nor a crash mid-write can lose the last good copy
+    FIELDS = {'library': str, 'track': str, 'position': int, 'volume': int, 'queue': list, 'shuffle': bool}        #Saved fields and their types, anything else in the file is ignored
+
+    def __init__(self, session_path):
+        self.path = session_path
+        self.condition = threading.Condition()          #Guards the pending session and wakes the writer thread
+        self.pending = None                             #Latest session waiting to be written
+        self.first_change = self.last_change = None     #Monotonic times bounding the pending write's debounce
+        self.submitted = None                           #Last session passed to update, compared against to spot changes
+        self.running = True
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def load(self):                                     #Returns the saved session as a dictionary of FIELDS, empty if there is none or it can't be read
+        try:
+            with open(self.path, 'r') as file:
+                session = json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            print("Session restore failed: " + str(error))
+            return {}
+
+        if not isinstance(session, dict):
+            return {}
+        session = {key: value for key, value in session.items() if key in self.FIELDS and isinstance(value, self.FIELDS[key])}
+        if not all(isinstance(name, str) for name in session.get('queue', ())):           #Hand edited or corrupt, a queue with anything but names in it is dropped whole
+            session['queue'] = []
+        if 'position' in session:
+            session['position'] = max(0, session['position'])
+        if 'volume' in session:
+            session['volume'] = min(100, max(0, session['volume']))
+        return session
+
+    def update(self, session):                          #Main loop, once per frame -- a write is only scheduled when something but the position changed or playback moved SESSION_POSITION_STEP_MS
+        previous = self.submitted
+        if previous is not None and abs(session['position'] - previous['position']) < SESSION_POSITION_STEP_MS:
+            if all(session[key] == previous[key] for key in session if key != 'position'):
+                return
+
+        self.submitted = session
+        now = time.monotonic()
+        with self.condition:
+            self.pending = session
+            self.first_change = self.first_change or now
+            self.last_change = now
+            self.condition.notify()
+
+    def writer(self):                                   #Write the pending session once updates go quiet for SESSION_SAVE_DELAY_MS (or SESSION_MAX_DELAY_MS passes)
+        while True:
+            with self.condition:
+                while self.running and self.pending is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+
+                due = min(self.last_change + SESSION_SAVE_DELAY_MS / 1000, self.first_change + SESSION_MAX_DELAY_MS / 1000)
+                if time.monotonic() < due:
+                    self.condition.wait(due - time.monotonic())
+                    continue
+
+                session = self.pending
+                self.pending = None
+                self.first_change = self.last_change = None
+            self.write(session)
+
+    def write(self, session):                           #Write a temporary file beside the session file, flush it to disk, then rename it over -- readers see the old file or the new one, never part of either
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w') as file:
+                json.dump(session, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+        except OSError as error:
+            print("Saving session failed: " + str(error))
+
+    def stop(self, session=None):                       #End the writer thread, then write the given final session (or whatever was pending) -- called on quit
+        with self.condition:
+            self.running = False
+            session = session or self.pending
+            self.pending = None
+            self.condition.notify()
+        self.thread.join()                              #A write already under way finishes first, so it can't land over the final one
+
+        if session is not None:
+            self.write(session)
+
+class DirectoryWatcher:                             #Watches a music directory on a background thread with inotify (listing on a timer elsewhere), batching bursts of adds, removes and renames
+    IN_CLOSE_WRITE = 0x008                          #inotify event masks from <sys/inotify.h>
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct('iIII')            #wd, mask, cookie, name length
+
+    def __init__(self, music_dir, library_index=None):
+        self.music_dir = music_dir
+        self.library_index = library_index
+        self.lock = threading.Lock()
+        self.batches = []                               #Format of [(added, removed, renamed)], sets of names and {old: new}, waiting for the main loop
+        self.running = True
+        self.inotify_fd = self.inotify_init()
+        self.wake_read, self.wake_write = os.pipe() if self.inotify_fd is not None else (None, None)         #Lets stop() interrupt a blocking select, the watcher thread closes its own descriptors
+
+        threading.Thread(target=self.watch, daemon=True).start()
+
+    def inotify_init(self):                             #Returns an inotify descriptor watching the directory, None where inotify isn't available
+        if not sys.platform.startswith('linux'):
+            return None
+
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_DELETE
+            if libc.inotify_add_watch(fd, os.fsencode(self.music_dir), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def watch(self):                                    #Collect changes until the directory goes quiet for WATCH_DEBOUNCE_MS (or WATCH_MAX_DELAY_MS passes), then hand them over as one batch
+        added, removed, renamed = set(), set(), {}
+        moves = {}                                      #Format of {cookie: old name} for moves out waiting on their matching move in
+        first_change = last_change = None
+        listing = None if self.inotify_fd is not None else self.list_tracks()
+
+        while self.running:
+            try:
+                if self.inotify_fd is not None:
+                    timeout = WATCH_DEBOUNCE_MS / 1000 if first_change else None
+                    readable = select.select([self.inotify_fd, self.wake_read], [], [], timeout)[0]
+                    events = self.read_events() if self.inotify_fd in readable else []
+                else:
+                    time.sleep(WATCH_POLL_MS / 1000)
+                    events, listing = self.diff_listing(listing)
+            except OSError as error:
+                print("Directory watch failed: " + str(error))
+                break
+
+            for mask, cookie, name in events:
+                if not name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    if mask & self.IN_MOVED_TO and cookie in moves:         #Renamed to something that isn't a track, same as removed
+                        removed.add(moves.pop(cookie))
+                    continue
+
+                if mask & self.IN_MOVED_FROM:
+                    moves[cookie] = name
+                elif mask & self.IN_MOVED_TO and cookie in moves:
+                    old_name = moves.pop(cookie)
+                    old_name = next((old for old, new in renamed.items() if new == old_name), old_name)     #Chained renames collapse to one
+                    if old_name in added:
+                        added.discard(old_name)
+                        added.add(name)
+                    else:
+                        renamed[old_name] = name
+                elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                    added.add(name)
+                    removed.discard(name)
+                elif mask & self.IN_DELETE:
+                    added.discard(name)
+                    removed.add(name)
+
+                now = time.monotonic()
+                first_change = first_change or now
+                last_change = now
+
+            if not first_change:
+                continue
+
+            now = time.monotonic()
+            if now - last_change >= WATCH_DEBOUNCE_MS / 1000 or now - first_change >= WATCH_MAX_DELAY_MS / 1000:
+                removed.update(moves.values())              #Moved out of the directory entirely
+                moves.clear()
+                self.flush(added, removed, renamed)
+                added, removed, renamed = set(), set(), {}
+                first_change = last_change = None
+
+        if self.inotify_fd is not None:
+            for fd in (self.inotify_fd, self.wake_read, self.wake_write):
+                os.close(fd)
+
+    def read_events(self):                              #Returns list of (mask, cookie, name) from the inotify descriptor
+        data = os.read(self.inotify_fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((mask, cookie, name))
+        return events
+
+    def list_tracks(self):                              #Returns a dictionary of {name: (size, mtime)} for tracks in the directory
+        tracks = {}
+        with os.scandir(self.music_dir) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(SUPPORTED_EXTENSIONS) and entry.is_file():
+                    stat = entry.stat()
+                    tracks[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return tracks
+
+    def diff_listing(self, listing):                    #Fallback for platforms without inotify, turns a change in listing into the same events -- renames show up as a remove and an add
+        current = self.list_tracks()
+        events = [(self.IN_DELETE, 0, name) for name in listing if name not in current]
+        events.extend((self.IN_CLOSE_WRITE, 0, name) for name, identity in current.items() if listing.get(name) != identity)
+        return events, current
+
+    def flush(self, added, removed, renamed):           #Write a batch to the library index here on the watcher thread, then queue it for the main loop
+        if not (added or removed or renamed):
+            return
+
+        if self.library_index:
+            try:
+                self.library_index.apply_changes(self.music_dir, added, removed, renamed)
+            except Exception as error:
+                print("Library index update failed: " + str(error))
+
+        with self.lock:
+            self.batches.append((added, removed, renamed))
+        post_event(LIBRARY_EVENT)
+
+    def take_changes(self):                             #Returns and clears all waiting batches
+        with self.lock:
+            batches = self.batches
+            self.batches = []
+            return batches
+
+    def stop(self):                                     #Ask the watcher thread to exit, it closes its descriptors on the way out
+        self.running = False
+        if self.wake_write is not None:
+            os.write(self.wake_write, b'\0')
+
+class MetadataService:                              #Background pool that parses durations and tags off the main thread -- results are written to the index and handed to the main loop
+    PRIORITY_CURRENT = 0                            #Lower runs first, current and next tracks jump ahead of the library scan
+    PRIORITY_NEXT = 1
+    PRIORITY_BACKGROUND = 2
+
+    def __init__(self, instance, library_index=None, workers=METADATA_WORKERS):
+        self.instance = instance
+        self.library_index = library_index
+        self.requests = queue.PriorityQueue()           #Format of (priority, sequence, music_dir, name), sequence keeps FIFO order within a priority
+        self.results = queue.SimpleQueue()              #Format of (music_dir, name, duration, title, artist, album)
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.pending = {}                               #Format of {(music_dir, name): priority} for requests not started yet
+        self.notified = False                           #True while a METADATA_EVENT is already posted and not yet polled
+        self.running = True
+        self.done = 0
+        self.total = 0
+        self.workers = workers
+
+        for _ in range(workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def request(self, music_dir, name, priority=PRIORITY_BACKGROUND):        #Queue a track for parsing, re-queues at the higher priority if it's already waiting
+        key = (music_dir, name)
+        with self.lock:
+            queued_priority = self.pending.get(key)
+            if queued_priority is not None and queued_priority <= priority:
+                return
+            if queued_priority is None:
+                self.total += 1
+            self.pending[key] = priority
+
+        self.requests.put((priority, next(self.sequence), music_dir, name))
+
+    def worker(self):                                   #Parse queued tracks until stopped, skipping entries superseded by a higher priority request
+        while self.running:
+            priority, sequence, music_dir, name = self.requests.get()
+            if not self.running:
+                return
+
+            with self.lock:
+                if self.pending.get((music_dir, name)) != priority:
+                    continue
+                del self.pending[(music_dir, name)]
+
+            try:
+                result = self.parse(music_dir, name)
+                if self.library_index:
+                    self.library_index.set_metadata(*result)
+                self.results.put(result)
+            except Exception as error:
+                print(f"Metadata parse failed for {name}: {error}")
+
+            with self.lock:
+                self.done += 1
+                notify = not self.notified
+                self.notified = True
+            if notify:
+                post_event(METADATA_EVENT)
+
+    def parse(self, music_dir, name):                   #Synchronous parse, only ever called on a worker thread
+        media = self.instance.media_new(os.path.join(music_dir, name))
+        media.parse()
+        duration = media.get_duration()                 #Get duration can possibly return -1 if the file can't be read
+        result = (
+            music_dir,
+            name,
+            duration / 1000 if duration >= 0 else UNKNOWN_DURATION,
+            media.get_meta(vlc.Meta.Title),
+            media.get_meta(vlc.Meta.Artist),
+            media.get_meta(vlc.Meta.Album)
+        )
+        media.release()
+        return result
+
+    def poll(self):                                     #Drain finished results on the main thread
+        with self.lock:
+            self.notified = False
+
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def progress(self):                                 #Returns tuple of tracks parsed and tracks requested
+        with self.lock:
+            return (self.done, self.total)
+
+    def stop(self):                                     #Let workers exit, anything still queued is picked up again on next startup
+        self.running = False
+        for _ in range(self.workers):
+            self.requests.put((-1, -1, None, None))
+
+def waveform_worker_init():                     #Process pool initializer -- silent SDL audio so the mixer can decode without a sound card
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    pygame.mixer.init(WAVEFORM_SAMPLE_RATE, -16, 1)
+
+def loudness_worker_init():                     #Process pool initializer -- lowest CPU priority and a stereo mixer for decoding
+    if hasattr(os, 'nice'):
+        os.nice(19)
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    pygame.mixer.init(LOUDNESS_SAMPLE_RATE, -16, 2)
+
+def audio_decode(path):                         #Decode a file to float32 samples in -1 to 1 shaped (frames, channels) and its sample rate -- WAV directly, everything else through SDL_mixer in the worker's mixer format
+    if path.lower().endswith('.wav'):
+        with wave.open(path, 'rb') as wav_file:
+            (channels, width, rate) = (wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate())
+            frames = wav_file.readframes(wav_file.getnframes())
+        if width in (1, 2, 4):
+            samples = numpy.frombuffer(frames, {1: numpy.uint8, 2: numpy.int16, 4: numpy.int32}[width]).astype(numpy.float32)
+            if width == 1:
+                samples -= 128
+            samples /= 2 ** (width * 8 - 1)
+            return (samples[:len(samples) // channels * channels].reshape(-1, channels), rate)
+
+    samples = pygame.sndarray.array(pygame.mixer.Sound(path))
+    return (samples.reshape(len(samples), -1).astype(numpy.float32) / 32768, pygame.mixer.get_init()[0])
+
+def waveform_analyze(path, cache_file):         #Process pool job -- decode once, reduce to per-column peak and RMS scaled to 0-255, write the cache file atomically
+    samples = numpy.abs(audio_decode(path)[0].mean(axis=1))
+    envelope = numpy.zeros((2, WAVEFORM_BINS), numpy.uint8)
+
+    usable = len(samples) // WAVEFORM_BINS * WAVEFORM_BINS
+    if usable:
+        columns = samples[:usable].reshape(WAVEFORM_BINS, -1)
+        peak = columns.max(axis=1)
+        rms = numpy.sqrt((columns ** 2).mean(axis=1))
+        scale = peak.max() or 1
+        envelope[0] = peak / scale * 255
+        envelope[1] = rms / scale * 255
+
+    temporary_file = cache_file + '.tmp'
+    with open(temporary_file, 'wb') as file:
+        numpy.save(file, envelope)
+    os.replace(temporary_file, cache_file)
+    return cache_file
+
+def k_weighting_response(rate, frequencies):     #Power response |H(f)|^2 of the BS.1770 K-weighting filter (high shelf then high-pass) at a sample rate, biquads designed as in libebur128
+    K = math.tan(math.pi * 1681.974450955533 / rate)
+    Vh = 10 ** (3.999843853973347 / 20)
+    Vb = Vh ** 0.4996667741545416
+    Q = 0.7071752369554196
+    a0 = 1 + K / Q + K * K
+    shelf = ((Vh + Vb * K / Q + K * K) / a0, 2 * (K * K - Vh) / a0, (Vh - Vb * K / Q + K * K) / a0), (1, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0)
+
+    K = math.tan(math.pi * 38.13547087602444 / rate)
+    Q = 0.5003270373238773
+    a0 = 1 + K / Q + K * K
+    high_pass = (1, -2, 1), (1, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0)
+
+    z = numpy.exp(-2j * numpy.pi * frequencies / rate)                 #z^-1 on the unit circle
+    response = numpy.ones_like(z)
+    for (b, a) in (shelf, high_pass):
+        response *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return numpy.abs(response) ** 2
+
+def loudness_analyze(path):                     #Process pool job -- returns (integrated loudness in LUFS, sample peak), loudness is None for silence
+    (samples, rate) = audio_decode(path)
+    peak = float(numpy.abs(samples).max()) if samples.size else 0.0
+
+    step = rate // 10                                   #Mean square per 100 ms segment through the K-weighting, taken in the frequency domain (Parseval), a 400 ms gating block is four segments
+    weights = k_weighting_response(rate, numpy.fft.rfftfreq(step, 1 / rate))
+    weights[1:(step + 1) // 2] *= 2                     #One-sided spectrum, every bin but DC (and Nyquist) stands for two
+    weights /= step * step
+    if samples.shape[1] == 1:                           #Mono counts as dual mono, it plays through both speakers (as SDL_mixer decodes it anyway)
+        weights *= 2
+
+    segments = len(samples) // step
+    powers = numpy.empty(segments)
+    for start in range(0, segments, 300):               #A few hundred segments at a time keeps the FFT buffers small
+        chunk = samples[start * step:min(segments, start + 300) * step].reshape(-1, step, samples.shape[1])
+        spectrum = numpy.fft.rfft(chunk, axis=1)
+        powers[start:start + len(chunk)] = ((spectrum.real ** 2 + spectrum.imag ** 2) * weights[None, :, None]).sum(axis=(1, 2))
+
+    if segments < 4:
+        return (None, peak)
+
+    blocks = numpy.convolve(powers, numpy.ones(4) / 4, 'valid')
+    blocks = blocks[blocks > 10 ** ((-70 + 0.691) / 10)]            #Absolute gate
+    if not blocks.size:
+        return (None, peak)
+
+    relative_gate = blocks.mean() / 10                  #10 LU below the absolutely gated loudness
+    blocks = blocks[blocks > relative_gate]
+    return (float(-0.691 + 10 * numpy.log10(blocks.mean())), peak)
+
+def normalization_gain(loudness, peak):         #Gain in dB bringing a loudness to LUFS LOUDNESS_TARGET_LUFS, boost capped and held below clipping, 0 when there's no loudness
+    if loudness is None:
+        return 0.0
+
+    gain = min(LOUDNESS_TARGET_LUFS - loudness, LOUDNESS_MAX_BOOST_DB)
+    if peak > 0:
+        gain = min(gain, -20 * math.log10(peak))
+    return gain
+
+class LoudnessService:                              #Background EBU R128 analysis -- a niced process pool works through tracks the index has no loudness for, a couple at a time, each result saved as it lands so a large library resumes where it left off
+    def __init__(self, library_index):
+        self.library_index = library_index
+        self.lock = threading.Lock()
+        self.queue = deque()                            #Format of [(music_dir, name)], waiting to be handed to the pool
+        self.queued = set()
+        self.in_flight = 0
+        self.results = deque()                          #Format of [(music_dir, name, loudness, peak)], drained by the main loop
+        self.notified = False
+        self.pool = None
+
+        try:
+            self.pool = concurrent.futures.ProcessPoolExecutor(LOUDNESS_WORKERS, mp_context=multiprocessing.get_context('spawn'), initializer=loudness_worker_init)
+        except Exception as error:
+            print("Loudness analysis unavailable: " + str(error))
+
+    def request(self, music_dir, name, first=False):    #Queue a track, first puts it at the front (current and next tracks)
+        with self.lock:
+            key = (music_dir, name)
+            if key in self.queued:
+                if not first or key not in self.queue:  #Already waiting, or already with the pool
+                    return
+                self.queue.remove(key)
+            self.queued.add(key)
+            if first:
+                self.queue.appendleft(key)
+            else:
+                self.queue.append(key)
+        self.pump()
+
+    def pump(self):                                     #Keep LOUDNESS_IN_FLIGHT tracks with the pool
+        while self.pool:
+            with self.lock:
+                if self.in_flight >= LOUDNESS_IN_FLIGHT or not self.queue:
+                    return
+                (music_dir, name) = self.queue.popleft()
+                self.in_flight += 1
+
+            try:
+                future = self.pool.submit(loudness_analyze, os.path.join(music_dir, name))
+            except RuntimeError:                        #Pool shut down
+                return
+            future.add_done_callback(lambda future, music_dir=music_dir, name=name: self.finished(music_dir, name, future))
+
+    def finished(self, music_dir, name, future):        #Pool callback thread -- save the result, hand it to the main loop, start the next track
+        if self.pool is None or future.cancelled():     #Stopped while this one was running, the index may be closed already
+            return
+
+        try:
+            (loudness, peak) = future.result()
+        except Exception as error:
+            print(f"Loudness analysis failed for {name}: {error}")
+            (loudness, peak) = (None, 0.0)              #Saved with no loudness so it isn't retried every run
+
+        try:
+            self.library_index.set_loudness(music_dir, name, loudness, peak)
+        except Exception as error:
+            print("Saving loudness failed: " + str(error))
+
+        with self.lock:
+            self.in_flight -= 1
+            self.queued.discard((music_dir, name))
+            self.results.append((music_dir, name, loudness, peak))
+            notify = not self.notified
+            self.notified = True
+        if notify:
+            post_event(LOUDNESS_EVENT)
+        self.pump()
+
+    def restore(self, music_dir, known):                #Hand results saved in the index by an earlier run to the main loop, known is {name: (loudness, peak)}
+        with self.lock:
+            self.results.extend((music_dir, name, loudness, peak) for name, (loudness, peak) in known.items())
+            notify = not self.notified
+            self.notified = True
+        if notify:
+            post_event(LOUDNESS_EVENT)
+
+    def poll(self, limit=LOUDNESS_APPLY_BATCH):         #Take up to limit results on the main thread, a big backlog (a library's worth restored at startup) is spread over several wakeups
+        with self.lock:
+            results = [self.results.popleft() for _ in range(min(limit, len(self.results)))]
+            self.notified = bool(self.results)
+        if self.notified:
+            post_event(LOUDNESS_EVENT)
+        return results
+
+    def clear(self):                                    #Drop everything queued, e.g. when the library is replaced -- unfinished tracks are picked up the next time it's loaded
+        with self.lock:
+            self.queue.clear()
+            self.queued.clear()
+
+    def stop(self):
+        self.clear()
+        (pool, self.pool) = (self.pool, None)
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+class WaveformService:                              #Peak/RMS envelopes for the waveform seekbar -- analysed in a process pool, cached on disk keyed by file identity and memory-mapped back in
+    def __init__(self, cache_dir=WAVEFORM_DIR):
+        self.cache_dir = cache_dir
+        self.loaded = OrderedDict()                     #Format of {path: envelope}, most recently used last
+        self.pending = {}                               #Format of {path: future} for analyses not yet picked up
+        self.failed = set()                             #Paths that couldn't be decoded, drawn flat instead of retried
+        self.pool = None
+
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.pool = concurrent.futures.ProcessPoolExecutor(WAVEFORM_WORKERS, mp_context=multiprocessing.get_context('spawn'), initializer=waveform_worker_init)
+            for _ in range(WAVEFORM_WORKERS):           #Start the workers now, spawning them on the first request would cost the first track its second
+                self.pool.submit(int)
+        except Exception as error:
+            print("Waveform analysis unavailable: " + str(error))
+
+    def cache_file(self, path):                         #Cache file for a path, keyed on path, size and modification time so edited files are analysed again
+        stat = os.stat(path)
+        key = hashlib.sha1(f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}".encode()).hexdigest()[:20]
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def get(self, path):                                #Returns the envelope (2 x WAVEFORM_BINS uint8, peak then RMS) or None while it's being analysed -- cheap enough to call every frame
+        envelope = self.loaded.get(path)
+        if envelope is not None:
+            self.loaded.move_to_end(path)
+            return envelope
+
+        if path in self.failed or self.pool is None:
+            return None
+
+        future = self.pending.get(path)
+        if future is not None and not future.done():
+            return None
+
+        try:
+            if future is not None:
+                del self.pending[path]
+                future.result()                         #Raises the worker's error if the analysis failed
+
+            cache_file = self.cache_file(path)
+            if not os.path.exists(cache_file):
+                self.request(path, cache_file)
+                return None
+
+            envelope = numpy.load(cache_file, mmap_mode='r')
+        except Exception as error:
+            print(f"Waveform failed for {os.path.basename(path)}: {error}")
+            self.failed.add(path)
+            return None
+
+        self.loaded[path] = envelope
+        if len(self.loaded) > WAVEFORM_MEMORY:
+            self.loaded.popitem(last=False)
+        return envelope
+
+    def request(self, path, cache_file=None):           #Start analysing a file if it isn't cached, loaded or already underway
+        if self.pool is None or path in self.loaded or path in self.pending or path in self.failed:
+            return
+
+        try:
+            cache_file = cache_file or self.cache_file(path)
+            if os.path.exists(cache_file):
+                return
+            future = self.pool.submit(waveform_analyze, path, cache_file)
+        except Exception as error:
+            print(f"Waveform request failed for {os.path.basename(path)}: {error}")
+            self.failed.add(path)
+            return
+
+        self.pending[path] = future
+        future.add_done_callback(lambda future: post_event(WAVEFORM_EVENT, path=path))
+
+    def stop(self):                                     #Drop queued analyses and let the workers exit
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+def id3_picture(file):                          #Returns (image bytes, MIME type) from an ID3v2 tag's APIC (or v2.2 PIC) frame, the front cover if there is one, else None
+    header = file.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return None
+
+    (version, flags) = (header[3], header[5])
+    size = sum((byte & 0x7f) << (7 * (3 - index)) for index, byte in enumerate(header[6:10]))
+    tag = file.read(min(size, ART_MAX_BYTES))
+    if flags & 0x80 and version < 4:                    #Whole tag unsynchronised
+        tag = tag.replace(b'\xff\x00', b'\xff')
+
+    position = 0
+    if flags & 0x40 and version >= 3:                   #Skip the extended header
+        extended_size = struct.unpack('>I', tag[:4])[0]
+        position = sum((byte & 0x7f) << (7 * (3 - index)) for index, byte in enumerate(tag[:4])) if version == 4 else extended_size + 4
+
+    (id_size, size_size) = (3, 3) if version == 2 else (4, 4)
+    found = None
+    while position + id_size + size_size <= len(tag):
+        frame_id = tag[position:position + id_size]
+        if not frame_id.strip(b'\0'):                  #Padding
+            break
+
+        size_bytes = tag[position + id_size:position + id_size + size_size]
+        if version == 4:
+            frame_size = sum((byte & 0x7f) << (7 * (3 - index)) for index, byte in enumerate(size_bytes))
+        else:
+            frame_size = int.from_bytes(size_bytes, 'big')
+        body_start = position + id_size + size_size + (0 if version == 2 else 2)
+        body = tag[body_start:body_start + frame_size]
+        position = body_start + frame_size
+
+        if frame_id not in (b'APIC', b'PIC'):
+            continue
+        if version == 4 and tag[body_start - 1] & 0x02:     #Frame level unsynchronisation
+            body = body.replace(b'\xff\x00', b'\xff')
+
+        encoding = body[0]
+        if frame_id == b'PIC':
+            (mime, rest) = ('image/' + body[1:4].decode('latin-1').lower(), body[4:])
+        else:
+            (mime, _, rest) = body[1:].partition(b'\0')
+            mime = mime.decode('latin-1').lower()
+        picture_type = rest[0]
+        terminator = b'\0\0' if encoding in (1, 2) else b'\0'
+        end = rest.find(terminator, 1)
+        while terminator == b'\0\0' and end > 0 and (end - 1) % 2:    #UTF-16 terminators sit on a character boundary
+            end = rest.find(terminator, end + 1)
+        if end < 0:
+            continue
+
+        picture = (rest[end + len(terminator):], mime)
+        if picture_type == 3:                           #Front cover
+            return picture
+        found = found or picture
+    return found
+
+def flac_picture(block):                        #Returns (image bytes, MIME type) from a FLAC picture block, the format of Vorbis METADATA_BLOCK_PICTURE
+    mime_length = struct.unpack('>I', block[4:8])[0]
+    mime = block[8:8 + mime_length].decode('latin-1').lower()
+    position = 8 + mime_length
+    description_length = struct.unpack('>I', block[position:position + 4])[0]
+    position += 4 + description_length + 16             #Description, then width, height, depth and colour count
+    data_length = struct.unpack('>I', block[position:position + 4])[0]
+    return (block[position + 4:position + 4 + data_length], mime)
+
+def ogg_picture(file):                          #Returns (image bytes, MIME type) from an Ogg Vorbis/Opus comment header's METADATA_BLOCK_PICTURE (or old COVERART), else None
+    packets = [b'']
+    read = 0
+    while len(packets) < 3 and read < ART_MAX_BYTES:    #Reassemble packets page by page until the comment header (the second) is complete
+        header = file.read(27)
+        if len(header) < 27 or header[:4] != b'OggS':
+            return None
+        lacing = file.read(header[26])
+        data = file.read(sum(lacing))
+        read += 27 + len(lacing) + len(data)
+
+        position = 0
+        for length in lacing:
+            packets[-1] += data[position:position + length]
+            position += length
+            if length < 255:                            #A lacing value under 255 ends a packet
+                packets.append(b'')
+
+    if len(packets) < 3:
+        return None
+    comments = packets[1]
+    for magic in (b'\x03vorbis', b'OpusTags'):
+        if comments.startswith(magic):
+            position = len(magic)
+            break
+    else:
+        return None
+
+    vendor_length = struct.unpack('<I', comments[position:position + 4])[0]
+    position += 4 + vendor_length
+    count = struct.unpack('<I', comments[position:position + 4])[0]
+    position += 4
+    found = None
+    for _ in range(count):
+        length = struct.unpack('<I', comments[position:position + 4])[0]
+        (key, _, value) = comments[position + 4:position + 4 + length].partition(b'=')
+        position += 4 + length
+
+        key = key.upper()
+        if key == b'METADATA_BLOCK_PICTURE':
+            block = base64.b64decode(value)
+            if block[:4] == b'\0\0\0\x03':              #Front cover
+                return flac_picture(block)
+            found = found or flac_picture(block)
+        elif key == b'COVERART':
+            found = found or (base64.b64decode(value), 'image/jpeg')
+    return found
+
+def folder_picture(path):                       #Returns the path of a cover image beside a track (folder.jpg and friends), else None
+    try:
+        images = {os.path.splitext(name)[0].lower(): name for name in os.listdir(os.path.dirname(path) or '.') if name.lower().endswith(('.jpg', '.jpeg', '.png'))}
+    except OSError:
+        return None
+
+    for name in ART_FOLDER_NAMES:
+        if name in images:
+            return os.path.join(os.path.dirname(path), images[name])
+    return None
+
+def art_load(path, size):                       #Worker thread job -- embedded art, else a folder image, decoded and scaled to fit a size x size square, returns the surface or None
+    picture = None
+    with open(path, 'rb') as file:
+        if path.lower().endswith('.mp3'):
+            picture = id3_picture(file)
+        elif path.lower().endswith('.ogg'):
+            picture = ogg_picture(file)
+
+    if picture:
+        image = pygame.image.load(io.BytesIO(picture[0]), picture[1].rpartition('/')[2] or 'jpg')
+    else:
+        image_path = folder_picture(path)
+        if not image_path:
+            return None
+        image = pygame.image.load(image_path)
+
+    (width, height) = image.get_size()
+    scale = size / max(width, height)
+    return pygame.transform.smoothscale(image.convert(32) if image.get_bitsize() < 24 else image, (max(1, round(width * scale)), max(1, round(height * scale))))
+
+class ArtService:                                   #Cover art thumbnails -- extracted, decoded and scaled on worker threads, cached on disk as pre-scaled PNGs keyed by file identity, kept converted in a memory-bounded LRU
+    def __init__(self, cache_dir=ART_DIR):
+        self.cache_dir = cache_dir
+        self.loaded = OrderedDict()                     #Format of {(path, size): surface or None}, most recently used last, None for tracks without art
+        self.loaded_bytes = 0
+        self.pending = {}                               #Format of {(path, size): future}
+        self.pool = concurrent.futures.ThreadPoolExecutor(ART_WORKERS, thread_name_prefix='art')
+
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as error:
+            print("Art cache unavailable: " + str(error))
+
+    def cache_file(self, path, size):                   #Cache file for a path at a size, keyed on path, size on disk and modification time so replaced art is picked up
+        stat = os.stat(path)
+        key = hashlib.sha1(f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{size}".encode()).hexdigest()[:20]
+        return os.path.join(self.cache_dir, key + '.png')
+
+    def load(self, path, size):                         #Worker thread -- read the thumbnail from disk, or make it and save it (an empty file marks a track with no art)
+        cache_file = self.cache_file(path, size)
+        try:
+            if os.path.exists(cache_file):
+                return pygame.image.load(cache_file) if os.path.getsize(cache_file) else None
+        except pygame.error:
+            pass                                        #Damaged cache file, make it again
+
+        try:
+            image = art_load(path, size)
+        except Exception as error:
+            print(f"Art failed for {os.path.basename(path)}: {error}")
+            image = None
+
+        try:
+            with open(cache_file + '.tmp', 'wb') as file:
+                if image:
+                    pygame.image.save(image, file, 'png')
+            os.replace(cache_file + '.tmp', cache_file)
+        except Exception as error:
+            print("Saving art failed: " + str(error))
+        return image
+
+    def get(self, path, size):                          #Returns the art for a track at a size, or None when it has none or is still loading -- cheap enough to call every frame
+        key = (path, size)
+        if key in self.loaded:
+            self.loaded.move_to_end(key)
+            return self.loaded[key]
+
+        future = self.pending.get(key)
+        if future is None:
+            self.request(path, size)
+            return None
+        if not future.done():
+            return None
+
+        del self.pending[key]
+        try:
+            image = future.result()
+            image = image and image.convert()           #Pixel format conversion needs the display, so it happens here, once
+        except Exception as error:
+            print(f"Art failed for {os.path.basename(path)}: {error}")
+            image = None
+
+        self.loaded[key] = image
+        self.loaded_bytes += image.get_width() * image.get_height() * image.get_bytesize() if image else 0
+        while self.loaded_bytes > ART_MEMORY and len(self.loaded) > 1:
+            evicted = self.loaded.popitem(last=False)[1]
+            self.loaded_bytes -= evicted.get_width() * evicted.get_height() * evicted.get_bytesize() if evicted else 0
+        return image
+
+    def request(self, path, size):                      #Start loading art if it isn't loaded or underway, drops stale requests left by fast skipping
+        key = (path, size)
+        if key in self.loaded or key in self.pending:
+            return
+
+        for stale_key in list(self.pending)[:-ART_WORKERS * 2]:
+            if self.pending[stale_key].cancel():
+                del self.pending[stale_key]
+
+        future = self.pool.submit(self.load, path, size)
+        self.pending[key] = future
+        future.add_done_callback(lambda future: post_event(ART_EVENT))
+
+    def stop(self):                                     #Drop queued loads and let the threads exit
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+class SpectrumAnalyzer:                             #Spectrum bars from PCM tapped off a second, silent libvlc player running just ahead of the audible one -- the ring is pinned to track time, so each frame reads the window at the audible position; analysed once per drawn frame under a time budget, nothing runs while off
+    def __init__(self, instance):                       #libvlc's audio callbacks replace a player's sound output rather than tee it, so the audible player can't be tapped without taking over output (and the gapless and fade timing that goes with it)
+        self.instance = instance
+        self.enabled = False
+        self.player = None
+        self.path = None
+        self.callbacks = None                           #ctypes callback objects, kept referenced for as long as libvlc may call them
+        self.lock = threading.Lock()                    #Guards the ring between libvlc's audio thread and the render thread
+        self.ring = numpy.zeros(SPECTRUM_RATE * SPECTRUM_RING_MS // 1000, numpy.float32)
+        self.written = 0                                #Total samples ever written, the ring position is this modulo its size
+        self.origin = None                              #(sample count, track ms) of the first buffer after a start or seek, maps ring samples to track time
+        self.start_ms = None                            #Track ms the analysis player was started or seeked to, pins the origin at the next buffer
+        self.seek_ms = None                             #Target of a seek whose flush hasn't arrived, buffers from before it may still come through
+        self.audible_ms = 0                             #Audible player's position as of the last sync
+        self.window = numpy.hanning(SPECTRUM_FFT_SIZE).astype(numpy.float32) / 32768
+        self.band_edges = {}                            #Format of {band count: FFT bin edges}
+        self.bands = SPECTRUM_BANDS
+        self.frame_skip = 1                             #Analyse every nth frame, raised past the band floor when still over budget
+        self.frame = 0
+        self.under_budget = 0                           #Consecutive cheap frames, a second's worth steps quality back up
+        self.levels = None                              #Bar heights 0-1 with fall-off, None until the first analysis
+
+    def toggle(self):                                   #Turn the visualizer on or off, returns the new state
+        if self.enabled:
+            self.enabled = False
+            self.player.stop()
+            self.path = None
+            self.levels = None
+            return False
+
+        if self.player is None:
+            self.player = self.instance.media_player_new()
+            self.callbacks = (
+                vlc.CallbackDecorators.AudioPlayCb(self.on_play),
+                vlc.CallbackDecorators.AudioPauseCb(lambda data, pts: None),
+                vlc.CallbackDecorators.AudioResumeCb(lambda data, pts: None),
+                vlc.CallbackDecorators.AudioFlushCb(self.on_flush),
+                vlc.CallbackDecorators.AudioDrainCb(lambda data: None),
+            )
+            self.player.audio_set_callbacks(*self.callbacks, None)
+            self.player.audio_set_format('S16N', SPECTRUM_RATE, 1)
+
+        self.enabled = True
+        return True
+
+    def on_play(self, data, samples, count, pts):       #libvlc audio thread -- copy a buffer of mono int16 into the ring
+        pcm = numpy.frombuffer(ctypes.string_at(samples, count * 2), numpy.int16)[-len(self.ring):]
+        size = len(self.ring)
+
+        with self.lock:
+            if self.start_ms is not None:
+                self.origin = (self.written, self.start_ms)
+                self.start_ms = None
+
+            start = self.written % size
+            end = start + len(pcm)
+            if end <= size:
+                self.ring[start:end] = pcm
+            else:
+                self.ring[start:] = pcm[:size - start]
+                self.ring[:end - size] = pcm[size - start:]
+            self.written += len(pcm)
+
+    def on_flush(self, data, pts):                      #libvlc audio thread -- a seek landed, whatever was pinned before it came from the old position
+        with self.lock:
+            if self.seek_ms is not None:
+                self.start_ms = self.seek_ms
+                self.seek_ms = None
+
+    def sample_at(self, time_ms):                       #Ring sample count at a track position, None before the first buffer
+        if self.origin is None:
+            return None
+        return self.origin[0] + int((time_ms - self.origin[1]) * SPECTRUM_RATE / 1000)
+
+    def covers(self, time_ms):                          #Whether the window ending at a track position is in the ring
+        end = self.sample_at(time_ms)
+        return end is not None and self.written - len(self.ring) + SPECTRUM_FFT_SIZE <= end <= self.written
+
+    def sync(self, path, time_ms, playing):             #Keep the analysis player on the audible one's track and pause state, a little ahead of it -- re-seeked only once the audible position leaves the ring, cheap to call every frame
+        self.audible_ms = time_ms
+        if path != self.path:
+            self.path = path
+            media = self.instance.media_new(path)
+            media.add_option(f':start-time={(time_ms + SPECTRUM_LEAD_MS) / 1000:.3f}')
+            with self.lock:
+                self.origin = None
+                self.start_ms = time_ms + SPECTRUM_LEAD_MS
+                self.seek_ms = None
+            self.player.set_media(media)
+            self.player.play()
+            return
+
+        if playing != (self.player.get_state() == vlc.State.Playing):
+            self.player.set_pause(0 if playing else 1)
+        elif playing and self.origin is not None and self.start_ms is None and self.seek_ms is None and not self.covers(time_ms):
+            with self.lock:
+                self.start_ms = self.seek_ms = time_ms + SPECTRUM_LEAD_MS
+            self.player.set_time(int(time_ms + SPECTRUM_LEAD_MS))
+
+    def get_band_edges(self, bands):                    #FFT bin edges for log-spaced bands from 40 Hz to 16 kHz, each band at least one bin wide
+        edges = self.band_edges.get(bands)
+        if edges is None:
+            edges = (numpy.geomspace(40, 16000, bands + 1) * SPECTRUM_FFT_SIZE / SPECTRUM_RATE).astype(numpy.intp)
+            for index in range(1, len(edges)):
+                edges[index] = max(edges[index], edges[index - 1] + 1)
+            edges = self.band_edges[bands] = edges
+        return edges
+
+    def analyse(self):                                  #Returns bar levels for this frame -- recomputed every frame_skip frames, degrades (fewer bands, then lower rate) when a pass runs over budget
+        self.frame += 1
+        if self.levels is not None and self.frame % self.frame_skip:
+            return self.levels
+
+        start = time.perf_counter()
+        with self.lock:
+            end = self.sample_at(self.audible_ms) if self.covers(self.audible_ms) else self.written         #Newest samples until the analysis player has caught up
+            block = numpy.take(self.ring, numpy.arange(end - SPECTRUM_FFT_SIZE, end), mode='wrap')
+
+        spectrum = numpy.abs(numpy.fft.rfft(block * self.window))
+        edges = self.get_band_edges(self.bands)
+        power = numpy.add.reduceat(spectrum, edges[:-1]) / numpy.diff(edges)
+        levels = numpy.clip((20 * numpy.log10(power + 1e-9) + 20) / 60, 0, 1)          #-40 dB to +20 dB of normalized magnitude onto 0-1
+
+        if self.levels is not None and len(self.levels) == len(levels):                 #Bars fall off gradually rather than flicker
+            levels = numpy.maximum(levels, self.levels * 0.85)
+        self.levels = levels
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms > SPECTRUM_BUDGET_MS:
+            self.under_budget = 0
+            if self.bands > SPECTRUM_MIN_BANDS:
+                self.bands //= 2
+            elif self.frame_skip < 4:
+                self.frame_skip *= 2
+        elif elapsed_ms < SPECTRUM_BUDGET_MS / 3:
+            self.under_budget += 1
+            if self.under_budget >= ACTIVE_FPS:
+                self.under_budget = 0
+                if self.frame_skip > 1:
+                    self.frame_skip //= 2
+                elif self.bands < SPECTRUM_BANDS:
+                    self.bands *= 2
+        return levels
+
+    def stop(self):                                     #Release the analysis player
+        if self.player:
+            self.player.stop()
+            self.player.release()
+            self.player = None
+        self.enabled = False
+
+class SearchIndex:                                  #In-memory trigram index over track titles, tags and paths for ranked fuzzy search -- documents are added and removed one at a time as tracks are learned
+    def __init__(self):
+        self.lock = threading.RLock()                   #Queries run on a worker while the main thread keeps indexing
+        self.clear()
+
+    def clear(self):
+        self.postings = {}                              #Format of {trigram: array of doc ids}
+        self.doc_ids = {}                               #Format of {name: doc id}
+        self.doc_names = []                             #Doc id to name and to padded searchable text, None once removed
+        self.doc_texts = []
+        self.vocabulary = {}                            #Format of {word: documents containing it}, typo correction looks words up here
+        self.alphabet = set()                           #Characters seen in indexed words, what corrections are built from
+        self.removed = 0
+
+    @staticmethod
+    def words(text):                                    #Lowercase alphanumeric words of a string
+        return re.findall(r'[^\W_]+', text.lower())
+
+    @staticmethod
+    def padded(words):                                  #Searchable text, each word padded as '  word ' so word starts carry extra weight and short words still produce trigrams
+        return ''.join('  ' + word + ' ' for word in words)
+
+    @staticmethod
+    def trigrams(text):                                 #Trigrams of padded text, the all-space one between words would match every document so it's dropped
+        grams = {text[i:i + 3] for i in range(len(text) - 2)}
+        grams.discard('   ')
+        return grams
+
+    def add(self, name, title, tags=None):              #Index or re-index a track, does nothing if its searchable text hasn't changed
+        words = list(dict.fromkeys(self.words(' '.join(filter(None, (title, *(tags or ()), name))))))        #Titles mostly repeat the file name, keep each word once
+        text = self.padded(words)
+
+        with self.lock:
+            doc_id = self.doc_ids.get(name)
+            if doc_id is not None:
+                if self.doc_texts[doc_id] == text:
+                    return
+                self.remove(name)
+
+            doc_id = len(self.doc_names)
+            self.doc_ids[name] = doc_id
+            self.doc_names.append(name)
+            self.doc_texts.append(text)
+
+            self.post(doc_id, text)
+
+    def post(self, doc_id, text):                       #Append a document to the postings of each of its trigrams and count its words
+        vocabulary = self.vocabulary
+        for word in text.split():
+            if word not in vocabulary:
+                vocabulary[word] = 0
+                self.alphabet.update(word)
+            vocabulary[word] += 1
+
+        postings = self.postings
+        for gram in self.trigrams(text):
+            posting = postings.get(gram)
+            if posting is None:
+                posting = postings[gram] = array('I')
+            posting.append(doc_id)
+
+    def remove(self, name):                             #Drop a track, its postings are left as tombstones until enough pile up to rebuild
+        with self.lock:
+            doc_id = self.doc_ids.pop(name, None)
+            if doc_id is None:
+                return
+
+            for word in self.doc_texts[doc_id].split():
+                self.vocabulary[word] -= 1
+                if not self.vocabulary[word]:
+                    del self.vocabulary[word]
+
+            self.doc_names[doc_id] = None
+            self.doc_texts[doc_id] = None
+            self.removed += 1
+            if self.removed > 1000 and self.removed > len(self.doc_names) // 2:
+                self.rebuild()
+
+    def rebuild(self):                                  #Re-index live documents under fresh ids, caller holds the lock
+        live = [(name, text) for name, text in zip(self.doc_names, self.doc_texts) if name is not None]
+        self.clear()
+        for name, text in live:
+            self.doc_ids[name] = len(self.doc_names)
+            self.doc_names.append(name)
+            self.doc_texts.append(text)
+            self.post(self.doc_ids[name], text)
+
+    def search(self, query, limit=SEARCH_RESULTS):      #Returns up to limit names ranked by share of query trigrams matched, with a bonus for whole-word prefix matches -- topped up with typo corrections when that finds too few
+        words = self.words(query)
+        if not words:
+            return []
+
+        with self.lock:
+            scored = self.score(words)
+            if len(scored) < limit:
+                corrected = [self.correct(word) for word in words]
+                if corrected != words:
+                    found = {doc_id for score, length, doc_id in scored}
+                    scored += [(score - 1, length, doc_id) for score, length, doc_id in self.score(corrected) if doc_id not in found]      #Ranked below anything matching as typed
+
+            return [self.doc_names[doc_id] for score, length, doc_id in heapq.nlargest(limit, scored)]
+
+    def score(self, words):                             #Returns list of (score, -text length, doc id) for documents matching enough of the words' trigrams
+        grams = self.trigrams(self.padded(words))
+        needed = max(1, math.ceil(len(grams) * SEARCH_MATCH_RATIO))
+
+        postings = sorted((posting for posting in map(self.postings.get, grams) if posting), key=len)
+        counted = []                                    #Rarest lists first, common trigrams past the budget are only checked on the candidates
+        total = 0
+        for posting in postings:
+            if counted and total + len(posting) > SEARCH_POSTINGS_BUDGET:
+                break
+            counted.append(posting[-SEARCH_POSTINGS_BUDGET:])           #A trigram in nearly every document, any slice of it is as good as the rest and the newest ids are the least likely to be tombstones
+            total += len(counted[-1])
+
+        threshold = max(1, needed - (len(postings) - len(counted)))        #Hits a document needs in the counted lists to still reach needed with every uncounted one
+        counts = Counter(itertools.chain.from_iterable(counted))
+        texts = self.doc_texts
+        candidates = [doc_id for doc_id, count in counts.items() if count >= threshold and texts[doc_id] is not None]
+        if len(candidates) > SEARCH_CANDIDATES:
+            candidates = heapq.nlargest(SEARCH_CANDIDATES, candidates, key=counts.__getitem__)
+
+        prefixes = [' ' + word for word in words]
+        scored = []
+        for doc_id in candidates:
+            text = texts[doc_id]
+            matches = sum(1 for gram in grams if gram in text)
+            if matches < needed:
+                continue
+
+            score = matches / len(grams)
+            if all(prefix in text for prefix in prefixes):
+                score += 0.5
+            scored.append((score, -len(text), doc_id))
+        return scored
+
+    def correct(self, word):                            #Returns the most common indexed word one edit (insert, delete, substitute or swap of neighbours) from word, or word itself if it's indexed or nothing is that close
+        vocabulary = self.vocabulary
+        if word in vocabulary:
+            return word
+
+        alphabet = self.alphabet if len(self.alphabet) <= 64 else set('abcdefghijklmnopqrstuvwxyz0123456789').union(word)         #Large scripts would make thousands of variants per word
+        splits = [(word[:index], word[index:]) for index in range(len(word) + 1)]
+        edits = {left + right[1:] for left, right in splits if right}
+        edits.update(left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1)
+        edits.update(left + letter + right[1:] for left, right in splits if right for letter in alphabet)
+        edits.update(left + letter + right for left, right in splits for letter in alphabet)
+
+        matches = [edit for edit in edits if edit in vocabulary]
+        return max(matches, key=vocabulary.__getitem__) if matches else word
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+class SearchOverlay:                                #Type-to-search overlay state -- query, ranked results and which one is highlighted
+    def __init__(self):
+        self.active = False
+        self.query = ''
+        self.results = []                               #Format of [(name, title)]
+        self.selected = 0
+        self.swallow = None                             #Text input to drop once, the keystroke that opened the overlay also arrives as text
+        self.deadline = None                            #perf_counter time the debounced query runs at, None when none is waiting
+
 class PlaylistManager:                              #Class to handle track files and playlist management -- takes render manager and audio manager as parameters for error handling and info methods
-    def __init__(self, music_dir, render_manager, audio_manager):
+    def __init__(self, music_dir, render_manager, audio_manager, library_index=None, metadata_service=None, loudness_service=None, rows=None):      #rows from scan() if the directory was already read off the main loop
         self.audio_manager = audio_manager
         self.render_manager = render_manager
+        self.library_index = library_index
+        self.metadata_service = metadata_service
+        self.loudness_service = loudness_service
         self.music_dir = music_dir
-        self.tracks = []
+        self.tracks = TrackStore(music_dir)
+        self.track_tags = {}                        #Format of {name: (title, artist, album)}, only for tracks that have any tags -- durations live in the track store
         self.current_track = 0
+        self.queue = deque()                        #Tracks to play next ahead of playlist order, format of [name]
+        self.shuffle = False
+        self.shuffle_next = None                    #Track shuffle picked to play next, kept by name until it plays so the buffered track is the one that does
+        self.watcher = None
+        self.search_index = SearchIndex()
+        self.search_cursor = 0                      #Tracks before this position are in the search index, the rest are indexed a chunk at a time
+        self.loudness = {}                          #Format of {name: (loudness, peak)} for analysed tracks, loudness is None for silent ones
+        self.loudness_loaded = False                #Set once the index has been read, until then prioritize leaves loudness alone
+        self.albums = {}                            #Format of {album key: set of analysed names}, the key is (directory, album tag)
+        self.track_albums = {}                      #Format of {name: album key} for analysed tracks, the album each one was counted towards
+        self.album_loudness = {}                    #Format of {album key: (loudness, peak)}, computed on first use and dropped when a member changes
         
         try:                                    #Check directory/files exist, then for access, then supported file types
             if not os.path.exists(music_dir):
@@ -362,35 +2782,253 @@ class PlaylistManager:                              #Class to handle track files
                 self.render_manager.error_prompt_render(f"Directory is not readable. Check you and this program have read access to: {music_dir}", fatal=True)
                 return
 
-            self.tracks = sorted([f for f in os.listdir(music_dir) if f.lower().endswith('.wav') or f.lower().endswith('.mp3') or f.lower().endswith('.ogg')])
-            print(f"Playlist: {self.tracks}")
+            if rows is None:
+                rows = self.scan(music_dir, self.library_index)
+            self.tracks = TrackStore(music_dir, [row[0] for row in rows], [row[1] for row in rows])
+            self.track_tags = {row[0]: row[2:] for row in rows if any(row[2:])}
+
+            if self.library_index:
+                run_background(self.verify_library)
+                self.attach_loudness(loudness_service)
+            print(f"Playlist: {len(self.tracks)} tracks")
+
+            if self.metadata_service and self.tracks:                   #Current and next first, then anything the index doesn't have metadata for yet
+                self.prioritize()
+                for index in range(len(self.tracks)):
+                    if self.tracks.get_duration(index) is None:
+                        self.metadata_service.request(music_dir, self.tracks[index])
+
+            self.watcher = DirectoryWatcher(music_dir, self.library_index)
 
             if not self.tracks:
                 self.render_manager.error_prompt_render(f"No supported tracks found in the specified directory. Supported file types are .wav, .mp3, and .ogg. Directory: {music_dir}", fatal=True)      #Maybe write a method to overwrite the config file?
             
         except Exception as error:
             self.render_manager.error_prompt_render("Playlist initialization failed: " + str(error), fatal=True)
+
+    @staticmethod
+    def scan(music_dir, library_index=None):                #Blocking read of a directory's tracks, returns sorted rows of (name, duration, title, artist, album) -- safe off the main thread
+        if library_index:
+            return library_index.load(music_dir)
+        return [(name, None, None, None, None) for name in sorted(f for f in os.listdir(music_dir) if f.lower().endswith(SUPPORTED_EXTENSIONS))]
+
+    def verify_library(self):                               #Background check for files edited in place, queues them for parsing -- stale metadata is replaced when the results land
+        try:
+            for name in self.library_index.verify(self.music_dir):
+                if self.metadata_service:
+                    self.metadata_service.request(self.music_dir, name)
+        except Exception as error:
+            print("Library verify failed: " + str(error))
     
+    def attach_loudness(self, loudness_service):            #Start using a loudness service (created after startup), reads what's analysed and queues the rest
+        self.loudness_service = loudness_service
+        if loudness_service and self.library_index and not self.loudness_loaded:
+            run_background(self.load_loudness)
+
+    def load_loudness(self):                                #Background read of analysed loudness from the index, queues the rest for analysis -- results are applied on the main loop like fresh ones
+        try:
+            (known, pending) = self.library_index.load_loudness(self.music_dir)
+            self.loudness_service.restore(self.music_dir, known)
+            pending = set(pending)
+            for name in sorted(pending):
+                self.loudness_service.request(self.music_dir, name)
+            if self.tracks:
+                for index in (self.get_next_index(), self.current_track):
+                    if self.tracks[index] in pending:
+                        self.loudness_service.request(self.music_dir, self.tracks[index], first=True)
+            self.loudness_loaded = True
+        except Exception as error:
+            print("Loading loudness failed: " + str(error))
+
+    def prioritize(self):                                   #Move the current and next tracks to the front of the metadata and loudness queues if they still need parsing or analysis
+        if not self.tracks:
+            return
+
+        for index, priority in ((self.get_next_index(), MetadataService.PRIORITY_NEXT), (self.current_track, MetadataService.PRIORITY_CURRENT)):
+            name = self.tracks[index]
+            if self.metadata_service and self.tracks.get_duration(index) is None:
+                self.metadata_service.request(self.music_dir, name, priority)
+            if self.loudness_service and self.loudness_loaded and name not in self.loudness:
+                self.loudness_service.request(self.music_dir, name, first=True)
+
+    def album_key(self, name):                              #Album a track counts towards for album gain -- its album tag within its directory, untagged tracks group by directory
+        tags = self.track_tags.get(name)
+        return (os.path.dirname(name), tags[2] if tags else None)
+
+    def set_loudness(self, name, loudness, peak):           #Record a track's analysis, or forget it with a peak of None, keeping album membership in step
+        if name in self.loudness:
+            key = self.track_albums.pop(name)
+            self.albums[key].discard(name)
+            self.album_loudness.pop(key, None)
+            del self.loudness[name]
+
+        if peak is not None:
+            key = self.album_key(name)
+            self.loudness[name] = (loudness, peak)
+            self.track_albums[name] = key
+            self.albums.setdefault(key, set()).add(name)
+            self.album_loudness.pop(key, None)
+
+    def apply_loudness(self):                               #Take analysis results, ignoring any for a library that has since been replaced -- the buffered next track picks up its gain, the playing one keeps its level
+        for music_dir, name, loudness, peak in self.loudness_service.poll():
+            if music_dir == self.music_dir and self.tracks.find(name) >= 0:
+                self.set_loudness(name, loudness, peak)
+        self.audio_manager.refresh_gain()
+
+    def get_album_loudness(self, key):                      #Returns (loudness, peak) of an album -- the mean energy of its analysed tracks, and its highest peak
+        if key not in self.album_loudness:
+            members = [self.loudness[name] for name in self.albums.get(key, ())]
+            energies = [10 ** (loudness / 10) for loudness, peak in members if loudness is not None]
+            self.album_loudness[key] = (10 * math.log10(sum(energies) / len(energies)) if energies else None, max((peak for loudness, peak in members), default=0.0))
+        return self.album_loudness[key]
+
+    def gain_for_path(self, track_path, mode):              #Returns normalization gain in dB for a track in 'track' or 'album' mode -- brought to LOUDNESS_TARGET_LUFS, boost capped and held below clipping, 0 when not analysed
+        name = os.path.relpath(track_path, self.music_dir)
+        if mode == 'off' or name not in self.loudness:
+            return 0.0
+
+        return normalization_gain(*(self.get_album_loudness(self.album_key(name)) if mode == 'album' else self.loudness[name]))
+
+    def apply_library_changes(self):                        #Apply batched adds, removes and renames from the watcher to the sorted track list in place, current_track keeps pointing at the same file
+        if not self.watcher:
+            return False
+
+        batches = self.watcher.take_changes()
+        if not batches:
+            return False
+
+        current_name = self.tracks[self.current_track] if self.tracks else None
+
+        for added, removed, renamed in batches:
+            for old_name, new_name in renamed.items():
+                index = self.tracks.find(old_name)
+                duration = self.tracks.get_duration(index) if index >= 0 else None
+                self.remove_track(old_name)
+                if old_name in self.track_tags:
+                    self.track_tags[new_name] = self.track_tags.pop(old_name)
+                if old_name in self.loudness:
+                    analysis = self.loudness[old_name]
+                    self.set_loudness(old_name, None, None)
+                    self.set_loudness(new_name, *analysis)
+                self.insert_track(new_name, duration)
+                if current_name == old_name:
+                    current_name = new_name
+                self.queue = deque(new_name if name == old_name else name for name in self.queue)
+
+            for name in removed:
+                self.remove_track(name)
+                self.set_loudness(name, None, None)
+                self.track_tags.pop(name, None)
+
+            for name in added:
+                self.set_loudness(name, None, None)
+                self.track_tags.pop(name, None)                 #New or rewritten, either way its metadata needs parsing and its loudness analysing
+                self.tracks.set_duration(self.insert_track(name), None)
+                if self.metadata_service:
+                    self.metadata_service.request(self.music_dir, name)
+                if self.loudness_service and self.loudness_loaded:
+                    self.loudness_service.request(self.music_dir, name)
+
+        if self.tracks and current_name is not None:            #If the current file itself went away, land on whatever took its place
+            self.current_track = min(bisect.bisect_left(self.tracks, current_name), len(self.tracks) - 1)
+        else:
+            self.current_track = 0
+
+        print(f"Playlist: {len(self.tracks)} tracks")
+        return True
+
+    def insert_track(self, name, duration=None):            #Insert into the track store and search index, keeping the search cursor on the same track, returns the index
+        count = len(self.tracks)
+        index = self.tracks.insert(name, duration)
+        if len(self.tracks) > count and index < self.search_cursor:
+            self.search_cursor += 1
+        self.search_index.add(name, self.tracks.title(index), self.track_tags.get(name))
+        return index
+
+    def remove_track(self, name):                           #Remove from the track store and search index, keeping the search cursor on the same track
+        index = self.tracks.remove(name)
+        if 0 <= index < self.search_cursor:
+            self.search_cursor -= 1
+        self.search_index.remove(name)
+
+    def build_search_index(self, budget_ms=SEARCH_INDEX_BUDGET_MS):     #Index tracks in small chunks until the time budget runs out, returns True while some are still waiting
+        deadline = time.perf_counter() + budget_ms / 1000
+        while self.search_pending() and time.perf_counter() < deadline:
+            end = min(len(self.tracks), self.search_cursor + 64)
+            for index in range(self.search_cursor, end):
+                name = self.tracks[index]
+                self.search_index.add(name, self.tracks.title(index), self.track_tags.get(name))
+            self.search_cursor = end
+        return self.search_pending()
+
+    def search_pending(self):                               #True until every track is in the search index
+        return self.search_cursor < len(self.tracks)
+
+    def titles(self, names):                                #Returns list of (name, title) for search results, skipping tracks removed since the query ran
+        results = []
+        for name in names:
+            index = self.tracks.find(name)
+            if index >= 0:
+                results.append((name, self.tracks.title(index)))
+        return results
+
+    def close(self):                                        #Stop watching the directory and analysing its tracks
+        if self.watcher:
+            self.watcher.stop()
+        if self.loudness_service:
+            self.loudness_service.clear()
+
+    def apply_metadata(self):                               #Take parsed results from the metadata service, ignoring any for a library that has since been replaced
+        for music_dir, name, duration, *tags in self.metadata_service.poll():
+            if music_dir != self.music_dir:
+                continue
+
+            index = self.tracks.find(name)
+            if index >= 0:
+                self.tracks.set_duration(index, duration)
+            analysis = self.loudness.get(name)
+            if analysis:                                    #The album tag may have changed, drop it from its old album first
+                self.set_loudness(name, None, None)
+            if any(tags):
+                self.track_tags[name] = tuple(tags)
+            else:
+                self.track_tags.pop(name, None)
+            if analysis:
+                self.set_loudness(name, *analysis)
+            if index >= 0 and index < self.search_cursor:
+                self.search_index.add(name, self.tracks.title(index), self.track_tags.get(name))
+
+    def preload_next(self):                                 #Have the audio manager buffer the next track for a gapless handover, returns its path
+        if not self.tracks:
+            return None
+
+        next_path = self.tracks.path(self.get_next_index())
+        self.audio_manager.preload(next_path)
+        return next_path
+
     def get_current_track_path(self):                       #Returns current playlist index as a path
-        return os.path.join(self.music_dir, self.tracks[self.current_track])
+        return self.tracks.path(self.current_track)
 
-    def get_track_title(self):                              #Returns formatted title of current track
-        title = str(self.tracks[self.current_track])
-        title = title.replace('.wav', '').replace('.mp3', '').replace('.ogg', '')
-        return ' '.join(word.capitalize() for word in title.split('_'))
+    def get_track_title(self):                              #Returns formatted title of current track, precomputed by the track store
+        return self.tracks.title(self.current_track)
     
-    def get_track_artist(self):                             #Returns artist of current track (we only use tracks from Cam)
+    def get_track_artist(self):                             #Returns artist tag of current track if indexed, otherwise the default (we only use tracks from Cam)
+        tags = self.track_tags.get(self.tracks[self.current_track])
+        if tags and tags[1]:
+            return tags[1]
         return "Cam (PH4NT0MBexe)"
     
-    def get_track_length(self):                             #Return length of current track, which involves a check for file corruption/compatibility
+    def get_track_length(self):                             #Return length of current track if known, otherwise queue it for parsing and return 0 -- never parses on the calling thread
         try:
-            track_path = self.get_current_track_path()
-            media = self.audio_manager.instance.media_new(track_path)
-            media.parse()
-            if media.get_duration() < 0:                #Get duration can possibly return -1 if duration isn't ready
+            duration = self.tracks.get_duration(self.current_track)
+            if duration == UNKNOWN_DURATION:                #Parsed, libvlc just couldn't time it -- nothing to wait for
                 return 0
-            self.track_length = media.get_duration() / 1000
-            return self.track_length
+            if duration is not None:
+                self.track_length = duration
+                return self.track_length
+
+            self.prioritize()
+            return 0
         except Exception as error:
             self.render_manager.error_prompt_render(f"Failed to get track length: {error}", fatal=True)
             return 0
@@ -406,8 +3044,34 @@ class PlaylistManager:                              #Class to handle track files
             'length': self.get_track_length()
         }
         
-    def get_next_index(self):                           #Returns next index in playlist
+    def get_next_index(self):                           #Returns next index in playlist, the head of the queue if anything is queued
+        while self.queue:
+            index = self.tracks.find(self.queue[0])
+            if index >= 0:
+                return index
+            self.queue.popleft()                        #Left the library after it was queued
+
+        if self.shuffle and len(self.tracks) > 1:
+            index = self.tracks.find(self.shuffle_next) if self.shuffle_next else -1
+            if index < 0 or index == self.current_track:            #Not picked yet, or the pick left the library or is playing already
+                index = random.randrange(len(self.tracks) - 1)
+                index += index >= self.current_track
+                self.shuffle_next = self.tracks[index]
+            return index
+
         return (self.current_track + 1) % len(self.tracks)
+
+    def toggle_shuffle(self):                           #Turn shuffle on or off, returns the new state
+        self.shuffle = not self.shuffle
+        self.shuffle_next = None
+        return self.shuffle
+
+    def enqueue(self, name):                            #Queue a track to play after the current one (and anything queued before it), returns False if it isn't in the library
+        if self.tracks.find(name) < 0:
+            return False
+
+        self.queue.append(name)
+        return True
     
     def get_previous_index(self):                       #Returns previous index in playlist
         return (self.current_track - 1) % len(self.tracks)
@@ -416,7 +3080,12 @@ class PlaylistManager:                              #Class to handle track files
         if not self.tracks:
             return None
 
-        self.current_track = self.get_next_index()
+        next_index = self.get_next_index()
+        if self.queue:                                  #get_next_index left a valid head in place, it's being played now
+            self.queue.popleft()
+        self.current_track = next_index
+        self.shuffle_next = None
+        self.prioritize()
         return self.get_current_track_path()
     
     def rewind(self):                                   #Rewinds playlist index and returns path to new current track file
@@ -424,10 +3093,11 @@ class PlaylistManager:                              #Class to handle track files
             return None
 
         self.current_track = self.get_previous_index()
+        self.prioritize()
         return self.get_current_track_path()
         
     def get_formatted_time(self):                       #Returns formatted time of current track as elapsed / total
-        if self.audio_manager.player.get_state() in [vlc.State.Playing, vlc.State.Paused]:
+        if self.audio_manager.get_state() in [vlc.State.Playing, vlc.State.Paused]:
             try:
                 (current_time, total_time) = self.audio_manager.get_progress()
                 
@@ -450,33 +3120,136 @@ class MediaPlayer:                  #Master class handling other classes, includ
     def __init__(self):             #Constructs other managers (error as part of render), initializes playlist, buttons, render info, and starts playing
         try:
             self.is_processing = False
-            self.audio_manager = AudioManager()
+            fonts_loading = threading.Thread(target=preload_fonts, daemon=True)         #Font lookup (fc-list on Linux) overlaps libvlc loading its plugins
+            fonts_loading.start()
+            self.session = SessionService(os.path.join(CONFIG_DIR, SESSION_FILE))
+            session = self.session.load()
+            self.audio_manager = AudioManager(session.get('volume', DEFAULT_VOLUME))
+            startup.mark('vlc')
+            self.library_index = LibraryIndex(os.path.join(CONFIG_DIR, LIBRARY_INDEX_FILE))
+            first_track = self.play_first_track(session)        #Sound before the window, fonts and library
+            fonts_loading.join()
+            startup.mark('fonts')
             self.render_manager = RenderManager(self.audio_manager)
-            self.playlist_manager = PlaylistManager(self.read_path(), self.render_manager, self.audio_manager)
+            startup.mark('window')
+
+            self.metadata_service = MetadataService(self.audio_manager.instance, self.library_index)
+            self.waveforms = None                               #Services with worker pools or a second player start after the first frame, see start_services
+            self.spectrum = None
+            self.loudness_service = None
+            self.art = ArtService()
+            self.playlist_manager = PlaylistManager(self.read_path(), self.render_manager, self.audio_manager, self.library_index, self.metadata_service)
+            self.audio_manager.gain_lookup = self.playlist_manager.gain_for_path
+            start_ms = self.resume_session(session, first_track)
+            startup.mark('library')
 
             self.buttons = {}
             self.buttons_init()
             self.drag_buttons = {}
             self.drag_buttons_init()
             self.progress_drag = False
+            self.mouse_pos = pygame.mouse.get_pos()            #Pointer position as of the last mouse event, hover is drawn from this
+            self.volume_target = None                           #Volume the knob was dragged to this frame, applied once by apply_input
+            self.search = SearchOverlay()
+            self.search_generation = 0                          #Bumped per query run, results from an older one are dropped
+            startup.mark('ui')
 
             if self.playlist_manager.tracks:
                 track_path = self.playlist_manager.get_current_track_path()
-                self.audio_manager.play(track_path)
+                if track_path != self.audio_manager.current_path:
+                    self.audio_manager.play(track_path, start_ms)
+                self.playlist_manager.preload_next()
                 self.info_update()
 
         except Exception as error:
             if hasattr(self, 'render_manager'):
                 self.render_manager.error_prompt_render("Player initialization failed: " + str(error), fatal=True)
+                self.render_manager.error_manager.wait_for_exit(self.render_manager)
             else:
                 print("Critical error: Could not initialize render manager:", str(error))
                 pygame.quit()
                 sys.exit(1)
         
+    def play_first_track(self, session):        #Start the track playback opens on -- the saved session's, at its position, or the library's first -- straight from the config and index, before the UI and library exist -- returns its path, or None to leave it to the normal startup
+        try:
+            with open(os.path.join(CONFIG_DIR, 'config.txt'), 'r') as file:
+                music_dir = file.read().strip()
+
+            start_ms = 0
+            row = None
+            if session.get('library') == music_dir and session.get('track') and os.path.exists(os.path.join(music_dir, session['track'])):
+                row = self.library_index.first_track(music_dir, session['track']) or (session['track'], None, None)
+                start_ms = session.get('position', 0)
+            else:
+                row = self.library_index.first_track(music_dir)
+            if not row or not os.path.exists(os.path.join(music_dir, row[0])):
+                return None
+
+            (name, loudness, peak) = row
+            track_path = os.path.join(music_dir, name)
+            self.audio_manager.gain_lookup = lambda path, mode: normalization_gain(loudness, peak) if path == track_path else 0.0         #Album gain needs the library, the track's own gain stands in
+            self.audio_manager.play(track_path, start_ms)
+            return track_path
+        except Exception as error:
+            print("Early start failed, starting normally: " + str(error))
+            return None
+
+    def resume_session(self, session, first_track):         #Point the playlist at the track already playing (or the saved one if the early start couldn't run) and restore queue and shuffle -- returns the position in ms to start the current track from if it isn't playing yet
+        playlist_manager = self.playlist_manager
+        if not playlist_manager.tracks:
+            return 0
+        if session.get('library') != playlist_manager.music_dir:            #Saved for another library
+            session = {}
+
+        name = os.path.relpath(first_track, playlist_manager.music_dir) if first_track else session.get('track')
+        index = playlist_manager.tracks.find(name) if name else -1
+        if index >= 0:
+            playlist_manager.current_track = min(index, len(playlist_manager.tracks) - 1)
+        playlist_manager.queue.extend(queued for queued in session.get('queue', ()) if playlist_manager.tracks.find(queued) >= 0)         #Names no longer in the library are dropped
+        playlist_manager.shuffle = session.get('shuffle', False)
+        playlist_manager.prioritize()
+
+        if index < 0 or name != session.get('track'):
+            return 0
+        duration = playlist_manager.tracks.get_duration(index)
+        position = session.get('position', 0)
+        return position if duration is None or duration <= 0 or position < duration * 1000 else 0          #Saved at or past the end (the file may have been shortened), start it over
+
+    def session_state(self):                    #Returns the session to save as a dictionary of SessionService.FIELDS, None while there's no track
+        playlist_manager = self.playlist_manager
+        if not playlist_manager.tracks:
+            return None
+
+        return {
+            'library': playlist_manager.music_dir,
+            'track': playlist_manager.tracks[playlist_manager.current_track],
+            'position': self.audio_manager.state.time,
+            'volume': self.audio_manager.get_volume(),
+            'queue': list(playlist_manager.queue),
+            'shuffle': playlist_manager.shuffle,
+        }
+
+    def session_update(self):                   #Hand the session to the saver once per frame, it decides whether anything is worth writing
+        session = self.session_state()
+        if session:
+            self.session.update(session)
+
+    def start_services(self):                   #Start the background services startup doesn't wait for -- waveform and loudness pools, spectrum player -- call once the first frame is up
+        if not numpy:
+            return
+
+        try:
+            self.waveforms = WaveformService()
+            self.spectrum = SpectrumAnalyzer(self.audio_manager.instance)
+            self.loudness_service = LoudnessService(self.library_index)
+            self.playlist_manager.attach_loudness(self.loudness_service)
+        except Exception as error:
+            self.render_manager.error_prompt_render("Failed to start background services: " + str(error), fatal=False)
+        startup.mark('services')
+
     def read_path(self):                        #Reads path from config file (will only make it here if playlist_manager proves file access)
         try:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            config_path = os.path.join(script_dir, 'config.txt')
+            config_path = os.path.join(CONFIG_DIR, 'config.txt')
             path = None
             
             if not os.path.exists(config_path):
@@ -493,17 +3266,22 @@ class MediaPlayer:                  #Master class handling other classes, includ
         except Exception as error:
             self.render_manager.error_prompt_render("Failed to read config file: " + str(error), fatal=True)
 
-    def update_config(self):                        #Updates -- by overwriting -- config file and restarts playlist
-        new_path = input("Enter the path to your music directory: ")
-        with open('config.txt', 'w') as file:
+    def update_config(self, new_path, rows=None):   #Updates -- by overwriting -- config file and restarts playlist on a new music directory, rows from PlaylistManager.scan if it was already read
+        if not os.path.isdir(new_path) or not os.access(new_path, os.R_OK):
+            raise ValueError(f"Not a readable directory: {new_path}")
+
+        with open(os.path.join(CONFIG_DIR, 'config.txt'), 'w') as file:
             file.write(new_path)
         
         self.stop()
-        self.playlist_manager = PlaylistManager(new_path, self.render_manager, self.audio_manager)
+        self.playlist_manager.close()
+        self.playlist_manager = PlaylistManager(new_path, self.render_manager, self.audio_manager, self.library_index, self.metadata_service, self.loudness_service, rows)
+        self.audio_manager.gain_lookup = self.playlist_manager.gain_for_path
 
         if self.playlist_manager.tracks:
             track_path = self.playlist_manager.get_current_track_path()
             self.audio_manager.play(track_path)
+            self.playlist_manager.preload_next()
 
         self.info_update()
 
@@ -516,11 +3294,11 @@ class MediaPlayer:                  #Master class handling other classes, includ
                 return
 
             try:
-                self.stop()
-                self.playlist_manager.advance()
+                self.playlist_manager.advance()                 #No stop first, play() either replaces the media or crossfades out of it
 
                 current_path = self.playlist_manager.get_current_track_path()
                 self.audio_manager.play(current_path)
+                self.playlist_manager.preload_next()
 
                 self.info_update()
             except Exception as error:
@@ -530,18 +3308,81 @@ class MediaPlayer:                  #Master class handling other classes, includ
     def pause(self):                                #Toggle pause audio player
         self.audio_manager.toggle_pause()
 
-    def progress(self):                             #Check if track has ended, if so, stop, advance playlist, start new track, update info
+    def library_update(self):                       #Apply file changes from the directory watcher, re-buffer the next track if it changed, start playing if the library was empty
+        was_empty = not self.playlist_manager.tracks
+        if not self.playlist_manager.apply_library_changes() or not self.playlist_manager.tracks:
+            return
+
+        try:
+            if was_empty:
+                self.audio_manager.play(self.playlist_manager.get_current_track_path())
+                self.playlist_manager.preload_next()
+            elif self.playlist_manager.tracks.path(self.playlist_manager.get_next_index()) != self.audio_manager.preloaded_path:
+                self.playlist_manager.preload_next()
+
+            self.info_update()
+        except Exception as error:
+            self.render_manager.error_prompt_render("Failed to update playlist: " + str(error), fatal=False)
+
+    def cycle_crossfade(self):                      #Step through crossfade lengths, buffering the next track if fading needs it
+        print(f"Crossfade: {self.audio_manager.cycle_crossfade()} s")
+        self.playlist_manager.preload_next()
+
+    def cycle_normalization(self):                  #Step through loudness normalization modes, needs NumPy for the analysis
+        if not self.loudness_service:
+            print("Loudness normalization needs NumPy")
+            return
+
+        print(f"Normalization: {self.audio_manager.cycle_normalization()}")
+
+    def toggle_spectrum(self):                      #Turn the spectrum visualizer on or off, needs NumPy
+        if not self.spectrum:
+            print("Spectrum visualizer needs NumPy")
+            return
+
+        try:
+            print(f"Spectrum: {'on' if self.spectrum.toggle() else 'off'}")
+        except Exception as error:
+            self.render_manager.error_prompt_render("Spectrum visualizer failed: " + str(error), fatal=False)
+
+    def toggle_shuffle(self):                       #Toggle shuffle, re-buffering the next track to match
+        print(f"Shuffle: {'on' if self.playlist_manager.toggle_shuffle() else 'off'}")
+        self.playlist_manager.prioritize()
+        self.playlist_manager.preload_next()
+
+    def toggle_gapless(self):                       #Toggle gapless mode, buffering or dropping the next track to match
+        self.audio_manager.gapless = not self.audio_manager.gapless
+        self.playlist_manager.preload_next()
+
+    def progress(self):                             #Check if track has ended (flagged by libvlc's end event) or was handed over gaplessly, if so, advance playlist, start new track if needed, update info
         with self.processing_lock() as processing:
             if not processing:
                 return
+
+            error = self.audio_manager.state.take_error()
+            if error:
+                self.render_manager.error_prompt_render(error, fatal=False)
+                return
+
+            self.audio_manager.preload_deferred()
+            if self.audio_manager.state.take_handed_over():          #Standby player is already playing the next track, only the playlist needs to catch up
+                try:
+                    self.playlist_manager.advance()
+                    self.playlist_manager.preload_next()
+
+                    self.info_update()
+                except Exception as error:
+                    self.render_manager.error_prompt_render("Failed to advance playlist: " + str(error), fatal=False)
+                return
         
-            if self.audio_manager.player.get_state() == vlc.State.Ended:
+            if self.audio_manager.state.take_ended():
                 try:
                     self.stop()
                     self.playlist_manager.advance()
 
                     current_path = self.playlist_manager.get_current_track_path()
                     self.audio_manager.play(current_path)
+                    self.playlist_manager.preload_next()
 
                     self.info_update()
                 except Exception as error:
@@ -554,25 +3395,37 @@ class MediaPlayer:                  #Master class handling other classes, includ
                 return
 
             try:
-                elapsed_time = self.audio_manager.get_progress()[0]
-                self.stop()
+                elapsed_time = self.audio_manager.get_progress()[0]             #No stop first, play() either replaces the media or crossfades out of it
 
                 if elapsed_time < 5:              #If elapsed time is less than 5 seconds, rewind playlist
                     self.playlist_manager.rewind()
                     current_path = self.playlist_manager.get_current_track_path()
                     self.audio_manager.play(current_path)
+                    self.playlist_manager.preload_next()
 
                 else:                            #If elapsed time is greater than 5 seconds, rewind track
                     current_path = self.playlist_manager.get_current_track_path()
                     self.audio_manager.play(current_path)
+                    self.playlist_manager.preload_next()
             
                 self.info_update()
             except Exception as error:
                 self.render_manager.error_prompt_render("Rewind failed: " + str(error), fatal=False)
                 return
         
-    def quit(self):                                 #Perform cleanup, quit pygame, exit program with normal/default flag
+    def quit(self):                                 #Perform cleanup, save the session, quit pygame, exit program with normal/default flag
+        self.session.stop(self.session_state())
+        self.metadata_service.stop()
+        if self.waveforms:
+            self.waveforms.stop()
+        if self.spectrum:
+            self.spectrum.stop()
+        if self.loudness_service:
+            self.loudness_service.stop()
+        self.art.stop()
+        self.playlist_manager.close()
         self.audio_manager.cleanup()
+        self.library_index.close()
         pygame.quit()
         sys.exit()
 
@@ -588,45 +3441,41 @@ class MediaPlayer:                  #Master class handling other classes, includ
         finally:
             self.is_processing = False
 
-    def buttons_init(self):              #Initialize buttons and behaviors
+    def buttons_init(self):              #Initialize buttons and behaviors, placed by the layout -- built once, relayouts move them
+        layout = self.render_manager.layout
         self.buttons = {
         'pause_button': Button({
-            'x': self.render_manager.window_width * (1/4),
-            'y': self.render_manager.window_height * (4/5),
+            'x': layout['pause_button'][0],
+            'y': layout['pause_button'][1],
             'label': "Pause",
             'onClick': lambda: self.pause()
         }),
 
         'skip_button': Button({
-            'x': self.render_manager.window_width * (2/4),
-            'y': self.render_manager.window_height * (4/5),
+            'x': layout['skip_button'][0],
+            'y': layout['skip_button'][1],
             'label': "Skip",
             'onClick': lambda: self.skip()
         }),
 
         'rewind_button': Button({
-            'x': self.render_manager.window_width * (3/4),
-            'y': self.render_manager.window_height * (4/5),
+            'x': layout['rewind_button'][0],
+            'y': layout['rewind_button'][1],
             'label': "Rewind",
             'onClick': lambda: self.rewind()
         }),
 
         'quit_button': Button({
-            'x': self.render_manager.window_width * (1/6),
-            'y': self.render_manager.window_height * (1/2),
+            'x': layout['quit_button'][0],
+            'y': layout['quit_button'][1],
             'label': "Quit",
             'onClick': lambda: self.quit()
         })
     }
 
-    def drag_buttons_init(self):                    #Initialize drag buttons, behaviors are handled in following methods and inherent to their class
-        progress_width = self.render_manager.window_width * 0.6
-        progress_x = (self.render_manager.window_width - progress_width) // 2
-        progress_y = self.render_manager.window_height * (5/8)
-
-        volume_width = self.render_manager.window_width * 0.1
-        volume_x = (self.render_manager.window_width - volume_width) // 2
-        volume_y = self.render_manager.window_height * (1/10)
+    def drag_buttons_init(self):                    #Initialize drag buttons on their bars in the layout, behaviors are handled in following methods and inherent to their class
+        (progress_x, progress_y, progress_width, _) = self.render_manager.layout['progress_bar']
+        (volume_x, volume_y, volume_width, _) = self.render_manager.layout['volume_bar']
 
         self.drag_buttons = {
             'progress': DragButton({
@@ -648,14 +3497,30 @@ class MediaPlayer:                  #Master class handling other classes, includ
             })
         }
 
-    def handle_mouse_down(self, mouse_pos):                 #Program-wide mouse down handler
+    def layout_widgets(self):                       #Move the existing buttons and drag buttons to the current layout after a resize, nothing is rebuilt
+        layout = self.render_manager.layout
+        for button_name, button in self.buttons.items():
+            button.move(layout[button_name])
+        for button_name, button in self.drag_buttons.items():
+            (x, y, width, _) = layout[button_name + '_bar']
+            button.set_track(x, x + width, y)
+
+    def resize_update(self):                        #Once per frame while the window is being resized -- the scaled last frame stands in until the size settles, then a single relayout
+        if self.render_manager.resize_update():
+            self.layout_widgets()
+
+    def handle_mouse_down(self, mouse_pos):                 #Program-wide mouse down handler, error toasts sit on top so they get the click first
+        self.mouse_pos = mouse_pos
+        if self.render_manager.error_manager.click(mouse_pos):
+            return True
+
         for button in self.drag_buttons.values():
             if button.handle_drag_start(mouse_pos):
                 return True
 
         for button in self.buttons.values():
             if button.check_mouse(mouse_pos):
-                button.handle_click()
+                button.handle_click(mouse_pos)
                 return True
 
         return False
@@ -674,19 +3539,128 @@ class MediaPlayer:                  #Master class handling other classes, includ
                 self.progress_drag = False
                 self.audio_manager.set_progress(position_percent)
             elif button_name == 'volume':
+                self.volume_target = None
                 self.audio_manager.set_volume(int(position_percent * 100))
     
-    def handle_mouse_motion(self, mouse_pos):                 #Program-wide mouse motion handler, only does things for the drag buttons and between trigger mouse events
+    def handle_mouse_motion(self, mouse_pos):                 #Program-wide mouse motion handler, only does things for the drag buttons and between trigger mouse events -- gets one (coalesced) motion per run of events, volume is left for apply_input
+        self.mouse_pos = mouse_pos
         for button_name, button in self.drag_buttons.items():
             position_percent = button.handle_drag(mouse_pos)
 
             if position_percent is not None:
                 if button_name == 'progress':
                     self.progress_drag = True
+                    self.audio_manager.scrub(position_percent)
 
                 elif button_name == 'volume':
-                    self.render_manager.volume_bar_render(int(position_percent * 100))
-                    self.audio_manager.set_volume(int(position_percent * 100))
+                    self.volume_target = int(position_percent * 100)
+
+    def apply_input(self):                                  #Apply what this frame's input asked for once -- a volume drag costs one libvlc call per frame however many motion events moved it
+        if self.volume_target is not None:
+            if self.volume_target != self.audio_manager.get_volume():
+                self.audio_manager.set_volume(self.volume_target)
+            self.volume_target = None
+
+    def is_animating(self):                                 #True while something on screen moves every frame (or background indexing wants the loop turning) and needs the full frame rate
+        if any(button.being_dragged for button in self.drag_buttons.values()) or self.playlist_manager.search_pending():
+            return True
+        if self.render_manager.resize_deadline is not None:         #Keeps the loop turning to notice the size settle
+            return True
+        return bool(self.spectrum and self.spectrum.enabled and self.audio_manager.get_state() == vlc.State.Playing)
+
+    def jump_to(self, index):                               #Play a track by playlist index
+        with self.processing_lock() as processing:
+            if not processing:
+                return
+
+            try:
+                self.playlist_manager.current_track = index
+                self.playlist_manager.prioritize()
+                self.audio_manager.play(self.playlist_manager.get_current_track_path())
+                self.playlist_manager.preload_next()
+
+                self.info_update()
+            except Exception as error:
+                self.render_manager.error_prompt_render("Jump to track failed: " + str(error), fatal=False)
+
+    def search_open(self, swallow=None):                    #Show the search overlay, swallow is the opening keystroke's text if it will also arrive as text input
+        self.search = SearchOverlay()
+        self.search.active = True
+        self.search.swallow = swallow
+        self.search_generation += 1                             #A query still running for the last overlay mustn't land in this one
+
+    def search_text(self, text):                            #Typed text goes into the query and re-runs the search
+        if not self.search.active:
+            return
+        if self.search.swallow and text == self.search.swallow:
+            self.search.swallow = None
+            return
+
+        self.search.swallow = None
+        self.search.query += text
+        self.search_request()
+
+    def search_key(self, key):                              #Editing and navigation keys while the overlay is open
+        if key == pygame.K_ESCAPE:
+            self.search.active = False
+        elif key == pygame.K_BACKSPACE:
+            self.search.query = self.search.query[:-1]
+            self.search_request()
+        elif key == pygame.K_DOWN and self.search.results:
+            self.search.selected = (self.search.selected + 1) % len(self.search.results)
+        elif key == pygame.K_UP and self.search.results:
+            self.search.selected = (self.search.selected - 1) % len(self.search.results)
+        elif key in (pygame.K_RETURN, pygame.K_KP_ENTER) and self.search.results:
+            index = self.playlist_manager.tracks.find(self.search.results[self.search.selected][0])
+            self.search.active = False
+            if index >= 0:
+                self.jump_to(index)
+
+    def search_request(self):                               #Re-run the query once typing pauses for SEARCH_DEBOUNCE_MS
+        self.search.deadline = time.perf_counter() + SEARCH_DEBOUNCE_MS / 1000
+
+    def search_update(self):                                #Hand the query to a worker once its debounce deadline passes, results come back as a SEARCH_EVENT
+        if self.search.deadline is None or time.perf_counter() < self.search.deadline:
+            return
+
+        self.search.deadline = None
+        self.search_generation += 1
+        run_background(self.search_run, self.search_generation, self.search.query)
+
+    def search_run(self, generation, query):                #Worker side of search_update, over whatever part of the library is indexed so far
+        post_event(SEARCH_EVENT, generation=generation, names=self.playlist_manager.search_index.search(query))
+
+    def search_apply(self, generation, names):              #Show a query's results unless a newer query has been run since
+        if generation != self.search_generation or not self.search.active:
+            return
+        self.search.results = self.playlist_manager.titles(names)
+        self.search.selected = 0
+
+    def get_tick_interval(self, focused):                   #Wakeup interval in ms for the main loop, None when nothing on screen can change by itself
+        interval = self.get_playback_interval(focused)
+        expiry = self.render_manager.error_manager.expire()            #Wake to take down an expired toast
+        if expiry is not None:
+            interval = min(interval or IDLE_TICK_MS, int(expiry * 1000) + 1)
+        if self.search.deadline is not None:                            #Wake to run a debounced query
+            interval = min(interval or IDLE_TICK_MS, max(1, int((self.search.deadline - time.perf_counter()) * 1000) + 1))
+        return interval
+
+    def get_playback_interval(self, focused):               #Wakeup interval in ms for playback progress, None when paused, stopped or empty
+        if not self.playlist_manager.tracks:
+            return None
+
+        if self.audio_manager.get_state() in [vlc.State.Paused, vlc.State.Stopped, vlc.State.NothingSpecial, vlc.State.Error]:
+            return None
+
+        if not focused:
+            return IDLE_TICK_MS
+
+        (current_time, total_time) = self.audio_manager.get_progress()
+        if total_time <= 0:                                 #Opening or buffering, check back soon for the length
+            return 1000 // ACTIVE_FPS
+
+        progress_width = self.render_manager.layout['progress_bar'][2]      #Wake about once per pixel of progress bar movement, but at least once a second
+        return int(max(1000 // ACTIVE_FPS, min(IDLE_TICK_MS, total_time * 1000 / progress_width)))
 
     def info_update(self):                                 #Renders song info to window, called by other methods to update info
         if not self.playlist_manager.tracks:
@@ -696,14 +3670,31 @@ class MediaPlayer:                  #Master class handling other classes, includ
             self.playlist_manager.get_track_title(),
             self.playlist_manager.get_track_artist(),
             self.playlist_manager.get_formatted_time(),
-            self.audio_manager.player.get_state()
+            self.audio_manager.get_state(),
+            self.get_art()
         )
 
+    def get_art(self):                                      #Cover art of the current track if it's loaded, the next track's is loaded once this one's is ready -- never waits on a decode
+        art_size = self.render_manager.art_size()
+        art = self.art.get(self.playlist_manager.get_current_track_path(), art_size)
+        if self.audio_manager.preloaded_path and (art or (self.playlist_manager.get_current_track_path(), art_size) in self.art.loaded):
+            self.art.request(self.audio_manager.preloaded_path, art_size)
+        return art
+
     def update(self):                                  #Update render info and all buttons
         if not self.playlist_manager.tracks:
+            self.render_manager.render_song_info(None, None, None, None)
+            self.render_manager.toasts_render()
+            self.render_manager.present()
             return
 
-        if self.audio_manager.player.get_state() in [vlc.State.Playing, vlc.State.Paused]:          #Confirm valid state or render blank progress bar
+        envelope = None
+        if self.waveforms:                  #Current track's waveform, the next one is analysed as soon as this one is ready
+            envelope = self.waveforms.get(self.playlist_manager.get_current_track_path())
+            if envelope is not None and self.audio_manager.preloaded_path:
+                self.waveforms.request(self.audio_manager.preloaded_path)
+
+        if self.audio_manager.get_state() in [vlc.State.Playing, vlc.State.Paused]:          #Confirm valid state or render blank progress bar
             (current_time, total_time) = self.audio_manager.get_progress()
 
             if total_time > 0:              #Check valid time, set time info or render blank progress bar
@@ -718,80 +3709,1242 @@ class MediaPlayer:                  #Master class handling other classes, includ
                         self.playlist_manager.get_track_title(),
                         self.playlist_manager.get_track_artist(),
                         time_pass,
-                        self.audio_manager.player.get_state()
+                        self.audio_manager.get_state(),
+                        self.get_art()
                     )
 
-                    self.render_manager.progress_bar_render(drag_position)
+                    self.render_manager.progress_bar_render(drag_position, envelope)
                 
                 else:
                     self.info_update()
-                    self.render_manager.progress_bar_render(progress)
+                    self.render_manager.progress_bar_render(progress, envelope)
 
             else:
-                self.render_manager.progress_bar_render(0)
+                self.render_manager.progress_bar_render(0, envelope)
 
         else:
-            self.render_manager.progress_bar_render(0)
+            self.render_manager.progress_bar_render(0, envelope)
 
         volume_percent = self.audio_manager.get_volume() / 100              #Update volume info in real time with drag position
         self.drag_buttons['volume'].update_pos(volume_percent)
         self.render_manager.volume_bar_render(self.audio_manager.get_volume())
 
-        for button in self.drag_buttons.values():
-            button.draw(self.render_manager.window)
+        for button_name, button in self.drag_buttons.items():
+            self.render_manager.drag_button_render(button_name, button)
         
-        for button in self.buttons.values():
-            button.draw(self.render_manager.window)
+        for button_name, button in self.buttons.items():
+            self.render_manager.button_render(button_name, button, self.mouse_pos)
+
+        if self.spectrum and self.spectrum.enabled:
+            self.spectrum.sync(self.playlist_manager.get_current_track_path(), self.audio_manager.state.current_time(), self.audio_manager.get_state() == vlc.State.Playing)
+            self.render_manager.spectrum_render(self.spectrum.analyse())
+
+        if profiler.lines:
+            self.render_manager.profiler_render(profiler.lines)
+
+        if self.search.active:
+            self.render_manager.search_render(self.search.query, [title for name, title in self.search.results], self.search.selected)
+
+        self.render_manager.toasts_render()
+
+        (parsed, requested) = self.metadata_service.progress()          #Library scan progress, disappears once everything requested is parsed
+        if parsed < requested:
+            self.render_manager.text_render('metadata_progress', f"Scanning library {parsed}/{requested}", self.render_manager.layout['metadata_progress'], self.render_manager.small_font)
         
-        pygame.display.flip()
+        self.render_manager.present()
+
+
+def sdl_library():                              #ctypes handle on the SDL2 that pygame itself loaded, None if it can't be found -- another copy would have its own event queue, so it has to report video as already initialised
+    import ctypes.util
+    import glob
+
+    package = os.path.dirname(pygame.__file__)
+    paths = []
+    for pattern in ('*SDL2-2*', '../pygame.libs/*SDL2-2*'):             #Bundled by the Linux pygame wheels, distro builds link the system one
+        paths += glob.glob(os.path.join(package, pattern))
+    system = ctypes.util.find_library('SDL2')
+    if system:
+        paths.append(system)
+
+    for path in paths:
+        try:
+            sdl = ctypes.CDLL(path)
+            if sdl.SDL_WasInit(0x20):                   #SDL_INIT_VIDEO
+                sdl.SDL_WaitEvent.argtypes = [ctypes.c_void_p]
+                return sdl
+        except (OSError, AttributeError):
+            continue
+    return None
+
+class FrameScheduler:                       #Decides when the main loop wakes on the asyncio loop -- a thread blocks in SDL until input arrives, events from other threads and timers wake it at once, runs at full rate only while animating
+    HIDDEN_EVENTS = (pygame.WINDOWHIDDEN, pygame.WINDOWMINIMIZED)
+    SHOWN_EVENTS = (pygame.WINDOWSHOWN, pygame.WINDOWRESTORED, pygame.WINDOWMAXIMIZED, pygame.WINDOWEXPOSED)
+    FOCUS_EVENTS = (pygame.WINDOWFOCUSGAINED, pygame.WINDOWFOCUSLOST)
+    WINDOW_EVENTS = HIDDEN_EVENTS + SHOWN_EVENTS + FOCUS_EVENTS
+
+    def __init__(self):
+        self.visible = True
+        self.focused = True
+        self.loop = None
+        self.wakeup = None                              #asyncio.Event set when another thread posts an event, or by anything on the loop that wants next_events to return
+        self.posted = deque()                           #Events posted from other threads, only touched on the loop's thread
+        self.last_frame = time.monotonic()
+        self.last_input = self.last_frame
+        self.input_mode = 'poll'                        #'thread' when the input thread waits in SDL, 'none' for drivers with no input of their own, 'poll' where SDL can't be reached
+        self.input_armed = threading.Event()            #Set by the loop to let the input thread wait for the next event
+        self.input_idle = threading.Event()             #Set by the input thread while it's outside SDL, nothing draws until it is
+        self.input_idle.set()
+        self.input_round = 0                            #Bumped each time the input thread is let wait, its wakeups from earlier rounds are ignored
+        self.input_woke = False                         #The last wakeup came from the input thread rather than a timer or posted event
+
+    def attach(self, loop):                             #Start taking events posted from other threads and waiting for input, call from inside the running loop
+        global event_scheduler
+        self.loop = loop
+        self.wakeup = asyncio.Event()
+        event_scheduler = self
+
+        driver = pygame.display.get_driver() if pygame.display.get_init() else None
+        if driver in ('dummy', 'offscreen'):            #Headless, the only input is what the player posts itself before waiting
+            self.input_mode = 'none'
+            return
+        if not sys.platform.startswith('linux') or driver not in ('x11', 'wayland'):         #Only these read the display connection from any thread -- Windows queues messages per thread and Cocoa must pump on the main thread, so they poll
+            return
+        sdl = sdl_library()
+        if sdl is not None:
+            self.input_mode = 'thread'
+            threading.Thread(target=self.input_wait, args=(sdl, loop), daemon=True).start()
+
+    def detach(self):                                   #Hand posting back to the pygame queue and let the input thread go, before the loop closes
+        global event_scheduler
+        if event_scheduler is self:
+            event_scheduler = None
+        self.loop = None
+        self.input_mode = 'poll'
+        self.input_armed.set()
+
+    def input_wait(self, sdl, loop):                    #Input thread -- waits in SDL for an event without taking it off the queue, then wakes the loop to drain it (pygame.event.wait polls every millisecond instead)
+        while True:
+            self.input_armed.wait()
+            self.input_armed.clear()
+            if self.loop is not loop:
+                self.input_idle.set()
+                return
+
+            input_round = self.input_round
+            sdl.SDL_WaitEvent(None)
+            self.input_idle.set()
+            try:
+                loop.call_soon_threadsafe(self.input_ready, input_round)
+            except RuntimeError:                                #Loop closed
+                return
+
+    def input_ready(self, input_round):
+        if input_round == self.input_round:                     #Otherwise the loop already moved on, from a timer or the release below
+            self.input_woke = True
+            self.wakeup.set()
+
+    def input_disarm(self):                             #Get the input thread out of SDL before the frame touches the display
+        if not self.input_idle.is_set():
+            pygame.event.post(pygame.event.Event(INPUT_WAKE_EVENT))
+            if not self.input_idle.wait(INPUT_RELEASE_TIMEOUT_MS / 1000):
+                print("Input thread didn't wake, polling for input instead")
+                self.input_mode = 'poll'
+        self.input_round += 1
+
+    def post(self, event):                              #Thread-safe, queue an event and wake the loop
+        try:
+            self.loop.call_soon_threadsafe(self.deliver, event)
+        except (AttributeError, RuntimeError):                  #Loop gone (shutting down)
+            pass
+
+    def deliver(self, event):
+        self.posted.append(event)
+        self.wakeup.set()
+
+    def handle_window_event(self, event):               #Track visibility and focus, returns True if the window contents need a full repaint
+        if event.type in self.HIDDEN_EVENTS:
+            self.visible = False
+        elif event.type in self.SHOWN_EVENTS:
+            self.visible = True
+            return True
+        elif event.type == pygame.WINDOWFOCUSGAINED:
+            self.focused = True
+        elif event.type == pygame.WINDOWFOCUSLOST:
+            self.focused = False
+        return False
+
+    def drain(self, events):                            #Move waiting input and posted events into the batch, returns the time
+        input_events = [event for event in pygame.event.get() if event.type != INPUT_WAKE_EVENT]
+        now = time.monotonic()
+        if input_events:
+            self.last_input = now
+            events.extend(input_events)
+        if self.posted:
+            events.extend(self.posted)
+            self.posted.clear()
+        return now
+
+    async def next_events(self, active, tick_interval):     #Returns the next batch of events -- capped at ACTIVE_FPS when active, otherwise returns as soon as anything arrives, the tick interval passes or the wakeup is set (even with nothing to hand back)
+        if active and self.visible:
+            deadline = self.last_frame + 1 / ACTIVE_FPS
+        elif tick_interval is not None:                 #Nothing is drawn while hidden, so only wake slowly
+            deadline = self.last_frame + (tick_interval if self.visible else max(tick_interval, IDLE_TICK_MS)) / 1000
+        else:
+            deadline = None
+
+        events = []
+        while True:
+            now = self.drain(events)
+            if (events and not active) or (deadline is not None and now >= deadline):
+                self.last_frame = now
+                return events
+
+            if active or self.input_mode != 'poll':     #Animating frames come soon enough to pick input up, otherwise something wakes the loop when it arrives
+                timeout = None if deadline is None else deadline - now
+            else:
+                poll = INPUT_POLL_MS if now - self.last_input < INPUT_IDLE_AFTER_MS / 1000 else INPUT_IDLE_POLL_MS
+                timeout = poll / 1000 if deadline is None else min(poll / 1000, deadline - now)
+
+            waiting = self.input_mode == 'thread' and not active
+            self.wakeup.clear()
+            self.input_woke = False
+            if waiting:
+                self.input_idle.clear()
+                self.input_armed.set()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+                woken = not self.input_woke
+            except asyncio.TimeoutError:
+                woken = False
+            finally:
+                if waiting:
+                    self.input_disarm()
+
+            if woken and not active:                    #A timer or another thread set the wakeup, the caller gets a batch even if it's empty
+                self.last_frame = self.drain(events)
+                return events
+
+class ControlServer:                                #Line-delimited JSON-RPC 2.0 over a Unix domain socket -- runs on the asyncio loop, so a command is applied between two frames and shows on the next
+    PARAMETERS = {'play': 'track', 'seek': 'position', 'volume': 'level', 'set_library': 'path', 'enqueue': 'track'}         #Main parameter of each method, lets the CLI client take it positionally
+    STATUS_EVENTS = {PLAYER_EVENT, CONTROL_EVENT, METADATA_EVENT, LIBRARY_EVENT, pygame.KEYDOWN, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION}         #Events that can change what status reports, a frame with none of them pushes nothing
+
+    def __init__(self, media_player, scheduler, path=CONTROL_SOCKET):
+        self.media_player = media_player
+        self.scheduler = scheduler
+        self.path = path
+        self.server = None
+        self.subscribers = {}                           #Format of {writer: (queue holding the latest unsent status, push task)} for connections that asked for status pushes
+        self.sent = {}                                  #Format of {writer: last status queued for it, minus the play position}
+        self.last_publish = 0                           #Monotonic time of the last push
+        self.publish_timer = None                       #Handle of a push held back by the rate limit
+        self.methods = {
+            'play': self.play,
+            'pause': self.pause,
+            'skip': lambda: self.media_player.skip(),
+            'rewind': lambda: self.media_player.rewind(),
+            'seek': self.seek,
+            'volume': self.volume,
+            'set_library': self.set_library,
+            'enqueue': self.enqueue,
+            'status': self.status,
+        }
+        self.signatures = {name: inspect.signature(method) for name, method in self.methods.items()}         #Params are checked against these before a call
+
+    async def start(self):                              #Listen on the socket, replacing a stale one left by a crash but not one another instance is serving
+        if not hasattr(asyncio, 'start_unix_server'):
+            raise OSError("Unix domain sockets aren't supported on this platform")
+
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise OSError(f"Another player is already listening on {self.path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.path)
+            finally:
+                probe.close()
+
+        self.server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+        os.chmod(self.path, 0o600)
+
+    def close(self):                                    #Stop listening and pushing, and remove the socket file
+        for writer in list(self.subscribers):
+            self.unsubscribe(writer)
+        if self.publish_timer:
+            self.publish_timer.cancel()
+            self.publish_timer = None
+        if self.server:
+            self.server.close()
+            self.server = None
+            with contextlib.suppress(OSError):
+                os.unlink(self.path)
+
+    async def handle_client(self, reader, writer):      #One connection, requests are answered in order
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                response = await self.dispatch(line, writer)
+                if response is not None:
+                    writer.write(json.dumps(response).encode() + b'\n')
+                    await writer.drain()
+        except (ConnectionError, ValueError):           #ValueError is a line over the stream limit
+            pass
+        finally:
+            self.unsubscribe(writer)
+            writer.close()
+
+    async def dispatch(self, line, writer):             #Run one request, returns the response object or None for a notification (no id) -- methods with blocking work are coroutines and are awaited
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32700, 'message': "Parse error"}}
+
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return {'jsonrpc': '2.0', 'id': None, 'error': {'code': -32600, 'message': "Invalid request"}}
+
+        request_id = request.get('id')
+        name = request['method']
+        params = request.get('params') or {}
+
+        if name == 'subscribe':                     #Answered with the current status, pushes follow from the next change
+            result = self.status()
+            self.subscribe(writer, result)
+            return {'jsonrpc': '2.0', 'id': request_id, 'result': result} if 'id' in request else None
+        if name == 'unsubscribe':
+            self.unsubscribe(writer)
+            return {'jsonrpc': '2.0', 'id': request_id, 'result': True} if 'id' in request else None
+        if name not in self.methods:
+            return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': -32601, 'message': f"Method not found: {name}"}}
+
+        try:                                        #Checked against the signature first, so a TypeError from inside a method is a bug and not the caller's fault
+            arguments = self.signatures[name].bind(*params) if isinstance(params, list) else self.signatures[name].bind(**params)
+        except TypeError as error:
+            return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': -32602, 'message': "Invalid params: " + str(error)}}
+
+        try:
+            result = self.methods[name](*arguments.args, **arguments.kwargs)
+            if asyncio.iscoroutine(result):
+                result = await result
+        except ValueError as error:                 #Raised by the methods for requests they can't carry out, the message is for the caller
+            return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': -32000, 'message': str(error)}}
+        except Exception as error:
+            print(f"Control method {name} failed: {error!r}")
+            return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': -32603, 'message': "Internal error"}}
+
+        if name != 'status':
+            self.scheduler.deliver(pygame.event.Event(CONTROL_EVENT))
+
+        if 'id' not in request:
+            return None
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+    def play(self, track=None):                         #Play a track by name, or resume/restart the current one
+        audio_manager = self.media_player.audio_manager
+        if track is not None and not isinstance(track, str):
+            raise ValueError(f"Track must be a file name: {track!r}")
+        if track is not None:
+            index = self.media_player.playlist_manager.tracks.find(os.path.basename(track))
+            if index < 0:
+                raise ValueError(f"Not in the library: {track}")
+            self.media_player.jump_to(index)
+        elif audio_manager.get_state() == vlc.State.Paused:
+            audio_manager.toggle_pause()
+        elif audio_manager.get_state() != vlc.State.Playing and self.media_player.playlist_manager.tracks:
+            audio_manager.play(self.media_player.playlist_manager.get_current_track_path())
+        return True
+
+    def pause(self):                                    #Pause if playing, unlike the space bar this never resumes
+        if self.media_player.audio_manager.get_state() == vlc.State.Playing:
+            self.media_player.audio_manager.toggle_pause()
+        return True
+
+    def seek(self, position):                           #Seek to a position in seconds
+        try:
+            position = float(position)
+        except (TypeError, ValueError):
+            raise ValueError(f"Position must be a number of seconds: {position!r}")
+        (current_time, total_time) = self.media_player.audio_manager.get_progress()
+        if total_time <= 0:
+            raise ValueError("Nothing seekable is playing")
+        self.media_player.audio_manager.set_progress(max(0, min(1, position / total_time)))
+        return True
+
+    def volume(self, level=None):                       #Set the volume (0-100), returns it -- without a level just reads it
+        if level is not None:
+            try:
+                level = int(level)
+            except (TypeError, ValueError):
+                raise ValueError(f"Volume must be a number from 0 to 100: {level!r}")
+            self.media_player.audio_manager.set_volume(max(0, min(100, level)))
+        return self.media_player.audio_manager.get_volume()
+
+    async def set_library(self, path):                  #Switch to another music directory, replaces typing a path on stdin -- the directory walk and index writes run on the executor, the switch itself back on the loop
+        if not isinstance(path, str):
+            raise ValueError(f"Path must be a string: {path!r}")
+        path = os.path.abspath(os.path.expanduser(path))
+        rows = await asyncio.get_running_loop().run_in_executor(None, PlaylistManager.scan, path, self.media_player.library_index)
+        self.media_player.update_config(path, rows)
+        return len(self.media_player.playlist_manager.tracks)
+
+    def enqueue(self, track):                           #Queue a track by name to play next
+        if not isinstance(track, str):
+            raise ValueError(f"Track must be a file name: {track!r}")
+        playlist_manager = self.media_player.playlist_manager
+        was_empty = not playlist_manager.queue
+        if not playlist_manager.enqueue(os.path.basename(track)):
+            raise ValueError(f"Not in the library: {track}")
+        if was_empty:                                   #The next track just changed, buffer it instead
+            playlist_manager.preload_next()
+        return list(playlist_manager.queue)
+
+    def status(self):                                   #Returns the player state as a dictionary
+        playlist_manager = self.media_player.playlist_manager
+        audio_manager = self.media_player.audio_manager
+        (current_time, total_time) = audio_manager.get_progress()
+        has_tracks = bool(playlist_manager.tracks)
+
+        return {
+            'state': str(audio_manager.get_state()).split('.')[-1].lower(),
+            'track': playlist_manager.tracks[playlist_manager.current_track] if has_tracks else None,
+            'title': playlist_manager.get_track_title() if has_tracks else None,
+            'artist': playlist_manager.get_track_artist() if has_tracks else None,
+            'index': playlist_manager.current_track,
+            'tracks': len(playlist_manager.tracks),
+            'time': round(current_time, 2),
+            'length': round(total_time, 2),
+            'volume': audio_manager.get_volume(),
+            'queue': list(playlist_manager.queue),
+            'shuffle': playlist_manager.shuffle,
+            'gapless': audio_manager.gapless,
+            'crossfade': audio_manager.crossfade,
+            'normalization': audio_manager.normalization,
+            'library': playlist_manager.music_dir,
+        }
 
+    def subscribe(self, writer, status):                #Start pushing status to a connection, from its own task so a slow reader only holds up itself -- status is what it was just sent
+        self.sent[writer] = {name: value for name, value in status.items() if name != 'time'}
+        if writer in self.subscribers:
+            return
+
+        pending = asyncio.Queue(maxsize=1)
+        self.subscribers[writer] = (pending, asyncio.get_running_loop().create_task(self.push(writer, pending)))
+
+    def unsubscribe(self, writer):
+        self.sent.pop(writer, None)
+        subscriber = self.subscribers.pop(writer, None)
+        if subscriber:
+            subscriber[1].cancel()
+
+    async def push(self, writer, pending):              #One subscriber's task -- send the latest status, and drop the connection if it stops reading
+        try:
+            while True:
+                message = await pending.get()
+                writer.write(message)
+                await asyncio.wait_for(writer.drain(), CONTROL_DRAIN_SECONDS)
+        except (ConnectionError, asyncio.TimeoutError):
+            self.subscribers.pop(writer, None)
+            self.sent.pop(writer, None)
+            writer.transport.abort()                    #Not close, that would wait to flush to a reader that isn't reading
+
+    def publish(self):                                  #Call after anything that may have changed the status, pushes at most CONTROL_PUBLISH_HZ times a second -- a change inside that window is sent once it ends
+        if not self.subscribers or self.publish_timer is not None:
+            return
+
+        wait = self.last_publish + 1 / CONTROL_PUBLISH_HZ - time.monotonic()
+        if wait > 0:
+            self.publish_timer = asyncio.get_running_loop().call_later(wait, self.publish_now)
+        else:
+            self.publish_now()
+
+    def publish_now(self):                              #Queue status for every subscriber whose last one differs in anything but the play position
+        self.publish_timer = None
+        self.last_publish = time.monotonic()
+        status = self.status()
+        key = {name: value for name, value in status.items() if name != 'time'}
+        message = None
+        for writer, (pending, task) in self.subscribers.items():
+            if self.sent.get(writer) == key:
+                continue
+
+            self.sent[writer] = key
+            message = message or json.dumps({'jsonrpc': '2.0', 'method': 'status', 'params': status}).encode() + b'\n'
+            if pending.full():                          #Still sending an older one, only the latest status matters
+                pending.get_nowait()
+            pending.put_nowait(message)
+
+def control_client(method, *args):              #CLI for the control socket -- arguments are key=value or the method's main parameter, values parsed as JSON where they can be; subscribe keeps printing pushed status
+    params = {}
+    for argument in args:
+        (key, separator, value) = argument.partition('=')
+        if not separator:
+            (key, value) = (ControlServer.PARAMETERS.get(method, 'value'), argument)
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(CONTROL_SOCKET)
+    except OSError as error:
+        print(f"Can't reach the player on {CONTROL_SOCKET}: {error}", file=sys.stderr)
+        sys.exit(1)
+
+    client.sendall(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params}).encode() + b'\n')
+    with client, client.makefile('r') as stream:
+        for line in stream:
+            message = json.loads(line)
+            if 'error' in message:
+                print(message['error']['message'], file=sys.stderr)
+                sys.exit(1)
+
+            print(json.dumps(message.get('result', message.get('params')), indent=2))
+            if method != 'subscribe':
+                break
+
+class ScriptedInput:                        #Canned input for headless runs, one list of events per frame, replayed in a cycle
+    def __init__(self, frames):
+        self.frames = frames                            #Format of [[event, ...], ...]
+
+    def post(self, frame):                              #Queue the events for a frame, they come back out of the normal event queue
+        for event in self.frames[frame % len(self.frames)]:
+            pygame.event.post(event)
+
+    @classmethod
+    def session(cls, media_player):                     #A typical few seconds of use against the current layout -- hovering, dragging both bars, volume keys and a search
+        mouse = lambda event_type, pos, **attributes: pygame.event.Event(event_type, pos=pos, **attributes)
+        key = lambda key: pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode='', scancode=0)
+        text = lambda text: pygame.event.Event(pygame.TEXTINPUT, text=text)
+        width = media_player.render_manager.window_width
+        height = media_player.render_manager.window_height
+        frames = []
+
+        for step in range(30):                          #Sweep the pointer across the buttons
+            pos = (int(width * step / 30), int(height * 0.85))
+            frames.append([mouse(pygame.MOUSEMOTION, pos, rel=(1, 0), buttons=(0, 0, 0))])
+
+        for name in ('volume', 'progress'):             #Grab each knob, drag it across its bar and let go
+            button = media_player.drag_buttons[name]
+            y = button.center_y
+            frames.append([mouse(pygame.MOUSEBUTTONDOWN, (int(button.center_x), int(y)), button=1)])
+            for step in range(30):
+                x = button.min_x + (button.max_x - button.min_x) * step / 29
+                frames.append([mouse(pygame.MOUSEMOTION, (int(x), int(y)), rel=(1, 0), buttons=(1, 0, 0))])
+            frames.append([mouse(pygame.MOUSEBUTTONUP, (int(button.max_x), int(y)), button=1)])
+
+        frames.extend([[key(pygame.K_UP)], [key(pygame.K_DOWN)]] * 5)
+        frames.append([key(pygame.K_SLASH), text('/')])
+        frames.extend([text(letter)] for letter in 'song')
+        frames.extend([key(pygame.K_BACKSPACE)] for _ in range(4))
+        frames.append([key(pygame.K_ESCAPE)])
+        frames.extend([] for _ in range(30))            #Plain playback frames
+        return cls(frames)
+
+BENCHMARKS = {}                     #Format of {name: function}, run with: python "Media Player 1.2.py" --bench <name> [arguments]
+
+def benchmark(name):                #Decorator registering a benchmark under a name
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+def wait_until(condition, timeout):             #Poll a condition until it holds or the timeout in seconds passes, returns whether it held
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+@benchmark('gapless')
+def benchmark_gapless(music_dir, pairs=5):      #Measure the silence in ms between consecutive tracks on automatic handover from the decoded audio itself, plays the last few seconds of each track, fails past GAPLESS_MAX_GAP_MS
+    audio_manager = AudioManager()
+    tracks = sorted(f for f in os.listdir(music_dir) if f.lower().endswith(SUPPORTED_EXTENSIONS))
+    heard = {}                                  #Format of {player: [(monotonic time a buffer arrived, time its audio ends), ...]}, written on libvlc's audio threads
+    callbacks = []
+
+    def on_play(player):                        #Each player gets its own callback so buffers can be told apart
+        def play(data, samples, count, pts):
+            now = time.monotonic()
+            heard.setdefault(player, []).append((now, now + count / LOUDNESS_SAMPLE_RATE))
+        return play
+
+    for player in (audio_manager.player, audio_manager.standby):       #Decoded audio comes back here instead of going to a sound card
+        callbacks.append((
+            vlc.CallbackDecorators.AudioPlayCb(on_play(player)),
+            vlc.CallbackDecorators.AudioPauseCb(lambda data, pts: None),
+            vlc.CallbackDecorators.AudioResumeCb(lambda data, pts: None),
+            vlc.CallbackDecorators.AudioFlushCb(lambda data, pts: None),
+            vlc.CallbackDecorators.AudioDrainCb(lambda data: None),
+        ))
+        player.audio_set_callbacks(*callbacks[-1], None)
+        player.audio_set_format('S16N', LOUDNESS_SAMPLE_RATE, 2)
+
+    gaps = []
+    for index in range(min(int(pairs), len(tracks) - 1)):
+        audio_manager.last_gap_ms = None
+        heard.clear()
+        audio_manager.play(os.path.join(music_dir, tracks[index]))
+        audio_manager.preload(os.path.join(music_dir, tracks[index + 1]))
+
+        if not wait_until(lambda: audio_manager.state.length > 0 and audio_manager.preload_ready, 10):
+            print(f"{tracks[index]}: timed out buffering")
+            continue
+
+        (outgoing, incoming) = (audio_manager.player, audio_manager.standby)
+        audio_manager.player.set_time(max(0, audio_manager.state.length - GAPLESS_LEAD_MS - 1500))
+        sought = time.monotonic()               #Anything the standby player decoded before this was its paused pre-roll
+        if not wait_until(lambda: audio_manager.last_gap_ms is not None, 10):          #Set once the old track reported its end
+            print(f"{tracks[index]}: timed out waiting for handover")
+            continue
+
+        ending = [end for (arrived, end) in heard.get(outgoing, []) if arrived >= sought]
+        starting = [arrived for (arrived, end) in heard.get(incoming, []) if arrived >= sought]
+        if not ending or not starting:
+            print(f"{tracks[index]}: no audio heard across the handover")
+            continue
+
+        gap = (starting[0] - ending[-1]) * 1000             #Positive is silence, negative is overlap
+        gaps.append(gap)
+        print(f"{tracks[index]} -> {tracks[index + 1]}: {gap:.1f} ms (libvlc events {audio_manager.last_gap_ms:.1f} ms)")
+
+    audio_manager.cleanup()
+    if not gaps:
+        print("No handovers measured")
+        sys.exit(1)
+
+    print(f"Gap over {len(gaps)} handovers: min {min(gaps):.1f} ms, max {max(gaps):.1f} ms, mean {sum(gaps) / len(gaps):.1f} ms")
+    if max(gaps) > GAPLESS_MAX_GAP_MS:
+        print(f"Gap exceeded {GAPLESS_MAX_GAP_MS} ms")
+        sys.exit(1)
+
+@benchmark('seek')
+def benchmark_seek(music_dir, seeks=20):        #Scrub seek latency per format -- from a scrub request to the first decoded audio after libvlc's flush, and to libvlc reporting the new time (what scrubbing paces on), then a simulated drag
+    seeks = int(seeks)
+    audio_manager = AudioManager()
+    resumed = {}                                #Monotonic time of the first buffer after a flush, written on libvlc's audio thread
+
+    def on_play(data, samples, count, pts):
+        if resumed.get('flushed') and 'audio' not in resumed:
+            resumed['audio'] = time.monotonic()
+
+    def on_flush(data, pts):
+        resumed['flushed'] = True
+
+    callbacks = (
+        vlc.CallbackDecorators.AudioPlayCb(on_play),
+        vlc.CallbackDecorators.AudioPauseCb(lambda data, pts: None),
+        vlc.CallbackDecorators.AudioResumeCb(lambda data, pts: None),
+        vlc.CallbackDecorators.AudioFlushCb(on_flush),
+        vlc.CallbackDecorators.AudioDrainCb(lambda data: None),
+    )
+    for player in (audio_manager.player, audio_manager.standby):       #Decoded audio comes back here instead of going to a sound card
+        player.audio_set_callbacks(*callbacks, None)
+        player.audio_set_format('S16N', LOUDNESS_SAMPLE_RATE, 2)
+
+    random_seeks = random.Random(0)
+    for extension in SUPPORTED_EXTENSIONS:
+        tracks = sorted(f for f in os.listdir(music_dir) if f.lower().endswith(extension))
+        if not tracks:
+            print(f"{extension}: no tracks")
+            continue
+
+        audio_manager.play(os.path.join(music_dir, tracks[0]))
+        if not wait_until(lambda: audio_manager.state.length > 0 and audio_manager.get_state() == vlc.State.Playing, 10):
+            print(f"{extension}: timed out starting {tracks[0]}")
+            continue
+        time.sleep(0.5)
+
+        to_audio, to_time = [], []
+        for _ in range(seeks):
+            resumed.clear()
+            audio_manager.last_seek_ms = None
+            start = time.monotonic()
+            audio_manager.scrub(random_seeks.uniform(0.05, 0.9))
+            if wait_until(lambda: 'audio' in resumed, 5):
+                to_audio.append((resumed['audio'] - start) * 1000)
+            if wait_until(lambda: audio_manager.last_seek_ms is not None, SEEK_TIMEOUT_MS / 1000):
+                to_time.append(audio_manager.last_seek_ms)
+            time.sleep(0.2)
+
+        sent = audio_manager.seeks_sent
+        for step in range(100):                 #A 1 s drag across the track, one motion event every 10 ms
+            audio_manager.scrub(0.1 + step * 0.008)
+            time.sleep(0.01)
+        target = audio_manager.state.length * (0.1 + 99 * 0.008)
+        wait_until(lambda: abs(audio_manager.state.time - target) <= SEEK_TOLERANCE_MS, 2)
+
+        for label, latencies in (('seek to audio', to_audio), ('seek to time', to_time)):
+            if latencies:
+                stats = frame_stats(latencies)
+                print(f"{extension} {label:<13} p50 {stats['p50_ms']:7.1f} ms  p95 {stats['p95_ms']:7.1f} ms  max {stats['max_ms']:7.1f} ms  ({len(latencies)}/{seeks} seeks)")
+            else:
+                print(f"{extension} {label:<13} no seeks landed")
+        print(f"{extension} drag: 100 scrubs sent as {audio_manager.seeks_sent - sent} seeks, settled {abs(audio_manager.state.time - target):.0f} ms from the final target")
+
+    audio_manager.cleanup()
+
+@benchmark('track_store')
+def benchmark_track_store(*sizes):              #Memory and indexing cost of the track store against a plain list of names and titles, for 10k, 100k and 1M tracks by default
+    import tracemalloc
+    import random
+
+    for size in [int(size) for size in sizes] or [10_000, 100_000, 1_000_000]:
+        make_names = lambda: [f"artist_{index % 997:03d}_some_song_title_{index:07d}.mp3" for index in range(size)]
+
+        tracemalloc.start()                     #Baseline is what PlaylistManager used to hold, a list of name strings plus the titles it would need
+        names = make_names()
+        baseline = (names, [format_title(name) for name in names])
+        list_bytes = tracemalloc.get_traced_memory()[0]
+        del baseline
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        store = TrackStore('/music', names)
+        store_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()             #Timed separately, tracemalloc slows allocation down a lot
+        store = TrackStore('/music', names)
+        build_time = time.perf_counter() - start
+
+        for index in range(size):                 #Worst case, every title formatted and stored
+            store.title(index)
+        titled_bytes = store.memory_usage()
+
+        lookups = [random.randrange(size) for _ in range(100_000)]
+        start = time.perf_counter()
+        for index in lookups:
+            store.title(index)
+        lookup_time = (time.perf_counter() - start) / len(lookups)
+
+        print(f"{size:>9} tracks: store {store_bytes / 2**20:7.1f} MiB ({store_bytes / size:5.1f} B/track), with all titles {titled_bytes / 2**20:7.1f} MiB ({titled_bytes / size:5.1f} B/track), "
+              f"list {list_bytes / 2**20:7.1f} MiB ({list_bytes / size:5.1f} B/track), build {build_time * 1000:.0f} ms, title lookup {lookup_time * 1e9:.0f} ns")
+
+@benchmark('search')
+def benchmark_search(size=100_000):             #Build time and query latency of the search index over synthetic tracks with artist and album tags
+    syllables = ['ka', 'lo', 'ren', 'mi', 'sa', 'tor', 'vel', 'do', 'ne', 'ri', 'an', 'bel', 'cho', 'fa', 'gru', 'ha', 'is', 'jo', 'mar', 'ost']
+    words = ['love', 'night', 'dream', 'summer', 'rain', 'shadow', 'storm'] + [a + b + c for a in syllables for b in syllables for c in ('', 'n', 'es')]
+    size = int(size)
+    search_index = SearchIndex()
+
+    start = time.perf_counter()
+    for index in range(size):
+        name = f"{index % 20:02} {words[(index * 7) % len(words)]} {words[(index * 13 + 5) % len(words)]} {words[(index // 3) % len(words)]}.mp3"
+        search_index.add(name, format_title(name), (None, f"{words[index % 997]} {words[index % 389]}", f"{words[(index // 12) % len(words)]}"))
+    build_time = time.perf_counter() - start
+
+    queries = ['love', 'lvoe', 'night dream', 'summr rain', 'kalo', 'marvel 12', 'shdow storm', 'e', 'chofes grune ostan', 'do', 'mp3']
+    timings = {query: [] for query in queries}
+    for _ in range(5):
+        for query in queries:
+            start = time.perf_counter()
+            search_index.search(query)
+            timings[query].append((time.perf_counter() - start) * 1000)
+
+    print(f"Indexed {size} tracks in {build_time:.2f} s, {len(search_index.postings)} trigrams")
+    slow = []
+    for query, times in timings.items():
+        times.sort()
+        print(f"  {query!r:>22}  p50 {times[len(times) // 2]:6.2f} ms  max {times[-1]:6.2f} ms  {search_index.search(query, 3)}")
+        if times[len(times) // 2] > SEARCH_LATENCY_MS:
+            slow.append(query)
+
+    if slow:
+        print(f"Queries over {SEARCH_LATENCY_MS} ms: " + ", ".join(map(repr, slow)))
+        sys.exit(1)
+
+def frame_stats(times):                                     #Summary of a list of frame times in ms for the frame benchmark
+    times = sorted(times)
+    percentile = lambda share: round(times[min(len(times) - 1, int(len(times) * share))], 3)
+    return {
+        'frames': len(times),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(times[-1], 3),
+    }
 
-def main():             #Create media player, run main loop for event handling, events are self explanatory, update and progress whenever possible
+def measure_frames(step, frames):              #Time a per-frame callable back to back, then count what it allocates per frame in a second pass (tracemalloc would skew the timings)
+    import tracemalloc
+
+    times = []
+    for frame in range(frames):
+        start = time.perf_counter()
+        step(frame)
+        times.append((time.perf_counter() - start) * 1000)
+    stats = frame_stats(times)
+
+    peak_bytes = 0
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    for frame in range(frames):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        step(frame)
+        peak_bytes += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    stats['alloc_peak_bytes_per_frame'] = round(peak_bytes / frames)            #Transient high water mark above what was live before the frame
+    stats['retained_blocks_per_frame'] = round((sys.getallocatedblocks() - blocks) / frames, 2)          #Net growth, should stay near zero once caches are warm
+    return stats
+
+def measure_paced(media_player, scheduler, script, seconds):            #Run the real main loop, event waits and frame cap included, for a while -- shows what the player costs in CPU when left running
+    times = []
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    async def run():
+        scheduler.attach(asyncio.get_running_loop())
+        wall_end = wall_start + seconds
+        asyncio.get_running_loop().call_at(asyncio.get_running_loop().time() + seconds, scheduler.wakeup.set)      #Guarantees a wakeup at the end even when the loop would sleep indefinitely
+        frame = 0
+        while time.perf_counter() < wall_end:
+            if script:
+                script.post(frame)
+            events = await scheduler.next_events(media_player.is_animating(), media_player.get_tick_interval(scheduler.focused))
+            start = time.perf_counter()
+            run_frame(media_player, scheduler, events)
+            times.append((time.perf_counter() - start) * 1000)
+            frame += 1
+        scheduler.detach()
+
+    asyncio.run(run())
+    stats = frame_stats(times)
+    stats['cpu_ms_per_second'] = round((time.process_time() - cpu_start) / (time.perf_counter() - wall_start) * 1000, 1)
+    return stats
+
+@benchmark('frames')
+def benchmark_frames(output='frame_bench.json', frames=300, *sizes):          #Headless frame time percentiles, allocations per frame and CPU use of update(), render_song_info() and the main loop at several window sizes, written as JSON
+    import platform
+
+    headless_init()
+    frames = int(frames)
     media_player = MediaPlayer()
+    media_player.start_services()
+    render_manager = media_player.render_manager
+    scheduler = FrameScheduler()
+    while media_player.playlist_manager.build_search_index(budget_ms=1000):            #Finish background indexing first so it doesn't land in the timings
+        pass
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'machine': platform.machine(),
+        'tracks': len(media_player.playlist_manager.tracks),
+        'frames': frames,
+        'sizes': {},
+    }
 
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                media_player.quit()
+    for size in sizes or ('1000x500', '1600x900', '2560x1440'):
+        (width, height) = (int(value) for value in size.split('x'))
+        pygame.display.set_mode((width, height), pygame.RESIZABLE)
+        render_manager.resize_window()
+        media_player.layout_widgets()
+        script = ScriptedInput.session(media_player)
+
+        title = media_player.playlist_manager.get_track_title()
+        artist = media_player.playlist_manager.get_track_artist()
+        play_state = media_player.audio_manager.get_state()
+
+        def main_loop(frame):
+            script.post(frame)
+            run_frame(media_player, scheduler, pygame.event.get())
+
+        results['sizes'][size] = {
+            'update': measure_frames(lambda frame: media_player.update(), frames),
+            'render_song_info': measure_frames(lambda frame: render_manager.render_song_info(title, artist, f"{frame // 60}:{frame % 60:02} / 3:00", play_state), frames),
+            'main_loop': measure_frames(main_loop, frames),
+            'main_loop_paced': measure_paced(media_player, scheduler, script, frames / ACTIVE_FPS),
+        }
+        pygame.event.clear()                            #The script may have stopped mid drag or mid search
+        media_player.handle_mouse_up()
+        media_player.search.active = False
+        results['sizes'][size]['idle_paced'] = measure_paced(media_player, scheduler, None, 3)
+
+        for name, stats in results['sizes'][size].items():
+            print(f"{size:>10} {name:<17} p50 {stats['p50_ms']:7.3f} ms  p95 {stats['p95_ms']:7.3f} ms  p99 {stats['p99_ms']:7.3f} ms  " +
+                  (f"alloc {stats['alloc_peak_bytes_per_frame']} B/frame" if 'alloc_peak_bytes_per_frame' in stats else f"cpu {stats['cpu_ms_per_second']:.1f} ms/s over {stats['frames']} frames"))
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+    media_player.quit()
+
+@benchmark('control')
+def benchmark_control(count=2000):              #Round trip latency and pipelined throughput (commands/sec) of the control socket against a headless player, with a local client
+    import tempfile
+
+    headless_init()
+    count = int(count)
+    path = os.path.join(tempfile.mkdtemp(), 'control.sock')
+    request = lambda request_id, method, params: json.dumps({'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}).encode() + b'\n'
+
+    def client():                               #Alternate status reads and volume writes one at a time, then send a burst without waiting and read the answers
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(path)
+        stream = connection.makefile('rb')
+
+        latencies = []
+        for index in range(count):
+            start = time.perf_counter()
+            connection.sendall(request(index, 'volume', {'level': index % 101}) if index % 2 else request(index, 'status', {}))
+            stream.readline()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        burst = b''.join(request(index, 'volume', {'level': index % 101}) for index in range(count))
+        start = time.perf_counter()
+        sender = threading.Thread(target=connection.sendall, args=(burst,))             #Sent from another thread so neither side's socket buffer can stall the other
+        sender.start()
+        for _ in range(count):
+            stream.readline()
+        throughput = count / (time.perf_counter() - start)
+        sender.join()
+
+        connection.close()
+        return (sorted(latencies), throughput)
+
+    async def run():
+        media_player = MediaPlayer()
+        scheduler = FrameScheduler()
+        scheduler.attach(asyncio.get_running_loop())
+        server = ControlServer(media_player, scheduler, path)
+        await server.start()
+
+        result = asyncio.get_running_loop().run_in_executor(None, client)
+        while not result.done():
+            events = await scheduler.next_events(media_player.is_animating(), media_player.get_tick_interval(scheduler.focused))
+            run_frame(media_player, scheduler, events)
+
+        server.close()
+        scheduler.detach()
+        return (media_player, result.result())
+
+    (media_player, (latencies, throughput)) = asyncio.run(run())
+    percentile = lambda share: latencies[min(len(latencies) - 1, int(len(latencies) * share))]
+    print(f"Round trip over {count} commands: p50 {percentile(0.5):.3f} ms, p95 {percentile(0.95):.3f} ms, p99 {percentile(0.99):.3f} ms, max {latencies[-1]:.3f} ms")
+    print(f"Pipelined: {throughput:,.0f} commands/sec")
+    media_player.quit()
+
+@benchmark('startup')
+def benchmark_startup(runs=10, output='startup_bench.json', baseline=None):            #Time to first audio and first frame over fresh headless processes, by phase, written as JSON -- given an earlier output as baseline, phases that got slower are flagged and the exit status is 1
+    import subprocess
+    import statistics
+
+    runs = int(runs)
+    marks = {}                                  #Format of {phase: [ms, ...]}
+    phases = {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), '--headless', '--startup-report'], capture_output=True, text=True, timeout=120)
+        report = next((json.loads(line) for line in reversed(result.stdout.splitlines()) if line.startswith('{')), None)
+        if report is None:
+            print("Startup run failed:\n" + result.stdout + result.stderr)
+            sys.exit(1)
+        for phase, value in report['marks'].items():
+            marks.setdefault(phase, []).append(value)
+        for phase, value in report['phases'].items():
+            phases.setdefault(phase, []).append(value)
+
+    summarize = lambda values: {'p50_ms': round(statistics.median(values), 2), 'max_ms': round(max(values), 2)}
+    results = {
+        'runs': runs,
+        'python': sys.version.split()[0],
+        'marks': {phase: summarize(values) for phase, values in sorted(marks.items(), key=lambda item: statistics.median(item[1]))},
+        'phases': {phase: summarize(values) for phase, values in phases.items()},
+    }
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    previous = {}
+    if baseline:
+        with open(baseline) as file:
+            previous = json.load(file)['marks']
+
+    regressions = []
+    for phase, stats in results['marks'].items():
+        line = f"{phase:>12} at p50 {stats['p50_ms']:8.1f} ms  max {stats['max_ms']:8.1f} ms  (phase p50 {results['phases'][phase]['p50_ms']:.1f} ms)"
+        if phase in previous:
+            before = previous[phase]['p50_ms']
+            line += f"  baseline {before:8.1f} ms"
+            if stats['p50_ms'] > before * (1 + STARTUP_REGRESSION) and stats['p50_ms'] > before + STARTUP_NOISE_MS:
+                line += "  REGRESSED"
+                regressions.append(phase)
+        print(line)
+    print(f"Results written to {output}")
+
+    if regressions:
+        print("Startup regressed: " + ", ".join(regressions))
+        sys.exit(1)
+
+@benchmark('input')
+def benchmark_input(frames=120, rate=8000):     #Input storm -- a volume drag from a mouse polling at rate Hz, frame time and libvlc volume calls per frame with motion coalescing against dispatching every event
+    headless_init()
+    frames = int(frames)
+    per_frame = max(1, int(rate) // ACTIVE_FPS)
+    media_player = MediaPlayer()
+    scheduler = FrameScheduler()
+    button = media_player.drag_buttons['volume']
+    y = int(button.center_y)
+    width = button.max_x - button.min_x
+
+    calls = [0]
+    set_volume = media_player.audio_manager.set_volume
+    def counted_set_volume(volume):                 #Each one is an audio_set_volume ctypes call
+        calls[0] += 1
+        set_volume(volume)
+    media_player.audio_manager.set_volume = counted_set_volume
+
+    for coalesce in (True, False):
+        media_player.handle_mouse_down((int(button.center_x), y))
+        calls[0] = 0
+        times = []
+        for frame in range(frames):
+            for step in range(per_frame):               #Back and forth across the bar, a little under a sweep per frame
+                phase = ((frame * per_frame + step) / (per_frame * 1.5)) % 2
+                x = button.min_x + width * (phase if phase < 1 else 2 - phase)
+                pygame.event.post(pygame.event.Event(pygame.MOUSEMOTION, pos=(int(x), y), rel=(1, 0), buttons=(1, 0, 0)))
+            events = pygame.event.get()
+
+            start = time.perf_counter()
+            if coalesce:
+                run_frame(media_player, scheduler, events)
+            else:                                       #Every event handled and applied on its own, as before coalescing
+                for event in events:
+                    handle_event(media_player, scheduler, event)
+                    media_player.apply_input()
+                run_frame(media_player, scheduler, [])
+            times.append((time.perf_counter() - start) * 1000)
+        media_player.handle_mouse_up()
+
+        stats = frame_stats(times)
+        print(f"{'coalesced' if coalesce else 'every event':<12} {per_frame} motion events/frame  p50 {stats['p50_ms']:7.3f} ms  p95 {stats['p95_ms']:7.3f} ms  max {stats['max_ms']:7.3f} ms  "
+              f"volume calls {calls[0] / frames:.1f}/frame")
+
+    media_player.quit()
+
+@benchmark('resize')
+def benchmark_resize(frames=60, drags=3):        #Live window resizing -- frame times while a drag keeps changing the size (scaled preview), the settle frame's full relayout, and layout cache use over repeated drags
+    headless_init()
+    frames = int(frames)
+    media_player = MediaPlayer()
+    render_manager = media_player.render_manager
+    scheduler = FrameScheduler()
+    run_frame(media_player, scheduler, [])
+
+    for drag in range(int(drags)):
+        dragging, settling = [], []
+        for frame in range(frames):                     #Widen and shrink the window a few pixels a frame, the same path each drag
+            width = WINDOW_WIDTH + int(300 * math.sin(math.pi * frame / frames))
+            height = WINDOW_HEIGHT + int(150 * math.sin(math.pi * frame / frames))
+            pygame.display.set_mode((width, height), pygame.RESIZABLE)         #What SDL does to the window surface during a user resize
+            events = [pygame.event.Event(pygame.VIDEORESIZE, size=(width, height), w=width, h=height)]
+
+            start = time.perf_counter()
+            run_frame(media_player, scheduler, events)
+            dragging.append((time.perf_counter() - start) * 1000)
+
+        time.sleep(RESIZE_SETTLE_MS / 1000)
+        start = time.perf_counter()
+        run_frame(media_player, scheduler, [])
+        settling.append((time.perf_counter() - start) * 1000)
+
+        stats = frame_stats(dragging)
+        print(f"drag {drag + 1}: {frames} resize frames p50 {stats['p50_ms']:7.3f} ms  p95 {stats['p95_ms']:7.3f} ms  max {stats['max_ms']:7.3f} ms  "
+              f"settle {settling[0]:.3f} ms  layouts computed {render_manager.layout_manager.computed}")
+
+    media_player.quit()
+
+@benchmark('errors')
+def benchmark_errors(count=1000, frames=120):   #Cost of a burst of errors against a headless player -- time to raise them, then frame times while their toasts are up, playback must carry on throughout
+    headless_init()
+    (count, frames) = (int(count), int(frames))
+    scheduler = FrameScheduler()
+    media_player = MediaPlayer()
+    state = media_player.audio_manager.get_state()
 
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE:
-                    media_player.pause()
-                
-                elif event.key == pygame.K_RIGHT:
-                    media_player.skip()
-                
-                elif event.key == pygame.K_LEFT:
-                    media_player.rewind()
-                
-                elif event.key == pygame.K_UP:
-                    media_player.audio_manager.volume_raise(5)
-                
-                elif event.key == pygame.K_DOWN:
-                    media_player.audio_manager.volume_lower(5)
-                
-                elif event.key == pygame.K_s:
-                    media_player.stop()
-                
-                elif event.key == pygame.K_ESCAPE:
-                    media_player.quit()
-            
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                media_player.handle_mouse_down(pygame.mouse.get_pos())
-            
-            elif event.type == pygame.MOUSEBUTTONUP:
-                media_player.handle_mouse_up()
-            
-            elif event.type == pygame.MOUSEMOTION:
-                media_player.handle_mouse_motion(pygame.mouse.get_pos())
-            
-            elif event.type == pygame.VIDEORESIZE:
-                media_player.render_manager.resize_window()
-                media_player.buttons_init()
-                media_player.drag_buttons_init()
-            
-        media_player.update()
-        media_player.progress()
-        pygame.time.Clock().tick(30)            #Set framerate to 30 fps
+    start = time.perf_counter()
+    for index in range(count):                  #Half repeats of a few messages, half distinct ones
+        message = f"Repeated error {index % 5}" if index % 2 else f"Distinct error {index}"
+        media_player.render_manager.error_prompt_render(message, fatal=False)
+    burst_ms = (time.perf_counter() - start) * 1000
+    media_player.render_manager.error_prompt_render("Fatal error after the burst", fatal=True)          #Over the rate limit, but must still get its own toast
+    toasts = media_player.render_manager.error_manager.toasts
+
+    stats = measure_frames(lambda frame: run_frame(media_player, scheduler, pygame.event.get()), frames)
+    print(f"Burst of {count} errors: {burst_ms:.2f} ms ({burst_ms * 1000 / count:.2f} us each), {len(media_player.render_manager.error_manager.toasts)} toasts shown")
+    print(f"Frames after: p50 {stats['p50_ms']:.3f} ms, p95 {stats['p95_ms']:.3f} ms, p99 {stats['p99_ms']:.3f} ms, max {stats['max_ms']:.3f} ms")
+    print(f"Playback state before {state}, after {media_player.audio_manager.get_state()}")
+    print(f"Fatal error toast shown: {'Fatal error after the burst' in toasts}, summary toast fatal: {toasts.get(ErrorManager.SUPPRESSED, [False])[0]}")
+    media_player.quit()
+
+def handle_event(media_player, scheduler, event):           #Dispatch one event, events are self explanatory
+    if event.type == pygame.QUIT:
+        media_player.quit()
+
+    elif event.type == METADATA_EVENT:
+        media_player.playlist_manager.apply_metadata()
+
+    elif event.type == LIBRARY_EVENT:
+        media_player.library_update()
+
+    elif event.type == LOUDNESS_EVENT:
+        media_player.playlist_manager.apply_loudness()
+
+    elif event.type == SEARCH_EVENT:
+        media_player.search_apply(event.generation, event.names)
+
+    elif event.type in FrameScheduler.WINDOW_EVENTS:
+        if scheduler.handle_window_event(event):
+            media_player.render_manager.full_redraw = True
 
-main()              #Call main
+    elif event.type == pygame.KEYDOWN and media_player.search.active:
+        media_player.search_key(event.key)
+
+    elif event.type == pygame.TEXTINPUT:
+        media_player.search_text(event.text)
+
+    elif event.type == pygame.KEYDOWN:
+        if event.key == pygame.K_SLASH:
+            media_player.search_open(swallow='/')
+
+        elif event.key == pygame.K_f and event.mod & pygame.KMOD_CTRL:
+            media_player.search_open()
+
+        elif event.key == pygame.K_SPACE:
+            media_player.pause()
+        
+        elif event.key == pygame.K_RIGHT:
+            media_player.skip()
+        
+        elif event.key == pygame.K_LEFT:
+            media_player.rewind()
+        
+        elif event.key == pygame.K_UP:
+            media_player.audio_manager.volume_raise(5)
+        
+        elif event.key == pygame.K_DOWN:
+            media_player.audio_manager.volume_lower(5)
+        
+        elif event.key == pygame.K_s:
+            media_player.stop()
+
+        elif event.key == pygame.K_g:
+            media_player.toggle_gapless()
+
+        elif event.key == pygame.K_h:
+            media_player.toggle_shuffle()
+
+        elif event.key == pygame.K_c:
+            media_player.cycle_crossfade()
+
+        elif event.key == pygame.K_v:
+            media_player.toggle_spectrum()
+
+        elif event.key == pygame.K_n:
+            media_player.cycle_normalization()
+
+        elif event.key == pygame.K_F3:
+            profiler.toggle()
+        
+        elif event.key == pygame.K_ESCAPE:
+            media_player.quit()
+    
+    elif event.type == pygame.MOUSEBUTTONDOWN:
+        media_player.handle_mouse_down(event.pos)
+    
+    elif event.type == pygame.MOUSEBUTTONUP:
+        media_player.handle_mouse_up()
+    
+    elif event.type == pygame.MOUSEMOTION:
+        media_player.handle_mouse_motion(event.pos)
+    
+    elif event.type == pygame.VIDEORESIZE:
+        media_player.render_manager.resize_request()
+
+def coalesce_motion(events):                    #Collapse each run of consecutive MOUSEMOTION events into its last one -- clicks keep their place between runs, so a drag still ends where it was let go
+    coalesced = []
+    for event in events:
+        if event.type == pygame.MOUSEMOTION and coalesced and coalesced[-1].type == pygame.MOUSEMOTION:
+            coalesced[-1] = event
+        else:
+            coalesced.append(event)
+    return coalesced
+
+def run_frame(media_player, scheduler, events):             #One pass of the main loop -- handle a batch of events (motion coalesced), apply input, do background work, draw, check playback
+    for event in coalesce_motion(events):
+        handle_event(media_player, scheduler, event)
+    media_player.apply_input()
+
+    if media_player.playlist_manager.search_pending():         #Catch the search index up a chunk at a time
+        if not media_player.playlist_manager.build_search_index() and media_player.search.active:
+            media_player.search_request()                           #Results so far came from a partial index
+    if media_player.search.deadline is not None:
+        media_player.search_update()
+
+    if media_player.render_manager.resize_deadline is not None:
+        media_player.resize_update()
+    if scheduler.visible and media_player.render_manager.resize_deadline is None:          #Skip drawing entirely while hidden or minimized, or mid resize
+        media_player.update()
+    media_player.progress()
+    media_player.session_update()
+
+async def main_loop(media_player):         #Run the frame loop as the main task -- other threads reach it through post_event, blocking work goes to the executor
+    scheduler = FrameScheduler()
+    scheduler.attach(asyncio.get_running_loop())
+
+    control_server = ControlServer(media_player, scheduler)
+    try:
+        await control_server.start()
+    except OSError as error:
+        print("Control socket unavailable: " + str(error))
+
+    try:
+        while True:
+            events = await scheduler.next_events(media_player.is_animating(), media_player.get_tick_interval(scheduler.focused))
+            run_frame(media_player, scheduler, events)
+            if any(event.type in ControlServer.STATUS_EVENTS for event in events):
+                control_server.publish()
+            if profiler.enabled:
+                profiler.frame_end()
+            if not startup.reported:
+                startup_progress(media_player)
+    finally:
+        control_server.close()
+        scheduler.detach()
+
+def startup_progress(media_player):             #Called after each frame until startup is reported -- starts background services after the first frame, then prints the phase report
+    if 'first_frame' not in startup.marks:
+        startup.mark('first_frame')
+        media_player.start_services()
+
+    if startup.done() or startup.marks['first_frame'] + STARTUP_REPORT_TIMEOUT_MS < (time.perf_counter() - START_TIME) * 1000:
+        startup.reported = True
+        print(startup.summary())
+        if STARTUP_REPORT:
+            print(json.dumps(startup.report()))
+            media_player.quit()
+
+def main():             #Create the media player (first track playing before asyncio is even imported), then run it on an asyncio event loop, rendering stays on this (the main) thread
+    startup.mark('imports')
+    media_player = MediaPlayer()
+    asyncio.run(main_loop(media_player))
+
+if __name__ == '__main__':              #Guarded, waveform workers import this file
+    if '--headless' in sys.argv:            #Run without a display or sound card
+        sys.argv.remove('--headless')
+        headless_init()
+
+    if '--startup-report' in sys.argv:      #Exit with the startup timings as JSON once the player is up
+        sys.argv.remove('--startup-report')
+        STARTUP_REPORT = True
+
+    if len(sys.argv) > 2 and sys.argv[1] == '--bench':             #Run a named benchmark instead of the player
+        BENCHMARKS[sys.argv[2]](*sys.argv[3:])
+    elif len(sys.argv) > 2 and sys.argv[1] == '--ctl':             #Send a command to a running player
+        control_client(*sys.argv[2:])
+    else:
+        main()              #Call main